@@ -0,0 +1,240 @@
+"""
+# JSSS benchmark suite
+Measure preprocessing, dataset build, item loading and DataLoader throughput on a synthetic JSSS-shaped corpus.
+Runs offline (no corpus download) in a temporary working directory.
+
+Usage:
+    python -m benchmarks.bench --subtypes short-form/voiceactress100 long-form/washington-dc --workers 1 2 4
+"""
+
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional
+import argparse
+from contextlib import contextmanager
+import json
+import os
+from pathlib import Path
+import pickle
+import random
+import shutil
+import tempfile
+import threading
+import time
+
+import numpy as np
+from torch import Tensor
+from torch.utils.data import DataLoader, Dataset
+
+from jsss.corpus import JSSS
+from jsss.PyTorch.dataset.shard import Storage
+from jsss.PyTorch.dataset.spectrogram import JSSS_spec, preprocess_as_spec
+from jsss.PyTorch.dataset.waveform import JSSS_wave, preprocess_as_wave
+from benchmarks.synthetic import generate_corpus
+
+
+class Result(NamedTuple):
+    """Benchmark row. Latency percentiles are None for bulk operations, and peak RSS is of the row itself."""
+    name: str
+    n_items: int
+    sec: float
+    n_bytes: int
+    p50_ms: Optional[float]
+    p99_ms: Optional[float]
+    peak_rss_mb: float
+
+    def __str__(self) -> str:
+        latency = lambda ms: f"{ms:>8.2f} ms" if ms is not None else f"{'-':>8}   "
+        return (f"{self.name:<40} {self.n_items / self.sec:>10.1f} items/s {self.n_bytes / self.sec / 1e6:>9.1f} MB/s"
+            f" p50 {latency(self.p50_ms)}  p99 {latency(self.p99_ms)}  peakRSS {self.peak_rss_mb:>8.1f} MB")
+
+
+def _status_kb(pid: int, field: str) -> int:
+    """A memory field (e.g. `VmRSS`) of /proc/<pid>/status [KiB] (0 if the process is gone)."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(f"{field}:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def _descendants(pid: int) -> List[int]:
+    pids: List[int] = []
+    try:
+        for task in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{task}/children") as f:
+                pids += [int(child) for child in f.read().split()]
+    except OSError:
+        return []
+    return pids + [grandchild for child in pids for grandchild in _descendants(child)]
+
+
+@contextmanager
+def _peak_rss(result: List[float], interval: float = 0.01) -> Iterator[None]:
+    """Peak RSS of a measurement [MB], this process (kernel high-water mark, reset at start) + child processes (sampled).
+
+    Linux only (/proc). Each measurement reports its own peak, not the peak of the whole run.
+    """
+
+    pid = os.getpid()
+    try:
+        # Reset the high-water mark (VmHWM) of this process.
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+    peak_children = [0]
+    done = threading.Event()
+    def sample() -> None:
+        while not done.wait(interval):
+            peak_children[0] = max(peak_children[0], sum(_status_kb(child, "VmRSS") for child in _descendants(pid)))
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    try:
+        yield
+    finally:
+        done.set()
+        sampler.join()
+        result.append((max(_status_kb(pid, "VmHWM"), _status_kb(pid, "VmRSS")) + peak_children[0]) / 1024)
+
+
+def _nbytes(datum) -> int:
+    return sum(field.numel() * field.element_size() for field in datum if isinstance(field, Tensor))
+
+
+def measure(name: str, fn: Callable[[], int], n_items: int) -> Result:
+    """Measure a bulk operation, which returns processed bytes (per-item latency is not available)."""
+    peak: List[float] = []
+    with _peak_rss(peak):
+        start = time.perf_counter()
+        n_bytes = fn()
+        sec = time.perf_counter() - start
+    return Result(name, n_items, sec, n_bytes, None, None, peak[0])
+
+
+def measure_items(name: str, fns: List[Callable[[], int]]) -> Result:
+    """Measure per-item operations, each of which returns processed bytes."""
+    latencies: List[float] = []
+    n_bytes = 0
+    peak: List[float] = []
+    with _peak_rss(peak):
+        for fn in fns:
+            start = time.perf_counter()
+            n_bytes += fn()
+            latencies.append(time.perf_counter() - start)
+    p50, p99 = np.percentile(latencies, [50, 99]) * 1000
+    return Result(name, len(fns), sum(latencies), n_bytes, float(p50), float(p99), peak[0])
+
+
+def bench_preprocess(corpus: JSSS, subtypes: List[str]) -> List[Result]:
+    ids = corpus.get_index().get_ids(corpus.get_index().select(subtypes))
+    dir_out = Path("bench_preprocess")
+    results = []
+    for name, preprocess in [("preprocess_as_wave", preprocess_as_wave), ("preprocess_as_spec", preprocess_as_spec)]:
+        def item(id, preprocess=preprocess) -> Callable[[], int]:
+            path = corpus.get_item_path(id)
+            return lambda: (preprocess(path, id, dir_out), os.path.getsize(path))[1]
+        results.append(measure_items(name, [item(id) for id in ids]))
+    shutil.rmtree(dir_out)
+    return results
+
+
+def bench_build(cls: Callable[..., Dataset], name: str, n_workers: int, n_items: int, wav_bytes: int) -> Result:
+    # Cold build: no dataset contents, no build cache
+    shutil.rmtree("tmp", ignore_errors=True)
+    return measure(f"build {name} (workers={n_workers})", lambda: (cls(n_workers=n_workers).prepare(), wav_bytes)[1], n_items)
+
+
+def bench_startup(cls: Callable[..., Dataset], name: str) -> List[Result]:
+    # Lazy construction (no I/O), and pickled size of the prepared dataset (sent to each spawned DataLoader worker)
+    results = [measure(f"construct {name}", lambda: (cls(), 0)[1], 1)]
+    dataset = cls()
+    dataset.prepare()
+    results.append(measure(f"pickle {name}", lambda: len(pickle.dumps(dataset)), 1))
+    return results
+
+
+def bench_getitem(dataset: Dataset, name: str) -> Result:
+    indices = list(range(len(dataset)))
+    random.Random(0).shuffle(indices)
+    return measure_items(f"{name}.__getitem__", [lambda i=i: _nbytes(dataset[i]) for i in indices])
+
+
+def bench_loader(dataset: Dataset, name: str, num_workers: int) -> Result:
+    def epoch() -> int:
+        loader = DataLoader(dataset, batch_size=None, shuffle=True, num_workers=num_workers)
+        return sum(_nbytes(datum) for datum in loader)
+    return measure(f"DataLoader {name} (workers={num_workers})", epoch, len(dataset))
+
+
+def bench_datamodule(corpus_adress: str, subtypes: List[str]) -> Optional[Result]:
+    try:
+        from jsss.PyTorch.Lightning.datamodule.spectrogram import JSSS_spec_DataModule
+    except ImportError:
+        return None
+    dm = JSSS_spec_DataModule(8, False, subtypes, corpus_adress=corpus_adress, bucketing=True)
+    dm.prepare_data()
+    dm.setup("fit")
+    def epoch() -> int:
+        return sum(_nbytes(batch.data) for batch in dm.train_dataloader())
+    return measure("JSSS_spec_DataModule train (batch=8, bucketing)", epoch, len(dm.data_train))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--subtypes", nargs="+", default=["short-form/voiceactress100", "long-form/washington-dc"])
+    parser.add_argument("--workers", nargs="+", type=int, default=[1, 2, 4])
+    parser.add_argument("--sec-short", type=float, default=3.0, help="Mean duration of short items [sec]")
+    parser.add_argument("--sec-long", type=float, default=30.0, help="Mean duration of long-form items [sec]")
+    parser.add_argument("--json", type=Path, default=None, help="Write results as JSON")
+    args = parser.parse_args()
+
+    cwd = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix="jsss_bench_")
+    os.chdir(workdir)
+    try:
+        path_archive = Path(workdir) / "synthetic" / "jsss_ver1.zip"
+        wav_bytes = generate_corpus(path_archive, args.subtypes, args.sec_short, args.sec_long)
+        corpus_adress = str(path_archive)
+        corpus = JSSS(corpus_adress)
+        results: List[Result] = []
+
+        n_items = len(corpus.get_index().select(args.subtypes))
+        results.append(measure("extract corpus", lambda: (corpus.get_contents(args.subtypes), wav_bytes)[1], n_items))
+        results += bench_preprocess(corpus, args.subtypes)
+
+        datasets: Dict[str, Callable[..., Dataset]] = {
+            "JSSS_wave": lambda **kwargs: JSSS_wave(None, args.subtypes, corpus_adress=corpus_adress, **kwargs),
+            "JSSS_spec": lambda **kwargs: JSSS_spec(True, None, args.subtypes, corpus_adress=corpus_adress, **kwargs),
+            "JSSS_wave[int16]": lambda **kwargs: JSSS_wave(None, args.subtypes, corpus_adress=corpus_adress, storage=Storage("int16"), **kwargs),
+            "JSSS_spec[log-float16]": lambda **kwargs: JSSS_spec(True, None, args.subtypes, corpus_adress=corpus_adress,
+                spec_storage=Storage("float16", log=True), wave_storage=Storage("int16"), **kwargs),
+        }
+        for name, cls in datasets.items():
+            for n_workers in args.workers:
+                results.append(bench_build(cls, name, n_workers, n_items, wav_bytes))
+            results += bench_startup(cls, name)
+            # Warm (built) dataset
+            dataset = cls()
+            dataset.prepare()
+            results.append(bench_getitem(dataset, name))
+            for num_workers in [0] + args.workers:
+                results.append(bench_loader(dataset, name, num_workers))
+        result_dm = bench_datamodule(corpus_adress, args.subtypes)
+        if result_dm is not None:
+            results.append(result_dm)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print()
+    for result in results:
+        print(result)
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump([result._asdict() for result in results], f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+from typing import List, Optional, Tuple
+from pathlib import Path
+
+# currently there is no stub in pytorch lightning
+import pytorch_lightning as pl  # type: ignore
+from torch.utils.data import DataLoader, Dataset
+from corpuspy.components.archive import hash_args
+
+from ...dataset.batching import LengthBucketBatchSampler, collate_pad, get_lengths
+from ...dataset.loader import LoaderConfig, autotune, loader_kwargs
+from ...dataset.sharded import _JSSS_sharded
+from ....corpus import Subtype
+from ....split import Split, get_split
+
+
+class _JSSS_DataModule(pl.LightningDataModule):
+    """
+    Split and DataLoader plumbing shared by JSSS DataModules
+
+    Subclass sets `data_train`/`data_val`/`data_test` in `setup`.
+    """
+
+    def __init__(
+        self,
+        batch_size: int,
+        subtypes: List[Subtype],
+        bucketing: bool,
+        max_frames: Optional[int],
+        loader_config: LoaderConfig,
+        split_ratios: Tuple[float, float, float],
+        split_seed: int,
+    ):
+        super().__init__()
+        self.n_batch = batch_size
+        self._subtypes = subtypes
+        self._bucketing = bucketing
+        self._max_frames = max_frames
+        self._loader_config = loader_config
+        self._split_ratios = split_ratios
+        self._split_seed = split_seed
+
+    def _split(self, dataset: _JSSS_sharded) -> Split:
+        """Split items of the dataset, seeded and persisted, so all ranks and runs have the same split."""
+        # Index rows come from the dataset without I/O, so ranks never touch the corpus index file.
+        index, item_rows = dataset.get_index_rows()
+        split_hash = hash_args(self._subtypes, self._split_ratios, self._split_seed)
+        return get_split(Path(".")/"tmp"/"JSSS_split"/f"{split_hash}.npz", index, item_rows,
+            self._split_ratios, self._split_seed)
+
+    def _loader(self, dataset: Dataset, shuffle: bool, config: Optional[LoaderConfig] = None) -> DataLoader:
+        kwargs = loader_kwargs(config if config is not None else self._loader_config)
+        if not self._bucketing:
+            return DataLoader(dataset, batch_size=self.n_batch, shuffle=shuffle, **kwargs)
+        batch_size = self.n_batch if self._max_frames is None else None
+        sampler = LengthBucketBatchSampler(get_lengths(dataset), batch_size, self._max_frames, shuffle)
+        return DataLoader(dataset, batch_sampler=sampler, collate_fn=collate_pad, **kwargs)
+
+    def autotune_loader(self, candidates: Optional[List[LoaderConfig]] = None, n_batch: int = 20) -> LoaderConfig:
+        """Pick DataLoader knobs with a short throughput probe on the train dataset (after `setup("fit")`).
+
+        Args:
+            candidates: Candidate configs. None use `default_candidates`.
+            n_batch: Number of probed batches of each candidate.
+        Returns:
+            Selected config, which is used by subsequent dataloaders.
+        """
+        self._loader_config = autotune(lambda config: self._loader(self.data_train, True, config), candidates, n_batch)
+        return self._loader_config
+
+    def train_dataloader(self, *args, **kwargs):
+        return self._loader(self.data_train, True)
+
+    def val_dataloader(self, *args, **kwargs):
+        return self._loader(self.data_val, False)
+
+    def test_dataloader(self, *args, **kwargs):
+        return self._loader(self.data_test, False)
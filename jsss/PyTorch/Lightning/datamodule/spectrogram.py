@@ -1,16 +1,21 @@
-from typing import Callable, List, Optional, Union
+from typing import Callable, List, Optional, Tuple, Union
 
-import pytorch_lightning as pl
 from torch.tensor import Tensor
-from torch.utils.data import random_split, DataLoader
+from torch.utils.data import Subset
 
+from ...dataset.loader import LoaderConfig, identity
+from ...dataset.pipeline import SpecConfig
 from ...dataset.spectrogram import JSSS_spec
 from ....corpus import Subtype
+from .base import _JSSS_DataModule
 
 
-class JSSS_spec_DataModule(pl.LightningDataModule):
+class JSSS_spec_DataModule(_JSSS_DataModule):
     """
     JSSS_spec dataset's PyTorch Lightning datamodule
+
+    Dataset is built/fetched in `prepare_data` (once per node), and `setup` only loads it.
+    For DDP with bucketing, use `Trainer(replace_sampler_ddp=False)`, because the bucket sampler shards batches by itself.
     """
 
     def __init__(
@@ -18,41 +23,69 @@ class JSSS_spec_DataModule(pl.LightningDataModule):
         batch_size: int,
         download: bool,
         subtypes: List[Subtype] = ["short-form/basic5000"],
-        transform: Callable[[Tensor], Tensor] = lambda i: i,
+        transform: Callable[[Tensor], Tensor] = identity,
         corpus_adress: Optional[str] = None,
         dataset_dir_adress: Optional[str] = None,
         resample_sr: Optional[int] = None,
+        bucketing: bool = False,
+        max_frames: Optional[int] = None,
+        segment_length: Optional[int] = None,
+        online: bool = False,
+        spec_config: SpecConfig = SpecConfig(),
+        loader_config: LoaderConfig = LoaderConfig(),
+        split_ratios: Tuple[float, float, float] = (0.9, 0.05, 0.05),
+        split_seed: int = 0,
+        normalize: Optional[str] = None,
     ):
-        super().__init__()
-        self.n_batch = batch_size
+        """
+        Args:
+            bucketing: If True, batch length-bucketed items with padding (batch become `PaddedBatch`).
+            max_frames: If not None, bucketed batch is frame-budgeted (padded frames per batch) instead of `batch_size`.
+            segment_length: If not None, items are random segments of the length [frame].
+            online: If True, spectrograms are computed on load from stored waveforms.
+            spec_config: STFT/mel parameters (non-default parameters need online mode).
+            loader_config: DataLoader performance knobs (workers, pinning, prefetch). Can be tuned by `autotune_loader`.
+            split_ratios: Ratios of train/val/test split (stratified by subtype).
+            split_seed: Random seed of the split.
+            normalize: If not None, spectrograms are normalized per frequency with the train split statistics,
+                `linear` or `log` (log spectrogram). Statistics come with the dataset, so no extra pass is needed.
+        """
+        super().__init__(batch_size, subtypes, bucketing, max_frames, loader_config, split_ratios, split_seed)
         self.download = download
-        self._subtypes = subtypes
         self.transform = transform
         self.corpus_adress = corpus_adress
         self._dataset_dir_adress = dataset_dir_adress
         self._resample_sr = resample_sr
+        self._segment_length = segment_length
+        self._dataset_all: Optional[JSSS_spec] = None
+        self._online = online
+        self._spec_config = spec_config
+        self._normalize = normalize
+
+    def _dataset(self, upload_archive: bool = False) -> JSSS_spec:
+        return JSSS_spec(True, self._resample_sr, self._subtypes, self.download,
+            self.corpus_adress, self._dataset_dir_adress, self.transform,
+            segment_length=self._segment_length, online=self._online, spec_config=self._spec_config,
+            upload_archive=upload_archive)
 
     def prepare_data(self, *args, **kwargs) -> None:
-        pass
+        # Called on local rank zero of each node. Concurrent builds are serialized by the dataset's file lock.
+        # Only the global rank zero uploads generated archive, so nodes do not race to upload.
+        trainer = getattr(self, "trainer", None)
+        self._dataset(upload_archive=getattr(trainer, "is_global_zero", True)).prepare()
 
     def setup(self, stage: Union[str, None] = None) -> None:
-        if stage == "fit" or stage is None:
-            dataset_train = JSSS_spec(True, self._resample_sr, self._subtypes, self.download,
-                self.corpus_adress, self._dataset_dir_adress, self.transform)
-            n_train = len(dataset_train)
-            self.data_train, self.data_val = random_split(dataset_train, [n_train - 10, 10])
-        if stage == "test" or stage is None:
-            self.data_test = JSSS_spec(True, self._resample_sr, self._subtypes, self.download,
-                self.corpus_adress, self._dataset_dir_adress, self.transform)
-
-    def train_dataloader(self, *args, **kwargs):
-        return DataLoader(self.data_train, batch_size=self.n_batch)
-
-    def val_dataloader(self, *args, **kwargs):
-        return DataLoader(self.data_val, batch_size=self.n_batch)
-
-    def test_dataloader(self, *args, **kwargs):
-        return DataLoader(self.data_test, batch_size=self.n_batch)
+        # Read-only: dataset contents are deployed by `prepare_data`.
+        # All stages are views of a single dataset instance, so the dataset is constructed only once.
+        if self._dataset_all is None:
+            self._dataset_all = self._dataset()
+            # Contents are already deployed, so this only opens them (before DataLoader workers start).
+            self._dataset_all.prepare()
+            split = self._split(self._dataset_all)
+            if self._normalize is not None:
+                # All stages are normalized with the train split statistics (no leak from val/test).
+                self._dataset_all.set_normalization(self._dataset_all.get_stats(split.train.tolist()), self._normalize)
+            self.data_train, self.data_val, self.data_test = (Subset(self._dataset_all, rows.tolist()) for rows in split)
 
 
 if __name__ == "__main__":
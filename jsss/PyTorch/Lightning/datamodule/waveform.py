@@ -1,17 +1,20 @@
-from typing import Callable, List, Optional, Union
+from typing import Callable, List, Optional, Tuple, Union
 
-# currently there is no stub in pytorch lightning
-import pytorch_lightning as pl  # type: ignore
 from torch.tensor import Tensor
-from torch.utils.data import random_split, DataLoader
+from torch.utils.data import Subset
 
+from ...dataset.loader import LoaderConfig, identity
 from ...dataset.waveform import JSSS_wave
 from ....corpus import Subtype
+from .base import _JSSS_DataModule
 
 
-class NpVCC2016DataModule(pl.LightningDataModule):
+class NpVCC2016DataModule(_JSSS_DataModule):
     """
     npVCC2016 speech corpus's PyTorch Lightning datamodule
+
+    Dataset is built/fetched in `prepare_data` (once per node), and `setup` only loads it.
+    For DDP with bucketing, use `Trainer(replace_sampler_ddp=False)`, because the bucket sampler shards batches by itself.
     """
 
     def __init__(
@@ -20,34 +23,49 @@ class NpVCC2016DataModule(pl.LightningDataModule):
         download: bool,
         subtypes: List[Subtype] = ["short-form/basic5000"],
         resample_sr: Optional[int] = None,
-        transform: Callable[[Tensor], Tensor] = lambda i: i,
+        transform: Callable[[Tensor], Tensor] = identity,
+        bucketing: bool = False,
+        max_frames: Optional[int] = None,
+        segment_length: Optional[int] = None,
+        loader_config: LoaderConfig = LoaderConfig(),
+        split_ratios: Tuple[float, float, float] = (0.9, 0.05, 0.05),
+        split_seed: int = 0,
     ):
-        super().__init__()
-        self.n_batch = batch_size
+        """
+        Args:
+            bucketing: If True, batch length-bucketed items with padding (batch become `PaddedBatch`).
+            max_frames: If not None, bucketed batch is frame-budgeted (padded samples per batch) instead of `batch_size`.
+            segment_length: If not None, items are random segments of the length [sample].
+            loader_config: DataLoader performance knobs (workers, pinning, prefetch). Can be tuned by `autotune_loader`.
+            split_ratios: Ratios of train/val/test split (stratified by subtype).
+            split_seed: Random seed of the split.
+        """
+        super().__init__(batch_size, subtypes, bucketing, max_frames, loader_config, split_ratios, split_seed)
         self.download = download
-        self._subtypes = subtypes
         self.transform = transform
         self._resample_sr = resample_sr
+        self._segment_length = segment_length
+        self._dataset_all: Optional[JSSS_wave] = None
+
+    def _dataset(self, upload_archive: bool = False) -> JSSS_wave:
+        return JSSS_wave(self._resample_sr, self._subtypes, self.download, None, None, self.transform,
+            segment_length=self._segment_length, upload_archive=upload_archive)
 
     def prepare_data(self, *args, **kwargs) -> None:
-        pass
+        # Called on local rank zero of each node. Concurrent builds are serialized by the dataset's file lock.
+        # Only the global rank zero uploads generated archive, so nodes do not race to upload.
+        trainer = getattr(self, "trainer", None)
+        self._dataset(upload_archive=getattr(trainer, "is_global_zero", True)).prepare()
 
     def setup(self, stage: Union[str, None] = None) -> None:
-        if stage == "fit" or stage is None:
-            dataset_train = JSSS_wave(self._resample_sr, self._subtypes, self.download, None, None, self.transform)
-            n_train = len(dataset_train)
-            self.data_train, self.data_val = random_split(dataset_train, [n_train - 10, 10])
-        if stage == "test" or stage is None:
-            self.data_test = JSSS_wave(self._resample_sr, self._subtypes, self.download, None, None, self.transform)
-
-    def train_dataloader(self, *args, **kwargs):
-        return DataLoader(self.data_train, batch_size=self.n_batch)
-
-    def val_dataloader(self, *args, **kwargs):
-        return DataLoader(self.data_val, batch_size=self.n_batch)
-
-    def test_dataloader(self, *args, **kwargs):
-        return DataLoader(self.data_test, batch_size=self.n_batch)
+        # Read-only: dataset contents are deployed by `prepare_data`.
+        # All stages are views of a single dataset instance, so the dataset is constructed only once.
+        if self._dataset_all is None:
+            self._dataset_all = self._dataset()
+            # Contents are already deployed, so this only opens them (before DataLoader workers start).
+            self._dataset_all.prepare()
+            split = self._split(self._dataset_all)
+            self.data_train, self.data_val, self.data_test = (Subset(self._dataset_all, rows.tolist()) for rows in split)
 
 
 if __name__ == "__main__":
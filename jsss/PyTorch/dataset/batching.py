@@ -0,0 +1,173 @@
+"""
+# Length-aware batching
+JSSS items vary widely in length (short-form vs long-form), so naive batching wastes most of a padded batch.
+Items are bucketed by their precomputed length (shard index), and padded per batch with lengths/masks.
+"""
+
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Sequence
+import random
+
+import torch
+from torch import Tensor
+import torch.distributed as dist
+from torch.utils.data import Dataset, Sampler, Subset
+
+
+def get_lengths(dataset: Dataset) -> List[int]:
+    """Get time lengths of all items without loading them.
+
+    Args:
+        dataset: JSSS dataset (`get_lengths` provider) or its `Subset`.
+    """
+
+    if isinstance(dataset, Subset):
+        lengths = get_lengths(dataset.dataset)
+        return [lengths[i] for i in dataset.indices]
+    return dataset.get_lengths() # type: ignore
+
+
+def pack_by_frames(indices: Sequence[int], lengths: Sequence[int], max_frames: int, max_items: Optional[int] = None) -> List[List[int]]:
+    """Greedily pack length-sorted items into frame-budgeted batches.
+
+    Args:
+        indices: Item indices sorted by length in ascending order.
+        lengths: Time length of each item (indexed by item index).
+        max_frames: Upper bound of padded frames (max length x batch size) in a batch. Item longer than it is a batch alone.
+        max_items: Upper bound of items in a batch. None is unbounded.
+    Returns:
+        Batches of item indices, in input order.
+    """
+
+    batches: List[List[int]] = []
+    batch: List[int] = []
+    for idx in indices:
+        # Sorted ascending, so the new item is the longest in the batch.
+        full = max_items is not None and len(batch) == max_items
+        if len(batch) > 0 and (full or lengths[idx] * (len(batch) + 1) > max_frames):
+            batches.append(batch)
+            batch = []
+        batch.append(idx)
+    if len(batch) > 0:
+        batches.append(batch)
+    return batches
+
+
+class LengthBucketBatchSampler(Sampler):
+    """Batch sampler which groups items with similar length.
+
+    Items are sorted by length (ties broken randomly), chunked into batches, then batch order is shuffled.
+    Batch is fixed-size (`batch_size`) or frame-budgeted (`max_frames`, padded length x batch size).
+
+    In distributed training, all replicas make the same batches (same seed and epoch), and each replica takes
+    every `num_replicas`-th batch (like `DistributedSampler`). Batches are padded by wrap-around, so that all replicas
+    run the same number of steps. With PyTorch-Lightning, `replace_sampler_ddp=False` keeps this batch sampler.
+    """
+
+    def __init__(
+        self,
+        lengths: Sequence[int],
+        batch_size: Optional[int] = None,
+        max_frames: Optional[int] = None,
+        shuffle: bool = True,
+        seed: int = 0,
+        drop_last: bool = False,
+        num_replicas: Optional[int] = None,
+        rank: Optional[int] = None,
+    ):
+        """
+        Args:
+            lengths: Time length of each item.
+            batch_size: Number of items in a batch.
+            max_frames: Upper bound of padded frames (max length x batch size) in a batch. Used if `batch_size` is None.
+            shuffle: Whether to shuffle batch order and tie-break order.
+            seed: Random seed (combined with epoch).
+            drop_last: Whether to drop the last incomplete batch (fixed-size mode only).
+            num_replicas: Number of distributed replicas. None use world size if distributed is initialized, else 1.
+            rank: Rank of this replica. None use the process rank if distributed is initialized, else 0.
+        """
+
+        if (batch_size is None) == (max_frames is None):
+            raise ValueError("Specify exactly one of `batch_size` or `max_frames`.")
+        self._lengths = list(lengths)
+        self._batch_size = batch_size
+        self._max_frames = max_frames
+        self._shuffle = shuffle
+        self._seed = seed
+        self._drop_last = drop_last
+        self._epoch = 0
+        distributed = dist.is_available() and dist.is_initialized()
+        self._num_replicas = num_replicas if num_replicas is not None else (dist.get_world_size() if distributed else 1)
+        self._rank = rank if rank is not None else (dist.get_rank() if distributed else 0)
+        if not 0 <= self._rank < self._num_replicas:
+            raise ValueError(f"Invalid rank {self._rank} of {self._num_replicas} replicas.")
+
+    def set_epoch(self, epoch: int) -> None:
+        """Set epoch for shuffle (like `DistributedSampler.set_epoch`)."""
+        self._epoch = epoch
+
+    def _batches(self) -> List[List[int]]:
+        rng = random.Random(self._seed + self._epoch)
+        tiebreak = [rng.random() for _ in self._lengths] if self._shuffle else [0.0] * len(self._lengths)
+        indices = sorted(range(len(self._lengths)), key=lambda i: (self._lengths[i], tiebreak[i]))
+
+        if self._batch_size is not None:
+            batches = [indices[i : i + self._batch_size] for i in range(0, len(indices), self._batch_size)]
+            if self._drop_last and len(batches) > 0 and len(batches[-1]) < self._batch_size:
+                batches.pop()
+        else:
+            batches = pack_by_frames(indices, self._lengths, self._max_frames)
+
+        if self._shuffle:
+            rng.shuffle(batches)
+        if self._num_replicas > 1 and len(batches) > 0:
+            # Wrap-around padding to equal steps, then interleaved sharding.
+            n_total = -(-len(batches) // self._num_replicas) * self._num_replicas
+            batches = (batches * (n_total // len(batches) + 1))[:n_total]
+            batches = batches[self._rank :: self._num_replicas]
+        return batches
+
+    def __iter__(self) -> Iterator[List[int]]:
+        batches = self._batches()
+        # Reshuffle in next epoch even if `set_epoch` is not called.
+        self._epoch += 1
+        return iter(batches)
+
+    def __len__(self) -> int:
+        return len(self._batches())
+
+
+class PaddedBatch(NamedTuple):
+    """Batch of padded data.
+
+    data: Batched datum (same type as dataset's datum). Tensor fields are zero-padded along time (last) axis and stacked.
+    lengths: Original time lengths of each Tensor field :: Dict[field, [Batch,]]
+    masks: Valid-frame masks of each Tensor field :: Dict[field, [Batch, Time]]
+    """
+
+    data: Any
+    lengths: Dict[str, Tensor]
+    masks: Dict[str, Tensor]
+
+
+def collate_pad(data: List[Any]) -> PaddedBatch:
+    """Collate variable-length datum (NamedTuple) into PaddedBatch.
+
+    Non-Tensor fields (e.g. label) are collected into list.
+    """
+
+    fields: Dict[str, Any] = {}
+    lengths: Dict[str, Tensor] = {}
+    masks: Dict[str, Tensor] = {}
+    for name in data[0]._fields:
+        values = [getattr(datum, name) for datum in data]
+        if not isinstance(values[0], Tensor):
+            fields[name] = values
+            continue
+        length = torch.tensor([value.size(-1) for value in values])
+        padded = values[0].new_zeros((len(values), *values[0].shape[:-1], int(length.max())))
+        for i, value in enumerate(values):
+            padded[i, ..., : value.size(-1)] = value
+        fields[name] = padded
+        lengths[name] = length
+        masks[name] = torch.arange(int(length.max())).unsqueeze(0) < length.unsqueeze(1)
+    return PaddedBatch(type(data[0])(**fields), lengths, masks)
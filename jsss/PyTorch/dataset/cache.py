@@ -0,0 +1,181 @@
+"""
+# RAM cache tier
+Opt-in in-memory cache of item features, which makes small-subtype epochs memory-bound instead of I/O-bound.
+
+- `LRUCache`: byte-budgeted LRU cache in each process
+- `SharedCache`: full preload into shared memory, read by all DataLoader workers without duplication
+
+Hit/miss counters live in shared memory (one row per worker), so statistics are aggregated over workers.
+"""
+
+from typing import Callable, Dict, Hashable, Iterable, List, NamedTuple, Optional, Tuple
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+import threading
+
+import torch
+from torch import Tensor
+from torch.utils.data import get_worker_info
+
+from .shard import ShardReader
+from ... import profiling
+from ...corpus import ItemIdJSSS
+
+
+# Counter rows: main process + DataLoader workers
+_n_counter_row = 129
+
+
+class CacheStats(NamedTuple):
+    hits: int
+    misses: int
+    n_items: int
+    n_bytes: int
+
+
+class RAMCache(ABC):
+    """Base of RAM caches.
+    """
+
+    def __init__(self):
+        # [hit, miss] counts of each process
+        self._counts = torch.zeros(_n_counter_row, 2, dtype=torch.int64).share_memory_()
+        # Counter update (read-modify-write) is not atomic among threads of a process (e.g. `PrefetchDataset`).
+        self._counts_lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_counts_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._counts_lock = threading.Lock()
+
+    def _record(self, hit: bool) -> None:
+        worker_info = get_worker_info()
+        row = (worker_info.id + 1) % _n_counter_row if worker_info is not None else 0
+        with self._counts_lock:
+            self._counts[row, 0 if hit else 1] += 1
+        profiling.count("cache.hit" if hit else "cache.miss")
+
+    @abstractmethod
+    def get(self, key: Hashable, load: Callable[[], Tensor]) -> Tensor:
+        """Get the cached tensor, or load (and cache) it."""
+
+    @abstractmethod
+    def _size(self) -> Tuple[int, int]:
+        """Number of cached items and their bytes in this process."""
+
+    def stats(self) -> CacheStats:
+        """Get hit/miss counts aggregated over all workers, and size of the cache in this process."""
+        hits, misses = self._counts.sum(dim=0).tolist()
+        return CacheStats(hits, misses, *self._size())
+
+
+class LRUCache(RAMCache):
+    """Byte-budgeted LRU cache (per process, thread-safe for `PrefetchDataset` threads).
+    """
+
+    def __init__(self, max_bytes: int):
+        """
+        Args:
+            max_bytes: Upper bound of cached tensor bytes in a process.
+        """
+        super().__init__()
+        self._max_bytes = max_bytes
+        self._n_bytes = 0
+        self._items: "OrderedDict[Hashable, Tensor]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, load: Callable[[], Tensor]) -> Tensor:
+        with self._lock:
+            if key in self._items:
+                self._record(True)
+                self._items.move_to_end(key)
+                return self._items[key]
+            self._record(False)
+        # Materialize (e.g. memmap view) so that the cache really holds the data. Loaded outside the lock (concurrent reads).
+        tensor = load().clone()
+        n_bytes = tensor.numel() * tensor.element_size()
+        with self._lock:
+            if n_bytes <= self._max_bytes and key not in self._items:
+                while self._n_bytes + n_bytes > self._max_bytes:
+                    _, evicted = self._items.popitem(last=False)
+                    self._n_bytes -= evicted.numel() * evicted.element_size()
+                self._items[key] = tensor
+                self._n_bytes += n_bytes
+        return tensor
+
+    def _size(self) -> Tuple[int, int]:
+        return len(self._items), self._n_bytes
+
+
+class SharedCache(RAMCache):
+    """Fully-preloaded cache in shared memory.
+
+    Items are packed into one shared buffer per dtype (not a shared segment per item), so worker spawn stays cheap.
+    Preload should be done before DataLoader workers start.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._buffers: Dict[torch.dtype, Tensor] = {}
+        self._entries: Dict[Hashable, Tuple[torch.dtype, int, torch.Size]] = {}
+
+    def preload(self, keys: Iterable[Hashable], load: Callable[[Hashable], Tensor]) -> None:
+        """Load all items into shared memory."""
+
+        groups: Dict[torch.dtype, List[Tensor]] = {}
+        offsets: Dict[torch.dtype, int] = {}
+        for key in keys:
+            tensor = load(key)
+            offset = offsets.get(tensor.dtype, 0)
+            self._entries[key] = (tensor.dtype, offset, tensor.shape)
+            groups.setdefault(tensor.dtype, []).append(tensor.reshape(-1))
+            offsets[tensor.dtype] = offset + tensor.numel()
+        self._buffers = {dtype: torch.cat(tensors).share_memory_() for dtype, tensors in groups.items()}
+
+    def get(self, key: Hashable, load: Callable[[], Tensor]) -> Tensor:
+        if key not in self._entries:
+            self._record(False)
+            return load()
+        self._record(True)
+        dtype, offset, shape = self._entries[key]
+        numel = 1
+        for size in shape:
+            numel *= size
+        return self._buffers[dtype][offset : offset + numel].view(shape)
+
+    def _size(self) -> Tuple[int, int]:
+        return len(self._entries), sum(buffer.numel() * buffer.element_size() for buffer in self._buffers.values())
+
+
+def read_cached(
+    cache: Optional[RAMCache],
+    reader: ShardReader,
+    feature: str,
+    id: ItemIdJSSS,
+    start: int = 0,
+    length: Optional[int] = None,
+) -> Tensor:
+    """Read a time range of an item feature through the cache.
+
+    The whole item is cached, so that random segments of the item hit the cache.
+    Cached tensors are shared among accesses, so they should not be modified in-place.
+    """
+
+    if cache is None:
+        return reader.get(id.serial_num, start, length)
+    item = cache.get((feature, id.subtype, id.serial_num), lambda: reader.get(id.serial_num))
+    end = item.size(-1) if length is None else min(start + length, item.size(-1))
+    return item[..., start:end]
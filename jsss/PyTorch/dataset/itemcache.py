@@ -0,0 +1,73 @@
+"""
+# Per-item build cache
+Preprocessing outputs are cached per (subtype, item, preprocessing config), independent of subtype selection.
+Builds skip cached items, resume after interruption, and share work among overlapping subtype selections.
+
+Item files are written atomically by the pipeline, so an existing file is always complete.
+The manifest records committed items, so that a build does not need to stat every item file.
+Manifest update is locked, so concurrent builders (e.g. JSSS_wave and JSSS_spec) do not lose each other's records.
+
+The cache (`tmp/JSSS_cache`) is not a part of dataset contents: datasets read only packed shards.
+It costs disk (float32 features) for resumable/shared builds, and can be deleted as a whole at any time
+(next build preprocesses the items again).
+"""
+
+from typing import Any, Dict, List, Set
+import json
+from pathlib import Path
+
+from corpuspy.components.archive import hash_args
+
+from .pipeline import Stage
+from ...corpus import ItemIdJSSS
+from ...lock import file_lock
+
+
+class ItemCache:
+    """Per-item preprocessing output cache of a preprocessing config.
+    """
+
+    def __init__(self, root: Path, **config: Any):
+        """
+        Args:
+            root: Root directory of caches.
+            config: Preprocessing config (e.g. `resample_sr`), which identifies the cache.
+        """
+
+        self.dir = root / hash_args(*sorted(config.items()))
+        self._path_manifest = self.dir / "manifest.json"
+        self._config = config
+        self._committed: Dict[str, Set[str]] = self._load_manifest()
+
+    def _load_manifest(self) -> Dict[str, Set[str]]:
+        if not self._path_manifest.exists():
+            return {}
+        with open(self._path_manifest) as f:
+            return {name: set(keys) for name, keys in json.load(f)["items"].items()}
+
+    @staticmethod
+    def _key(id: ItemIdJSSS) -> str:
+        return f"{id.subtype}/{id.serial_num}"
+
+    def _is_cached(self, id: ItemIdJSSS, stage: Stage) -> bool:
+        # Items of interrupted build are not in manifest, but their files exist.
+        return self._key(id) in self._committed.get(stage.name, set()) or stage.get_path(self.dir, id).exists()
+
+    def missing(self, ids: List[ItemIdJSSS], stages: List[Stage]) -> List[ItemIdJSSS]:
+        """Get items which lack output of any stage."""
+        return [id for id in ids if not all(self._is_cached(id, stage) for stage in stages)]
+
+    def commit(self, ids: List[ItemIdJSSS], stages: List[Stage]) -> None:
+        """Record items as cached in the manifest."""
+
+        with file_lock(self.dir / "manifest.lock"):
+            # Merge records committed by other builders since load.
+            for name, keys in self._load_manifest().items():
+                self._committed.setdefault(name, set()).update(keys)
+            for stage in stages:
+                self._committed.setdefault(stage.name, set()).update(map(self._key, ids))
+            path_tmp = self._path_manifest.with_name(self._path_manifest.name + ".tmp")
+            with open(path_tmp, "w") as f:
+                items = {name: sorted(keys) for name, keys in self._committed.items()}
+                json.dump({"config": {k: str(v) for k, v in self._config.items()}, "items": items}, f)
+            path_tmp.replace(self._path_manifest)
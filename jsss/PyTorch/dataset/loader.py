@@ -0,0 +1,134 @@
+"""
+# DataLoader performance knobs
+Loading (shard read, segment crop, online feature, collate) runs in DataLoader workers instead of the training process.
+`autotune` picks the knobs by a short throughput probe on the actual dataset and machine.
+"""
+
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+import os
+import random
+import time
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader
+
+
+def identity(tensor: torch.Tensor) -> torch.Tensor:
+    """Identity transform, default of datasets (picklable into spawned DataLoader workers, unlike a lambda)."""
+    return tensor
+
+
+def seed_worker(worker_id: int) -> None:
+    """Seed `random`/`numpy` of a DataLoader worker from its torch seed (different among workers and epochs).
+
+    Without this, forked workers share the parent RNG state and yield the same random segments.
+    """
+
+    seed = torch.initial_seed() % 2 ** 32
+    random.seed(seed)
+    np.random.seed(seed)
+
+
+class LoaderConfig(NamedTuple):
+    """DataLoader performance knobs.
+
+    Args:
+        num_workers: Number of loading worker processes. 0 load in the training process.
+        pin_memory: Whether to pin batches in page-locked memory (faster host-to-GPU copy).
+        prefetch_factor: Number of batches prefetched by each worker.
+        persistent_workers: Whether to keep workers (and their memmaps/caches) alive among epochs.
+        worker_init_fn: Worker initializer.
+    """
+
+    num_workers: int = 0
+    pin_memory: bool = False
+    prefetch_factor: int = 2
+    persistent_workers: bool = False
+    worker_init_fn: Optional[Callable[[int], None]] = seed_worker
+
+
+def loader_kwargs(config: LoaderConfig) -> Dict[str, Any]:
+    """DataLoader keyword arguments of the config (worker-only options are omitted without workers)."""
+
+    kwargs: Dict[str, Any] = {"num_workers": config.num_workers, "pin_memory": config.pin_memory}
+    if config.num_workers > 0:
+        kwargs.update(prefetch_factor=config.prefetch_factor, persistent_workers=config.persistent_workers,
+            worker_init_fn=config.worker_init_fn)
+    return kwargs
+
+
+def default_candidates() -> List[LoaderConfig]:
+    """Candidate configs: worker counts up to CPU cores, prefetch depths and worker persistence, pinned if CUDA is available.
+
+    Ordered from the cheapest (fewer workers, shallower prefetch, non-persistent), which `autotune` prefers on a tie.
+    """
+
+    n_cpu = os.cpu_count() or 1
+    pin = torch.cuda.is_available()
+    n_workers = sorted(set([n for n in [1, 2, 4, 8, 16, 32] if n <= n_cpu] + [n_cpu]))
+    # Without workers, prefetch and persistence have no effect.
+    candidates = [LoaderConfig(0, pin)]
+    for n in n_workers:
+        for prefetch_factor in [2, 4, 8]:
+            candidates += [LoaderConfig(n, pin, prefetch_factor, persistent) for persistent in [False, True]]
+    return candidates
+
+
+def probe(loader: DataLoader, n_batch: int = 20) -> float:
+    """Measure loader throughput [batch/sec] over first batches and an epoch restart.
+
+    The first batch, which includes worker startup, is excluded. The first batch of the next epoch is included,
+    so that restart cost (worker respawn unless persistent) is accounted.
+    """
+
+    iterator = iter(loader)
+    try:
+        next(iterator)
+    except StopIteration:
+        return 0.0
+    start = time.perf_counter()
+    n_done = 0
+    for _ in range(n_batch):
+        try:
+            next(iterator)
+        except StopIteration:
+            break
+        n_done += 1
+    # Next epoch: persistent workers are reused, others are shut down and respawned.
+    del iterator
+    iterator = iter(loader)
+    next(iterator)
+    n_done += 1
+    sec = time.perf_counter() - start
+    # Shutdown workers of the probe before next candidate.
+    del iterator
+    return n_done / sec
+
+
+def autotune(
+    make_loader: Callable[[LoaderConfig], DataLoader],
+    candidates: Optional[List[LoaderConfig]] = None,
+    n_batch: int = 20,
+    tolerance: float = 0.05,
+) -> LoaderConfig:
+    """Pick the loader config with a short throughput probe.
+
+    Args:
+        make_loader: DataLoader factory of a config.
+        candidates: Candidate configs. None use `default_candidates()`.
+        n_batch: Number of probed batches of each candidate.
+        tolerance: Earlier (cheaper) candidate is preferred if the throughput is within this ratio of the best.
+    Returns:
+        The fastest config (the earliest among nearly-fastest ones).
+    """
+
+    candidates = candidates if candidates is not None else default_candidates()
+    throughputs = []
+    for config in candidates:
+        throughputs.append(probe(make_loader(config), n_batch))
+        print(f"Loader probe: {config.num_workers} workers, prefetch {config.prefetch_factor}, "
+            f"persistent {config.persistent_workers}, {throughputs[-1]:.1f} batch/sec")
+    best = max(throughputs)
+    # Candidates are ordered by cost, so the first nearly-fastest one is the cheapest.
+    return next(config for config, throughput in zip(candidates, throughputs) if throughput >= best * (1 - tolerance))
@@ -0,0 +1,306 @@
+"""
+# Preprocessing pipeline
+A corpus item is decoded and resampled only once, then the waveform is fanned out to feature stages.
+Transforms (Resample/Spectrogram) are cached per process, so their kernels are not rebuilt for each item.
+`torchaudio` is imported on first use, so that loading from shards (and process startup) does not import it.
+"""
+
+from typing import TYPE_CHECKING, Callable, List, NamedTuple, Optional, Tuple, Union
+from functools import lru_cache
+import os
+from pathlib import Path
+
+from torch import Tensor, save, stack
+from torch.nn.functional import pad
+
+if TYPE_CHECKING:
+    # currently there is no stub in torchaudio [issue](https://github.com/pytorch/audio/issues/615)
+    from torchaudio.transforms import MelSpectrogram, Spectrogram, Resample # type: ignore
+
+from ... import profiling
+from ...corpus import ItemIdJSSS
+
+
+@lru_cache(maxsize=None)
+def get_resampler(orig_freq: int, new_freq: int) -> "Resample":
+    """Get cached resampler (kernel is computed only once per process)."""
+    from torchaudio.transforms import Resample # type: ignore
+    return Resample(orig_freq, new_freq)
+
+
+@lru_cache(maxsize=None)
+def get_spectrogram(n_fft: int) -> "Spectrogram":
+    """Get cached spectrogram transform (window is computed only once per process)."""
+    from torchaudio.transforms import Spectrogram # type: ignore
+    # defaults: hop_length = win_length // 2, window_fn = torch.hann_window, power = 2
+    return Spectrogram(n_fft)
+
+
+class SpecConfig(NamedTuple):
+    """STFT/mel parameters of spectrogram feature.
+
+    Default is the linear power spectrogram of `to_spectrogram`.
+    """
+
+    n_fft: int = 254
+    # None: n_fft // 2
+    hop_length: Optional[int] = None
+    # None: linear spectrogram
+    n_mels: Optional[int] = None
+
+    @property
+    def hop(self) -> int:
+        """Waveform samples per frame."""
+        return self.hop_length if self.hop_length is not None else self.n_fft // 2
+
+    @property
+    def name(self) -> str:
+        """Feature name which encodes the parameters (default config is `spec`)."""
+        if self == SpecConfig():
+            return "spec"
+        mel = f"_mel{self.n_mels}" if self.n_mels is not None else ""
+        return f"spec_fft{self.n_fft}_hop{self.hop}{mel}"
+
+
+@lru_cache(maxsize=None)
+def get_feature_transform(config: SpecConfig, sr: int) -> Union["Spectrogram", "MelSpectrogram"]:
+    """Get cached spectrogram/melspectrogram transform of the config."""
+    from torchaudio.transforms import MelSpectrogram, Spectrogram # type: ignore
+    if config.n_mels is None:
+        return Spectrogram(config.n_fft, hop_length=config.hop)
+    return MelSpectrogram(sr, n_fft=config.n_fft, hop_length=config.hop, n_mels=config.n_mels)
+
+
+def load_waveform(path_wav: Path, new_sr: Optional[int] = None) -> Tensor:
+    """Load a corpus item as waveform.
+
+    Args:
+        path_wav: Path of the wav file.
+        new_sr: If not None, resample with specified sampling rate.
+    Returns:
+        Waveform :: [Length,]
+    """
+
+    waveform, _sr_orig = decode(path_wav)
+    return resample(waveform, _sr_orig, new_sr)
+
+
+def decode(path_wav: Path) -> Tuple[Tensor, int]:
+    """Decode a corpus item.
+
+    Returns:
+        Waveform :: [1, Length] and its sampling rate
+    """
+
+    from torchaudio import load as load_wav
+
+    with profiling.span("decode") as span:
+        waveform, sr = load_wav(path_wav)
+        span.add_bytes(waveform.numel() * waveform.element_size())
+    return waveform, sr
+
+
+def resample(waveform: Tensor, orig_sr: int, new_sr: Optional[int] = None) -> Tensor:
+    """Resample a decoded waveform with cached resampler.
+
+    Args:
+        waveform: Decoded waveform :: [1, Length]
+        orig_sr: Sampling rate of the waveform.
+        new_sr: If not None, resample with specified sampling rate.
+    Returns:
+        Waveform :: [Length,]
+    """
+
+    if new_sr is not None:
+        with profiling.span("resample", waveform.numel() * waveform.element_size()):
+            waveform = get_resampler(orig_sr, new_sr)(waveform)
+    # :: [1, Length] -> [Length,]
+    return waveform[0, :]
+
+
+def as_waveform(waveform: Tensor) -> Tensor:
+    """Waveform feature (waveform itself)."""
+    return waveform
+
+
+def to_spectrogram(waveform: Tensor, n_fft: int = 254) -> Tensor:
+    """Linear power spectrogram feature.
+
+    Returns:
+        Spectrogram :: [Freq, Frame]
+    """
+    with profiling.span("spectrogram", waveform.numel() * waveform.element_size()):
+        return get_spectrogram(n_fft)(waveform)
+
+
+def to_spectrograms(waveforms: List[Tensor], n_fft: int = 254) -> List[Tensor]:
+    """Batched linear power spectrogram feature, bit-identical to per-item `to_spectrogram`.
+
+    Each waveform is right-padded with its own reflection (what `center=True` STFT does), then zero-padded to the batch
+    length. STFT runs once over the batch, and each item takes only its own frames, which see exactly the same samples
+    as per-item STFT.
+    Waveforms should be grouped by length beforehand, so that zero-padding is small.
+
+    Returns:
+        Spectrograms :: List[[Freq, Frame]]
+    """
+
+    p = n_fft // 2
+    hop = get_spectrogram(n_fft).hop_length
+    # Reflection padding needs length > n_fft // 2, so such short items go through the per-item path.
+    batched = [i for i, waveform in enumerate(waveforms) if waveform.size(-1) > p]
+    specs: List[Optional[Tensor]] = [None] * len(waveforms)
+    for i in sorted(set(range(len(waveforms))) - set(batched)):
+        specs[i] = to_spectrogram(waveforms[i], n_fft)
+    if len(batched) > 0:
+        rows = [_pad_reflect_right(waveforms[i], p) for i in batched]
+        length = max(row.size(-1) for row in rows)
+        with profiling.span("spectrogram", sum(row.numel() * row.element_size() for row in rows)):
+            batch_specs = get_spectrogram(n_fft)(stack([pad(row, (0, length - row.size(-1))) for row in rows]))
+        for i, spec in zip(batched, batch_specs):
+            n_frame = waveforms[i].size(-1) // hop + 1
+            # clone: a view would be saved with the whole batch storage
+            specs[i] = spec[:, :n_frame].clone()
+    return specs # type: ignore
+
+
+def compute_feature(waveform: Tensor, config: SpecConfig, sr: int) -> Tensor:
+    """Spectrogram feature of the config.
+
+    Args:
+        waveform: Waveform :: [Length,]
+        config: STFT/mel parameters.
+        sr: Sampling rate of the waveform (used by mel filterbank).
+    Returns:
+        Spectrogram :: [Freq, Frame]
+    """
+    with profiling.span("spectrogram", waveform.numel() * waveform.element_size()):
+        return get_feature_transform(config, sr)(waveform)
+
+
+def compute_feature_range(
+    read: Callable[[int, int], Tensor],
+    n_sample: int,
+    start: int,
+    n_frame: int,
+    config: SpecConfig,
+    sr: int,
+) -> Tensor:
+    """Frames [start, start + n_frame) of the spectrogram feature, computed from a part of the waveform.
+
+    Frame t sees samples [t*hop - n_fft//2, t*hop + n_fft//2]. The waveform is read with frame-aligned margins,
+    so frames inside the range are identical to `compute_feature` of the whole waveform
+    (at waveform edges, the slice edge is the waveform edge, so `center=True` reflection is the same).
+
+    Args:
+        read: Waveform reader, `read(start_sample, n_sample)` :: [Length,]
+        n_sample: Length of the whole waveform.
+        start: Start frame.
+        n_frame: Number of frames (fewer if the waveform ends).
+        config: STFT/mel parameters.
+        sr: Sampling rate of the waveform.
+    Returns:
+        Spectrogram :: [Freq, Frame]
+    """
+
+    hop = config.hop
+    p = config.n_fft // 2
+    margin = -(-p // hop)
+    end = min((start + n_frame - 1 + margin) * hop + 1, n_sample)
+    # Reflection padding of the slice needs length > n_fft // 2 (e.g. the last frame of `n_sample % hop == 0` item),
+    # so the slice is extended to the left. The extra frames are discarded.
+    first = max(min(start - margin, (end - p - 1) // hop), 0)
+    spec = compute_feature(read(first * hop, end - first * hop), config, sr)
+    n_frame_all = n_sample // hop + 1
+    return spec[:, start - first : min(start + n_frame, n_frame_all) - first]
+
+
+def _pad_reflect_right(waveform: Tensor, p: int) -> Tensor:
+    """Append right reflection padding (edge excluded, same as `pad_mode="reflect"`) :: [Length] -> [Length + p]"""
+    return pad(waveform.view(1, 1, -1), (0, p), mode="reflect").view(-1)
+
+
+class Stage(NamedTuple):
+    """Feature stage, which derives a feature from the waveform and saves it.
+
+    All functions should be picklable (module-level function or `functools.partial` of it) for parallel preprocessing.
+    `compute_batch` is optional batched version of `compute`, which should yield the same outputs.
+    """
+
+    name: str
+    compute: Callable[[Tensor], Tensor]
+    get_path: Callable[[Path, ItemIdJSSS], Path]
+    compute_batch: Optional[Callable[[List[Tensor]], List[Tensor]]] = None
+
+
+class Pipeline:
+    """Preprocessing pipeline, which feeds single decoded/resampled waveform to all stages.
+    """
+
+    def __init__(self, stages: List[Stage], new_sr: Optional[int] = None):
+        """
+        Args:
+            stages: Feature stages.
+            new_sr: If not None, resample with specified sampling rate.
+        """
+        self._stages = stages
+        self._new_sr = new_sr
+
+    def __call__(self, path_wav: Path, id: ItemIdJSSS, dir_dataset: Path) -> None:
+        """Transform a JSSS corpus item into features.
+
+        Before this preprocessing, corpus contents should be deployed.
+        """
+
+        waveform = load_waveform(path_wav, self._new_sr)
+        for stage in self._stages:
+            self._save(stage.compute(waveform), stage.get_path(dir_dataset, id))
+
+    def process_batch(self, paths_wav: List[Path], ids: List[ItemIdJSSS], dir_dataset: Path) -> None:
+        """Transform a batch of JSSS corpus items into features, with batched stages if available.
+
+        Items should be grouped by length for efficient batched computation.
+        """
+
+        self.process_decoded([decode(path_wav) for path_wav in paths_wav], ids, dir_dataset)
+
+    def process_decoded(self, decoded: List[Tuple[Tensor, int]], ids: List[ItemIdJSSS], dir_dataset: Path) -> None:
+        """Transform a batch of decoded items (`decode` outputs) into features."""
+
+        waveforms = [resample(waveform, sr, self._new_sr) for waveform, sr in decoded]
+        for stage in self._stages:
+            if stage.compute_batch is not None:
+                features = stage.compute_batch(waveforms)
+            else:
+                features = [stage.compute(waveform) for waveform in waveforms]
+            for id, feature in zip(ids, features):
+                self._save(feature, stage.get_path(dir_dataset, id))
+
+    @staticmethod
+    def _save(feature: Tensor, path_feature: Path) -> None:
+        path_feature.parent.mkdir(parents=True, exist_ok=True)
+        # Atomic write: interrupted item never leaves a broken file.
+        # Per-process name: concurrent builders (e.g. JSSS_wave and JSSS_spec) share the build cache.
+        path_tmp = path_feature.with_name(f"{path_feature.name}.{os.getpid()}.tmp")
+        with profiling.span("save", feature.numel() * feature.element_size()):
+            save(feature, path_tmp)
+        path_tmp.replace(path_feature)
+
+
+class VariantPipeline:
+    """Preprocessing pipeline of multiple variants (sampling rate and its stages), which decodes an item only once.
+    """
+
+    def __init__(self, variants: List[Tuple[Pipeline, Path]]):
+        """
+        Args:
+            variants: Pipeline of each variant and its output directory.
+        """
+        self._variants = variants
+
+    def process_batch(self, paths_wav: List[Path], ids: List[ItemIdJSSS]) -> None:
+        """Transform a batch of JSSS corpus items into features of all variants."""
+
+        decoded = [decode(path_wav) for path_wav in paths_wav]
+        for pipeline, dir_dataset in self._variants:
+            pipeline.process_decoded(decoded, ids, dir_dataset)
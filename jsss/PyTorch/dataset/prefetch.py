@@ -0,0 +1,100 @@
+"""
+# Prefetching reader
+Items are read ahead of the sampler order by a bounded thread pool in each process, so that blocking reads
+(ranged reads of remote shards, decompression, online STFT) overlap each other and the training step.
+Ready items (or batches) are handed to the DataLoader in the sampler order.
+
+Usage:
+    sampler = LengthBucketBatchSampler(get_lengths(dataset), 8)
+    loader = DataLoader(PrefetchDataset(dataset, sampler, n_threads=32), batch_size=None, collate_fn=collate_pad, num_workers=2)
+"""
+
+from typing import Any, Deque, Iterable, Iterator, List, Optional, Sequence, Union
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import torch
+from torch.utils.data import Dataset, IterableDataset, get_worker_info
+
+from ... import profiling
+
+
+class PrefetchDataset(IterableDataset):
+    """Iterable view of a map-style dataset, which reads items ahead of the sampler order with bounded concurrency.
+
+    With DataLoader workers, each worker takes every `num_workers`-th entry of the same order.
+    The order is made in each process, so it is seeded by (`seed`, epoch) for torch-RNG samplers (e.g. `RandomSampler`),
+    and `set_epoch` is forwarded to samplers which have it (e.g. `LengthBucketBatchSampler`).
+    Epoch is advanced by each iteration in the process. With non-persistent workers, call `set_epoch` every epoch
+    (like `DistributedSampler`).
+    """
+
+    def __init__(
+        self,
+        dataset: Dataset,
+        sampler: Iterable[Union[int, Sequence[int]]],
+        n_threads: int = 16,
+        depth: Optional[int] = None,
+        seed: int = 0,
+    ):
+        """
+        Args:
+            dataset: Map-style dataset (e.g. `JSSS_wave` with `remote_shards=True`, or its `Subset`).
+            sampler: Item order, which yields indices (e.g. `RandomSampler`) or index lists (batch sampler).
+                Index lists are yielded as lists of items (collate them with DataLoader's `collate_fn`).
+            n_threads: Number of concurrent reads in each process.
+            depth: Upper bound of items in flight (read ahead of consumption). None is 2 x `n_threads`.
+            seed: Random seed of torch-RNG samplers (combined with epoch).
+        """
+
+        self._dataset = dataset
+        self._sampler = sampler
+        self._n_threads = n_threads
+        self._depth = depth if depth is not None else 2 * n_threads
+        self._seed = seed
+        self._epoch = 0
+
+    def set_epoch(self, epoch: int) -> None:
+        """Set epoch of the order."""
+        self._epoch = epoch
+
+    def _order(self) -> List[Union[int, Sequence[int]]]:
+        """Sampler order of this epoch (same in all processes), sharded over DataLoader workers."""
+
+        if hasattr(self._sampler, "set_epoch"):
+            self._sampler.set_epoch(self._epoch) # type: ignore
+        with torch.random.fork_rng(devices=[]):
+            torch.manual_seed(self._seed + self._epoch)
+            order = list(self._sampler)
+        self._epoch += 1
+        worker_info = get_worker_info()
+        if worker_info is not None:
+            order = order[worker_info.id :: worker_info.num_workers]
+        return order
+
+    def __iter__(self) -> Iterator[Any]:
+        order = self._order()
+        # Entries in flight: (whether batch, futures of items)
+        pending: Deque[Any] = deque()
+        n_inflight = 0
+        with ThreadPoolExecutor(self._n_threads) as executor:
+            for entry in order:
+                is_batch = isinstance(entry, (list, tuple))
+                indices = list(entry) if is_batch else [entry] # type: ignore
+                pending.append((is_batch, [executor.submit(self._dataset.__getitem__, i) for i in indices]))
+                n_inflight += len(indices)
+                while n_inflight > self._depth:
+                    n_inflight -= len(pending[0][1])
+                    yield self._collect(*pending.popleft())
+            while len(pending) > 0:
+                yield self._collect(*pending.popleft())
+
+    @staticmethod
+    def _collect(is_batch: bool, futures: List[Future]) -> Any:
+        # Wait time is the stall of the consumer, which should be small if reads keep ahead.
+        with profiling.span("prefetch.wait"):
+            items = [future.result() for future in futures]
+        return items if is_batch else items[0]
+
+    def __len__(self) -> int:
+        return len(self._sampler) # type: ignore
@@ -0,0 +1,99 @@
+"""
+# Preprocessing runner
+Dataset generation is embarrassingly parallel (item-wise independent), so items are distributed over a process pool.
+Each item writes only its own output, so contents are identical regardless of worker count and scheduling.
+"""
+
+from typing import Any, Callable, List, Optional, Sequence, Tuple
+import os
+import traceback
+from multiprocessing import get_context
+
+import torch
+from tqdm import tqdm
+
+from .batching import pack_by_frames
+
+
+Item = Tuple[Any, ...]
+
+
+def _init_worker() -> None:
+    """Initialize a preprocessing worker process.
+
+    Each worker processes one item at a time, so intra-op threading only oversubscribes cores.
+    """
+
+    torch.set_num_threads(1)
+
+
+class _Guarded:
+    """Picklable wrapper which converts item failure into a returned error report.
+    """
+
+    def __init__(self, process: Callable[..., None]):
+        self._process = process
+
+    def __call__(self, item: Item) -> Optional[str]:
+        try:
+            self._process(*item)
+            return None
+        except Exception:
+            return traceback.format_exc()
+
+
+def preprocess_items(
+    process: Callable[..., None],
+    items: Sequence[Item],
+    n_workers: Optional[int] = 1,
+    chunksize: Optional[int] = None,
+    desc: str = "Preprocessing",
+) -> None:
+    """Run `process(*item)` for all items, optionally over a process pool.
+
+    Args:
+        process: Picklable item preprocessing function (e.g. module-level function or `functools.partial` of it).
+        items: Argument tuples of each item.
+        n_workers: Number of worker processes. 1 is serial in-process run, None use all CPU cores.
+        chunksize: Number of items sent to a worker at once. None automatically balance load among workers.
+        desc: Progress bar description.
+    Raises:
+        RuntimeError: When preprocessing of an item failed. Remaining work is cancelled.
+    """
+
+    n_workers = n_workers if n_workers is not None else (os.cpu_count() or 1)
+    guarded = _Guarded(process)
+    with tqdm(total=len(items), desc=desc) as pbar:
+        if n_workers <= 1:
+            for item in items:
+                _raise_if_failed(item, guarded(item))
+                pbar.update(1)
+            return
+
+        # 4 chunks per worker: small enough to balance long/short items, large enough to amortize IPC.
+        chunksize = chunksize if chunksize else max(1, len(items) // (n_workers * 4))
+        with get_context().Pool(n_workers, initializer=_init_worker) as pool:
+            # `imap` yields in item order, so the first failure in item order is reported deterministically.
+            # Exiting the `with` block terminates the pool, so a failure cancels all in-flight work.
+            for item, error in zip(items, pool.imap(guarded, items, chunksize)):
+                _raise_if_failed(item, error)
+                pbar.update(1)
+
+
+def batch_by_length(lengths: Sequence[int], max_items: int = 32, max_samples: int = 2 ** 22) -> List[List[int]]:
+    """Group items with similar length into batches for batched feature computation.
+
+    Args:
+        lengths: Length of each item (e.g. number of samples in corpus index).
+        max_items: Upper bound of items in a batch.
+        max_samples: Upper bound of padded samples (max length x batch size) in a batch.
+    Returns:
+        Batches of item indices.
+    """
+
+    return pack_by_frames(sorted(range(len(lengths)), key=lambda i: lengths[i]), lengths, max_samples, max_items)
+
+
+def _raise_if_failed(item: Item, error: Optional[str]) -> None:
+    if error is not None:
+        raise RuntimeError(f"Preprocessing failed at item {item}:\n{error}")
@@ -0,0 +1,309 @@
+"""
+# Packed shard format
+Features of a subtype are packed into a contiguous binary shard (`<subtype>/<feature>.bin`)
+with an offset/shape index (`<subtype>/<feature>.index.json`).
+Shards are opened with `numpy.memmap`, so item access is a zero-copy view without per-item file open/unpickling,
+and OS page cache is shared among DataLoader worker processes.
+
+Items are stored time-major (time axis first), so that a time range of an item is a contiguous byte range.
+
+Storage precision is configurable (`Storage`): int16 PCM / float16 / log-compressed values are decoded on read
+with vectorized ops (float32 storage stays zero-copy). With compression, each item is a zlib-compressed chunk,
+so a read decompresses the whole item (memmap only saves file open).
+
+Shards can also be read in place from an uncompressed dataset archive in remote storage (`RemoteShardReader`).
+
+Per-item moments of the feature are accumulated while packing (`<subtype>/<feature>.stats.npz`, see `stats`).
+"""
+
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple, Union
+import json
+from pathlib import Path
+import zlib
+
+import fsspec
+import numpy as np
+import torch
+from torch import Tensor, from_numpy, load
+
+from .pipeline import Stage
+from .stages import stage_wave
+from .stats import ItemMoments, MomentsAccumulator
+from ... import profiling
+from ...corpus import ItemIdJSSS, Subtype
+
+
+def get_shard_path(dir_dataset: Path, subtype: Subtype, feature: str) -> Path:
+    return dir_dataset / subtype / f"{feature}.bin"
+
+
+def get_index_path(dir_dataset: Path, subtype: Subtype, feature: str) -> Path:
+    return dir_dataset / subtype / f"{feature}.index.json"
+
+
+def get_stats_path(dir_dataset: Path, subtype: Subtype, feature: str) -> Path:
+    return dir_dataset / subtype / f"{feature}.stats.npz"
+
+
+def get_adress(root: Union[Path, str], subtype: Subtype, name: str) -> str:
+    """Adress of a contents file, under local dataset contents (Path) or remote dataset archive (adress str)."""
+    return f"{root}/{subtype}/{name}" if isinstance(root, str) else str(root / subtype / name)
+
+
+# int16 PCM full scale
+_pcm_scale = 32768
+# Floor of log-compressed values (power spectrogram can be exact zero)
+_log_eps = 1e-10
+
+
+class Storage(NamedTuple):
+    """On-disk storage format of a feature.
+
+    Args:
+        dtype: Storage dtype, `float32`, `float16` or `int16` (PCM, waveform only).
+        log: Store `log(max(x, eps))` instead of x (spectrogram only, required with `float16` spectrogram).
+        compression: None or `zlib` (fast level, per-item chunk).
+    """
+
+    dtype: str = "float32"
+    log: bool = False
+    compression: Optional[str] = None
+
+    def validate(self, waveform: bool) -> None:
+        """Raise ValueError if the format cannot store the feature faithfully.
+
+        Args:
+            waveform: Whether the feature is waveform (signed, in [-1, 1)) or spectrogram (non-negative, unbounded).
+        """
+
+        if self.dtype not in ("float32", "float16", "int16"):
+            raise ValueError(f"Unknown storage dtype: {self.dtype}")
+        if self.compression not in (None, "zlib"):
+            raise ValueError(f"Unknown storage compression: {self.compression} (None or `zlib`).")
+        if waveform and self.log:
+            raise ValueError("Log storage is only for non-negative features (spectrogram), not for waveform.")
+        if not waveform and self.dtype == "int16":
+            raise ValueError("int16 storage is PCM in [-1, 1), which clips spectrogram. Use float16 with log.")
+        if not waveform and self.dtype == "float16" and not self.log:
+            raise ValueError("float16 storage of linear spectrogram overflows (max 65504). Use float16 with log.")
+
+
+def encode(feature: Tensor, storage: Storage) -> np.ndarray:
+    """Encode a float feature into the storage dtype."""
+    if storage.log:
+        feature = torch.log(torch.clamp(feature, min=_log_eps))
+    if storage.dtype == "int16":
+        feature = torch.clamp(torch.round(feature * _pcm_scale), -_pcm_scale, _pcm_scale - 1)
+    return feature.numpy().astype(storage.dtype)
+
+
+def decode(stored: Tensor, storage: Storage) -> Tensor:
+    """Decode stored values into float32 feature (no copy if float32 without log)."""
+    if storage.dtype == "int16":
+        stored = stored.float().div_(_pcm_scale)
+    elif storage.dtype != "float32":
+        stored = stored.float()
+    if storage.log:
+        # in-place only on a decoded copy, never on the shard view
+        stored = stored.exp_() if storage.dtype != "float32" else stored.exp()
+    return stored
+
+
+def to_time_major(feature: Tensor) -> Tensor:
+    """[..., Time] -> [Time, ...]"""
+    return feature.permute(feature.dim() - 1, *range(feature.dim() - 1))
+
+
+def from_time_major(feature: Tensor) -> Tensor:
+    """[Time, ...] -> [..., Time] (view, no copy)"""
+    return feature.permute(*range(1, feature.dim()), 0)
+
+
+def pack_shards(dir_items: Path, dir_dataset: Path, ids: List[ItemIdJSSS], stage: Stage, storage: Storage = Storage()) -> None:
+    """Pack per-item feature files of the stage into per-subtype shards.
+
+    Items are packed in `ids` order, so shard contents are deterministic.
+    Per-item moments are accumulated from the loaded features in the same pass, and saved next to the shard.
+
+    Args:
+        dir_items: Directory of per-item feature files (e.g. build cache).
+        dir_dataset: Directory of dataset contents, into which shards are written.
+        ids: Items to be packed.
+        stage: Stage of the feature.
+        storage: Storage format.
+    """
+
+    storage.validate(stage.name == stage_wave.name)
+    subtypes: List[Subtype] = list(dict.fromkeys(id.subtype for id in ids))
+    for subtype in subtypes:
+        path_shard = get_shard_path(dir_dataset, subtype, stage.name)
+        path_shard.parent.mkdir(parents=True, exist_ok=True)
+        entries: Dict[str, Dict[str, object]] = {}
+        offset = 0
+        moments = MomentsAccumulator(log=stage.name != stage_wave.name)
+        with open(path_shard, "wb") as f:
+            for id in filter(lambda id: id.subtype == subtype, ids):
+                with profiling.span("load") as span:
+                    feature = load(stage.get_path(dir_items, id))
+                    span.add_bytes(feature.numel() * feature.element_size())
+                with profiling.span("stats"):
+                    moments.add(id.serial_num, to_time_major(feature))
+                with profiling.span("pack") as span:
+                    array = encode(to_time_major(feature).contiguous(), storage)
+                    if storage.compression is None:
+                        # offset [element]
+                        f.write(array.tobytes())
+                        entries[str(id.serial_num)] = {"offset": offset, "shape": list(array.shape)}
+                        offset += array.size
+                        span.add_bytes(array.nbytes)
+                    else:
+                        # offset/size [byte]
+                        chunk = zlib.compress(array.tobytes(), 1)
+                        f.write(chunk)
+                        entries[str(id.serial_num)] = {"offset": offset, "size": len(chunk), "shape": list(array.shape)}
+                        offset += len(chunk)
+                        span.add_bytes(len(chunk))
+        with open(get_index_path(dir_dataset, subtype, stage.name), "w") as f:
+            json.dump({"dtype": storage.dtype, "log": storage.log, "compression": storage.compression, "items": entries}, f)
+        moments.result().save(str(get_stats_path(dir_dataset, subtype, stage.name)))
+
+
+class ShardReader:
+    """Zero-copy item reader of a feature shard.
+
+    The memmap is opened lazily and dropped on pickling, so each DataLoader worker maps the shard by itself.
+    """
+
+    def __init__(self, root: Union[Path, str], subtype: Subtype, feature: str):
+        """
+        Args:
+            root: Local dataset contents directory (Path), or remote dataset archive adress (str, for subclasses).
+            subtype: Subtype of the shard.
+            feature: Feature name of the shard.
+        """
+
+        self._adress_shard = get_adress(root, subtype, f"{feature}.bin")
+        with fsspec.open(get_adress(root, subtype, f"{feature}.index.json"), "r") as f:
+            index = json.load(f)
+        self._storage = Storage(index["dtype"], index.get("log", False), index.get("compression"))
+        self._dtype = np.dtype(self._storage.dtype)
+        self._entries: Dict[int, Tuple[int, Tuple[int, ...]]] = {
+            int(num): (entry["offset"], tuple(entry["shape"])) for num, entry in index["items"].items()
+        }
+        # Compressed chunk size [byte]
+        self._sizes: Dict[int, int] = {int(num): entry["size"] for num, entry in index["items"].items() if "size" in entry}
+        self._memmap: Optional[np.memmap] = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_memmap"] = None
+        return state
+
+    def _get_memmap(self) -> np.memmap:
+        if self._memmap is None:
+            # copy-on-write mode: writable view for `torch.from_numpy` without touching the shard file
+            dtype = self._dtype if self._storage.compression is None else np.uint8
+            self._memmap = np.memmap(self._adress_shard, dtype=dtype, mode="c")
+        return self._memmap
+
+    def _read_elements(self, start: int, end: int) -> np.ndarray:
+        """Read elements [start, end) of uncompressed shard."""
+        return self._get_memmap()[start:end]
+
+    def _read_bytes(self, start: int, end: int) -> np.ndarray:
+        """Read bytes [start, end) of compressed shard."""
+        return self._get_memmap()[start:end]
+
+    def get(self, serial_num: int, start: int = 0, length: Optional[int] = None) -> Tensor:
+        """Get an item feature :: [..., Time] as zero-copy view of the shard (decoded copy if encoded/compressed).
+
+        Args:
+            serial_num: Serial number of the item.
+            start: Start time index of the range.
+            length: Time length of the range (clipped at the item end). None read to the end.
+        Returns:
+            Item feature of the time range. Only this byte range is touched in the shard.
+        """
+
+        offset, shape = self._entries[serial_num]
+        end = shape[0] if length is None else min(start + length, shape[0])
+        with profiling.span("shard.read") as span:
+            if self._storage.compression is None:
+                stride = int(np.prod(shape[1:]))
+                array = self._read_elements(offset + start * stride, offset + end * stride).reshape((end - start, *shape[1:]))
+                span.add_bytes(array.nbytes)
+            else:
+                chunk = self._read_bytes(offset, offset + self._sizes[serial_num])
+                span.add_bytes(chunk.nbytes)
+                # bytearray: writable buffer for `torch.from_numpy`
+                array = np.frombuffer(bytearray(zlib.decompress(chunk)), dtype=self._dtype).reshape(shape)[start:end]
+            return from_time_major(decode(from_numpy(array), self._storage))
+
+    def length(self, serial_num: int) -> int:
+        """Get time length of an item without reading the item."""
+        return self._entries[serial_num][1][0]
+
+    def serial_nums(self) -> List[int]:
+        """Get serial numbers of the items in the shard (packing order)."""
+        return list(self._entries)
+
+
+class RemoteShardReader(ShardReader):
+    """Item reader of a feature shard in remote storage (e.g. uncompressed dataset archive in object storage).
+
+    Each read is a ranged request of the item (time range) bytes, so nothing is deployed locally.
+    The filesystem is resolved lazily through `fsspec`, whose instance (and connection pool) is shared by all readers
+    of a process, and each DataLoader worker resolves its own.
+    Reads block on the network, so they should be overlapped by `PrefetchDataset`.
+    """
+
+    def __init__(self, adress_dataset: str, subtype: Subtype, feature: str):
+        super().__init__(adress_dataset, subtype, feature)
+        self._fs: Optional[Any] = None
+        self._path_remote = ""
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_fs"] = None
+        return state
+
+    def _get_fs(self) -> Any:
+        if self._fs is None:
+            shard = fsspec.open(self._adress_shard)
+            self._fs, self._path_remote = shard.fs, shard.path
+        return self._fs
+
+    def _read_bytes(self, start: int, end: int) -> np.ndarray:
+        # seek/read (ranged `cat_file` is not in fsspec 0.8), without read-ahead cache beyond the range.
+        # A file object per read, so that concurrent reads (prefetch threads) do not share a position.
+        with self._get_fs().open(self._path_remote, "rb", cache_type="none") as f:
+            f.seek(start)
+            # bytearray: writable buffer for `torch.from_numpy`
+            return np.frombuffer(bytearray(f.read(end - start)), dtype=np.uint8)
+
+    def _read_elements(self, start: int, end: int) -> np.ndarray:
+        itemsize = self._dtype.itemsize
+        return self._read_bytes(start * itemsize, end * itemsize).view(self._dtype)
+
+
+def open_shard(root: Union[Path, str], subtype: Subtype, feature: str) -> ShardReader:
+    """Open a feature shard of local dataset contents (Path), or of remote dataset archive (adress str)."""
+    if isinstance(root, str):
+        return RemoteShardReader(root, subtype, feature)
+    return ShardReader(root, subtype, feature)
+
+
+def load_moments(root: Union[Path, str], subtype: Subtype, feature: str) -> ItemMoments:
+    """Load per-item moments of a feature shard of local dataset contents (Path), or of remote dataset archive (adress str).
+
+    Contents packed without moments (older builds) are scanned from the shard once (not from the corpus).
+    """
+
+    try:
+        return ItemMoments.load(get_adress(root, subtype, f"{feature}.stats.npz"))
+    except FileNotFoundError:
+        reader = open_shard(root, subtype, feature)
+        moments = MomentsAccumulator(log=feature != stage_wave.name)
+        for serial_num in reader.serial_nums():
+            moments.add(serial_num, to_time_major(reader.get(serial_num)))
+        return moments.result()
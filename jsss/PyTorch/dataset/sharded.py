@@ -0,0 +1,212 @@
+"""
+# Sharded dataset base
+Contents plumbing shared by `JSSS_wave` and `JSSS_spec`: lazy deployment of dataset contents (archive fetch or build,
+under a file lock), local or remote shard opening, RAM cache preload, per-item moments and pickle-light state.
+"""
+
+from typing import Dict, List, Optional, Tuple, Union
+from abc import ABC, abstractmethod
+from pathlib import Path
+
+import numpy as np
+from torch import Tensor
+from torch.utils.data import Dataset
+
+from .cache import RAMCache, SharedCache
+from .shard import ShardReader, load_moments, open_shard
+from .stats import ItemMoments
+from .variants import Variants, get_variant_dir
+from ...corpus import CorpusIndex, ItemIdJSSS, Subtype, JSSS
+from ... import profiling
+from ...archive import acquire_dataset_archive, is_contents_complete, read_archive_manifest, save_dataset_archive, select_subtypes, validate_compression, write_manifest
+from ...lock import file_lock
+
+
+def resolve_archive_subtypes(
+    subtypes: List[Subtype],
+    archive_subtypes: Optional[List[Subtype]],
+    archive_compression: str,
+    remote_shards: bool,
+) -> List[Subtype]:
+    """Validate dataset archive arguments, and resolve archive subtypes (None is `subtypes`)."""
+
+    archive_subtypes = archive_subtypes if archive_subtypes is not None else subtypes
+    if not all(subtype in archive_subtypes for subtype in subtypes):
+        raise ValueError(f"subtypes {subtypes} should be included in archive_subtypes {archive_subtypes}.")
+    validate_compression(archive_compression)
+    if remote_shards and archive_compression != "none":
+        raise ValueError(f"Remote shards need uncompressed dataset archive, but got archive_compression {archive_compression}.")
+    return archive_subtypes
+
+
+class _JSSS_sharded(Dataset, ABC):
+    """Base of datasets whose contents are per-subtype feature shards (local, or remote in the dataset archive).
+    """
+
+    def _init_contents(
+        self,
+        corpus: JSSS,
+        resample_sr: Optional[int],
+        subtypes: List[Subtype],
+        archive_subtypes: List[Subtype],
+        variants: Optional[Variants],
+        root: Path,
+        arg_hash: str,
+        dataset_dir_adress: Optional[str],
+        cache: Optional[RAMCache],
+        n_workers: Optional[int],
+        upload_archive: bool,
+        archive_compression: str,
+        remote_shards: bool,
+    ) -> None:
+        """Store contents arguments (no I/O).
+
+        Args:
+            root: Local root of the dataset kind (contents and default archive directory).
+            arg_hash: Hash of arguments which determine the contents.
+            Others: Same as dataset arguments (`archive_subtypes` resolved by `resolve_archive_subtypes`).
+        """
+
+        self._corpus = corpus
+        self._resample_sr = resample_sr
+        self._subtypes = subtypes
+        self._archive_subtypes = archive_subtypes
+        self._variants = variants
+        self._cache = cache
+        self._n_workers = n_workers
+        self._upload_archive = upload_archive
+        self._archive_compression = archive_compression
+        self._remote_shards = remote_shards
+        self._path_contents_local = root/"contents"/arg_hash
+        self._path_lock = root/"contents"/f"{arg_hash}.lock"
+        dataset_dir_adress = dataset_dir_adress if dataset_dir_adress else str(root/"archive")
+        self._dataset_archive_adress = f"{dataset_dir_adress}/{arg_hash}"
+
+        # Prepare data identities (in-memory identity index, without index I/O).
+        identities = corpus.get_identity_index()
+        self._ids: List[ItemIdJSSS] = identities.get_ids(identities.select(subtypes))
+
+        self._prepared = False
+        # feature -> subtype -> shard
+        self._shards: Optional[Dict[str, Dict[Subtype, ShardReader]]] = None
+        self._moments: Dict[Tuple[str, Subtype], ItemMoments] = {}
+
+    @abstractmethod
+    def _features(self) -> List[str]:
+        """Names of the features whose shards are opened."""
+
+    @abstractmethod
+    def _cache_keys(self) -> List[Tuple[str, Subtype, int]]:
+        """Keys (feature, subtype, serial_num) preloaded into `SharedCache`."""
+
+    @abstractmethod
+    def _load_whole(self, key: Tuple[str, Subtype, int]) -> Tensor:
+        """Load whole item feature of a cache key (shards are opened)."""
+
+    @abstractmethod
+    def _generate_dataset_contents(self) -> None:
+        """Generate dataset contents of all archive subtypes into the local contents directory."""
+
+    def prepare(self) -> None:
+        """Deploy dataset contents (fetch the archive, or generate and archive them) and open them.
+
+        Called on first access if not called explicitly. Call it before DataLoader workers start,
+        so that contents are deployed (and `SharedCache` is preloaded) only once.
+        """
+
+        if self._prepared:
+            return
+
+        # Remote shards are read from the archive in place, so contents are deployed only if the archive does not exist.
+        manifest = read_archive_manifest(self._dataset_archive_adress) if self._remote_shards else None
+        if manifest is None:
+            self._deploy_contents()
+        if self._remote_shards:
+            manifest = manifest if manifest is not None else read_archive_manifest(self._dataset_archive_adress)
+            if manifest is None or manifest["compression"] != "none":
+                raise RuntimeError(f"Remote shards need uncompressed dataset archive at {self._dataset_archive_adress}.")
+
+        self._open_shards()
+        if isinstance(self._cache, SharedCache):
+            self._cache.preload(self._cache_keys(), self._load_whole)
+        self._prepared = True
+
+    def _deploy_contents(self) -> None:
+        """Deploy dataset contents, only once even if processes (e.g. DDP ranks on a node) prepare the dataset concurrently."""
+
+        # Fetch only shards of the subtypes (of the selected variant).
+        variant_prefix = "" if self._variants is None else f"{get_variant_dir(Path(), self._resample_sr).as_posix()}/"
+        selector = select_subtypes(self._subtypes, variant_prefix)
+        with file_lock(self._path_lock):
+            with profiling.span("archive.acquire"):
+                contents_acquired = acquire_dataset_archive(self._dataset_archive_adress, self._path_contents_local, selector)
+            if not contents_acquired:
+                # Generate the dataset contents from corpus
+                print("Dataset archive file is not found. Automatically generating new dataset...")
+                with profiling.span("build"):
+                    self._generate_dataset_contents()
+                write_manifest(self._path_contents_local, self._archive_compression)
+                if self._upload_archive:
+                    with profiling.span("archive.save"):
+                        save_dataset_archive(self._path_contents_local, self._dataset_archive_adress, self._archive_compression)
+                    print("Dataset contents was generated and archive was saved.")
+            elif self._remote_shards and self._upload_archive and read_archive_manifest(self._dataset_archive_adress) is None:
+                # Local contents are reused, but the archive to be read in place does not exist.
+                if not is_contents_complete(self._path_contents_local):
+                    # Partially fetched (from another archive adress), so the archive is made from complete contents.
+                    with profiling.span("build"):
+                        self._generate_dataset_contents()
+                    write_manifest(self._path_contents_local, self._archive_compression)
+                with profiling.span("archive.save"):
+                    save_dataset_archive(self._path_contents_local, self._dataset_archive_adress, self._archive_compression)
+                print("Dataset archive was saved from local contents.")
+
+    def _get_shard_root(self) -> Union[Path, str]:
+        """Shard root of the selected variant, local contents directory or remote archive adress."""
+        variant = [get_variant_dir(Path(), self._resample_sr).as_posix()] if self._variants is not None else []
+        if self._remote_shards:
+            return "/".join([self._dataset_archive_adress] + variant)
+        return self._path_contents_local.joinpath(*variant)
+
+    def _open_shards(self) -> Dict[str, Dict[Subtype, ShardReader]]:
+        """Open packed shards (of the selected variant), in local contents or in the remote archive."""
+        if self._shards is None:
+            root = self._get_shard_root()
+            self._shards = {feature: {subtype: open_shard(root, subtype, feature) for subtype in self._subtypes} for feature in self._features()}
+        return self._shards
+
+    def _get_shards(self) -> Dict[str, Dict[Subtype, ShardReader]]:
+        """Get shards, which are prepared on first access and reopened after unpickling (e.g. in DataLoader workers)."""
+        if not self._prepared:
+            self.prepare()
+        return self._open_shards()
+
+    def __getstate__(self):
+        # Pickle-light: shard readers (with item tables) are reopened by each process.
+        state = self.__dict__.copy()
+        state["_shards"] = None
+        state["_moments"] = {}
+        return state
+
+    def _get_moments(self, feature: str, subtype: Subtype) -> ItemMoments:
+        if (feature, subtype) not in self._moments:
+            self._get_shards()
+            self._moments[(feature, subtype)] = load_moments(self._get_shard_root(), subtype, feature)
+        return self._moments[(feature, subtype)]
+
+    def _get_archive_ids(self) -> List[ItemIdJSSS]:
+        """Item identities of the archive subtypes (all items of the dataset contents)."""
+        identities = self._corpus.get_identity_index()
+        return identities.get_ids(identities.select(self._archive_subtypes))
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def get_ids(self) -> List[ItemIdJSSS]:
+        """Get item identities in dataset order (without I/O)."""
+        return list(self._ids)
+
+    def get_index_rows(self) -> Tuple[CorpusIndex, np.ndarray]:
+        """Get the in-memory identity index and its rows of the items in dataset order (without I/O, e.g. for `get_split`)."""
+        identities = self._corpus.get_identity_index()
+        return identities, identities.select(self._subtypes)
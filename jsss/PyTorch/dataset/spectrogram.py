@@ -1,19 +1,24 @@
-from typing import Callable, List, NamedTuple, Optional, Union
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple, Union
+from functools import partial
 from pathlib import Path
+import random
 
-from torch import Tensor, save, load
-from torch.utils.data.dataset import Dataset
-# currently there is no stub in torchaudio [issue](https://github.com/pytorch/audio/issues/615)
-from torchaudio import load as load_wav
-from torchaudio.transforms import Spectrogram, Resample # type: ignore
-from corpuspy.components.archive import hash_args, try_to_acquire_archive_contents, save_archive
+from torch import Tensor
+from torch.nn.functional import pad
+from corpuspy.components.archive import hash_args
 
-from .waveform import get_dataset_wave_path, preprocess_as_wave
+from .pipeline import Pipeline, SpecConfig, compute_feature, compute_feature_range
+from .cache import RAMCache, read_cached
+from .itemcache import ItemCache
+from .loader import identity
+from .preprocess import batch_by_length, preprocess_items
+from .shard import Storage, pack_shards
+from .sharded import _JSSS_sharded, resolve_archive_subtypes
+from .stages import get_dataset_spec_path, stage_spec, stage_wave
+from .stats import FeatureStats, get_normalizer, merge_item_stats, normalize
+from .variants import Variants, build_variants
 from ...corpus import ItemIdJSSS, Subtype, JSSS
-
-
-def get_dataset_spec_path(dir_dataset: Path, id: ItemIdJSSS) -> Path:
-    return dir_dataset / id.subtype / "specs" / f"{id.serial_num}.spec.pt"
+from ... import profiling
 
 
 def preprocess_as_spec(path_wav: Path, id: ItemIdJSSS, dir_dataset: Path, new_sr: Optional[int] = None) -> None:
@@ -21,17 +26,15 @@ def preprocess_as_spec(path_wav: Path, id: ItemIdJSSS, dir_dataset: Path, new_sr
 
     Before this preprocessing, corpus contents should be deployed.
     """
-    
-    waveform, _sr_orig = load_wav(path_wav)
-    if new_sr is not None:
-        waveform = Resample(_sr_orig, new_sr)(waveform)
-    # :: [1, Length] -> [Length,]
-    waveform: Tensor = waveform[0, :]
-    # defaults: hop_length = win_length // 2, window_fn = torch.hann_window, power = 2
-    spec: Tensor = Spectrogram(254)(waveform)
-    path_spec = get_dataset_spec_path(dir_dataset, id)
-    path_spec.parent.mkdir(parents=True, exist_ok=True)
-    save(spec, path_spec)
+
+    Pipeline([stage_spec], new_sr)(path_wav, id, dir_dataset)
+
+
+def preprocess_as_spec_and_wave(path_wav: Path, id: ItemIdJSSS, dir_dataset: Path, new_sr: Optional[int] = None) -> None:
+    """Transform JSSS corpus contents into spectrogram Tensor and waveform Tensor with single decode.
+    """
+
+    Pipeline([stage_spec, stage_wave], new_sr)(path_wav, id, dir_dataset)
 
 
 class Datum_JSSS_spec_train(NamedTuple):
@@ -45,7 +48,7 @@ class Datum_JSSS_spec_test(NamedTuple):
     label: str
 
 
-class JSSS_spec(Dataset): # I failed to understand this error
+class JSSS_spec(_JSSS_sharded): # I failed to understand this error
     """Audio spectrogram dataset from JSSS speech corpus.
     """
     def __init__(
@@ -56,7 +59,20 @@ class JSSS_spec(Dataset): # I failed to understand this error
         download_corpus: bool = False,
         corpus_adress: Optional[str] = None,
         dataset_dir_adress: Optional[str] = None,
-        transform: Callable[[Tensor], Tensor] = (lambda i: i),
+        transform: Callable[[Tensor], Tensor] = identity,
+        n_workers: Optional[int] = 1,
+        segment_length: Optional[int] = None,
+        cache: Optional[RAMCache] = None,
+        online: bool = False,
+        spec_config: SpecConfig = SpecConfig(),
+        spec_storage: Storage = Storage(),
+        wave_storage: Storage = Storage(),
+        upload_archive: bool = True,
+        variants: Optional[Variants] = None,
+        archive_compression: str = "none",
+        archive_subtypes: Optional[List[Subtype]] = None,
+        remote_shards: bool = False,
+        normalize: Optional[str] = None,
     ):
         """
         Args:
@@ -67,6 +83,27 @@ class JSSS_spec(Dataset): # I failed to understand this error
             corpus_adress: URL/localPath of corpus archive (remote url, like `s3::`, can be used). None use default URL.
             dataset_dir_adress: URL/localPath of JSSS_spec dataset directory (remote url, like `s3::`, can be used).
             transform: Tensor transform on load.
+            n_workers: Number of preprocessing processes for dataset generation. None use all CPU cores.
+            segment_length: If not None, yield random segment of the length [frame] (zero-padded if an item is shorter).
+                In test mode, waveform segment is hop-aligned with the spectrogram segment.
+            cache: If not None, cache features in RAM (`LRUCache`, or `SharedCache` which is preloaded in `prepare`).
+                In online mode, computed spectrograms are memoized in it.
+            online: If True, store only waveforms and compute spectrograms on load (in DataLoader workers).
+            spec_config: STFT/mel parameters. Non-default parameters need online mode or variants.
+            spec_storage: On-disk spectrogram format (e.g. `Storage("float16", log=True)`). Not used in online mode.
+            wave_storage: On-disk waveform format (e.g. `Storage("int16")`).
+            upload_archive: Whether to save generated dataset archive to `dataset_dir_adress`
+                (e.g. False except on the global rank zero, so that nodes do not race to upload the same archive).
+            variants: If not None, use multi-variant dataset store, from which `resample_sr`/`spec_config` variant is selected
+                (`spec_storage`/`wave_storage` are ignored, the store has its own formats).
+            archive_compression: Compression of generated dataset archive, `none`, `zlib` or `zstd` (needs `zstandard`).
+            archive_subtypes: Subtypes of the dataset archive (superset of `subtypes`), from which only `subtypes` are fetched.
+                None is `subtypes`. Jobs on different subtype subsets can share one archive.
+            remote_shards: If True, read items by ranged reads from the (uncompressed) dataset archive in place,
+                without deploying contents locally (e.g. object storage, with `PrefetchDataset` to overlap reads).
+            normalize: If not None, normalize spectrograms per frequency on load with the dataset statistics,
+                `linear` or `log` (log spectrogram normalized with log statistics). Not supported in online mode.
+                `set_normalization` replaces the statistics (e.g. with training split statistics).
         """
 
         # Design Notes:
@@ -78,51 +115,173 @@ class JSSS_spec(Dataset): # I failed to understand this error
         #   Dataset archive name:
         #     Dataset contents differ based on argument, so archive should differ when arguments differ.
         #     It is guaranteed by name by argument hash.
+        #   Dataset format:
+        #     Spectrograms/waveforms are packed into per-subtype shards, and read through memmap.
+        #     Non-default storage formats are added to the archive hash (default keeps the hash of float32 archives).
+        #   Online mode:
+        #     Dataset contents are waveforms only, so STFT/mel parameters are not in the archive hash.
+        #     Parameter sweeps reuse the same archive without rebuild.
+        #   Variants:
+        #     Multi-variant store is identified by variants (not by selected one), so sweeps share one build and archive.
+        #   Lazy initialization:
+        #     Construction only resolves arguments (no I/O), and contents are deployed by `prepare` (explicitly or on first access).
+        #     Pickled dataset carries only arguments and ids, and shards are reopened in each DataLoader worker.
+        #   Remote shards:
+        #     Uncompressed archive keeps the shard layout, so it is read in place by ranged reads instead of deployed.
+        #   Statistics:
+        #     Per-item moments are computed while packing and persisted with shards, so statistics need no pass over items.
+        #     Normalization is applied on load before padding (padded frames stay the mean) and before `transform`.
 
         # Store parameters.
         self._train = train
-        self._resample_sr = resample_sr
         self._transform = transform
+        self._segment_length = segment_length
+        self._online = online
+        self._spec_config = spec_config
+        self._storages = {stage_spec.name: spec_storage, stage_wave.name: wave_storage}
+        self._sr = resample_sr if resample_sr is not None else JSSS.sampling_rate
+        if normalize is not None and online:
+            raise ValueError("Spectrogram normalization needs precomputed spectrograms (not online mode).")
+        if normalize not in (None, "linear", "log"):
+            raise ValueError(f"Unknown normalization mode: {normalize}")
+        self._normalize = normalize
 
-        self._corpus = JSSS(corpus_adress, download_corpus)
-        arg_hash = hash_args(subtypes, resample_sr)
-        JSSS_spec_root = Path(".")/"tmp"/"JSSS_spec"
-        self._path_contents_local = JSSS_spec_root/"contents"/arg_hash
-        dataset_dir_adress = dataset_dir_adress if dataset_dir_adress else str(JSSS_spec_root/"archive")
-        dataset_archive_adress = f"{dataset_dir_adress}/{arg_hash}.zip"
-
-        # Prepare data identities.
-        self._ids: List[ItemIdJSSS] = list(filter(lambda id: id.subtype in subtypes, self._corpus.get_identities()))
-
-        # Deploy dataset contents.
-        contents_acquired = try_to_acquire_archive_contents(dataset_archive_adress, self._path_contents_local)
-        if not contents_acquired:
-            # Generate the dataset contents from corpus
-            print("Dataset archive file is not found. Automatically generating new dataset...")
-            self._generate_dataset_contents()
-            save_archive(self._path_contents_local, dataset_archive_adress)
-            print("Dataset contents was generated and archive was saved.")
+        corpus = JSSS(corpus_adress, download_corpus)
+        archive_subtypes = resolve_archive_subtypes(subtypes, archive_subtypes, archive_compression, remote_shards)
+        if variants is None:
+            spec_storage.validate(waveform=False)
+            wave_storage.validate(waveform=True)
+        else:
+            variants.spec_storage.validate(waveform=False)
+            variants.wave_storage.validate(waveform=True)
+        if variants is None:
+            if not online and spec_config != SpecConfig():
+                raise ValueError(f"Precomputed spectrogram supports only default `SpecConfig` without variants, but got {spec_config}.")
+            mode_args = ["online"] if online else []
+            storage_args = [tuple(spec_storage), tuple(wave_storage)] if (spec_storage, wave_storage) != (Storage(), Storage()) else []
+            arg_hash = hash_args(archive_subtypes, resample_sr, "shard", *mode_args, *storage_args)
+            JSSS_spec_root = Path(".")/"tmp"/"JSSS_spec"
+        else:
+            if resample_sr not in variants.resample_srs:
+                raise ValueError(f"resample_sr {resample_sr} is not in the variants {variants.resample_srs}.")
+            if not online and spec_config not in variants.spec_configs:
+                raise ValueError(f"spec_config {spec_config} is not in the variants {variants.spec_configs}.")
+            arg_hash = hash_args(archive_subtypes, *variants.hash_args())
+            JSSS_spec_root = Path(".")/"tmp"/"JSSS_variants"
+        self._init_contents(corpus, resample_sr, subtypes, archive_subtypes, variants, JSSS_spec_root, arg_hash,
+            dataset_dir_adress, cache, n_workers, upload_archive, archive_compression, remote_shards)
+
+        # Normalization arguments (mode, mean, std), pickled into DataLoader workers
+        self._norm: Optional[Tuple[str, Tensor, Tensor]] = None
+
+    def prepare(self) -> None:
+        """Deploy dataset contents (fetch the archive, or generate and archive them) and open them.
+
+        Called on first access if not called explicitly. Call it before DataLoader workers start,
+        so that contents are deployed (and `SharedCache` is preloaded) only once.
+        Normalization statistics (if `normalize`) are loaded here too.
+        """
+
+        super().prepare()
+        if self._normalize is not None and self._norm is None:
+            self._norm = get_normalizer(self.get_stats(), self._normalize)
+
+    def _features(self) -> List[str]:
+        # Online mode has waveform shards only.
+        return [stage_wave.name] if self._online else [self._spec_config.name, stage_wave.name]
+
+    def _cache_keys(self) -> List[Tuple[str, Subtype, int]]:
+        # Waveforms are needed only in test mode.
+        features = [self._spec_config.name] if self._train else [self._spec_config.name, stage_wave.name]
+        return [(feature, id.subtype, id.serial_num) for feature in features for id in self._ids]
 
     def _generate_dataset_contents(self) -> None:
         """Generate dataset with corpus auto-download and preprocessing.
+
+        Items already in the build cache (previous/interrupted/overlapping builds) are not preprocessed again.
+        All items of the archive subtypes are generated.
         """
 
-        self._corpus.get_contents()
-        print("Preprocessing...")
-        for id in self._ids:
-            path_wav = self._corpus.get_item_path(id)
-            preprocess_as_spec(path_wav, id, self._path_contents_local, self._resample_sr)
-            preprocess_as_wave(path_wav, id, self._path_contents_local, self._resample_sr)
+        ids = self._get_archive_ids()
+
+        if self._variants is not None:
+            build_variants(self._corpus, ids, self._variants, self._path_contents_local, self._n_workers)
+            return
+
+        stages = [stage_wave] if self._online else [stage_spec, stage_wave]
+        cache = ItemCache(Path(".")/"tmp"/"JSSS_cache", resample_sr=self._resample_sr)
+        ids_todo = cache.missing(ids, stages)
+        print(f"Preprocessing... ({len(ids) - len(ids_todo)} items cached, {len(ids_todo)} items to process)")
+        if len(ids_todo) > 0:
+            self._corpus.get_contents(list(dict.fromkeys(id.subtype for id in ids_todo)))
+            # Length-grouped batches for batched STFT
+            index = self._corpus.get_index()
+            batches = batch_by_length([index.num_samples[index.get_row(id)] for id in ids_todo])
+            items = [([self._corpus.get_item_path(ids_todo[i]) for i in batch], [ids_todo[i] for i in batch]) for batch in batches]
+            process = partial(Pipeline(stages, self._resample_sr).process_batch, dir_dataset=cache.dir)
+            preprocess_items(process, items, self._n_workers, chunksize=1)
+        cache.commit(ids, stages)
+        for stage in stages:
+            pack_shards(cache.dir, self._path_contents_local, ids, stage, self._storages[stage.name])
         print("Preprocessed.")
 
+    def _load_whole(self, key: Tuple[str, Subtype, int]) -> Tensor:
+        """Load whole item feature of a cache key."""
+        feature, subtype, serial_num = key
+        shards = self._open_shards()
+        if feature == stage_wave.name or not self._online:
+            return shards[feature][subtype].get(serial_num)
+        return compute_feature(shards[stage_wave.name][subtype].get(serial_num), self._spec_config, self._sr)
+
+    def _load_spec(self, id: ItemIdJSSS, start: int, n_frame: Optional[int]) -> Tensor:
+        """Load frames [start, start + n_frame) of the spectrogram (whole item if n_frame is None)."""
+        if not self._online:
+            return read_cached(self._cache, self._open_shards()[self._spec_config.name][id.subtype], self._spec_config.name, id, start, n_frame)
+        if self._cache is not None:
+            # Memoize the whole item, so that random segments of the item hit the memo.
+            key = (self._spec_config.name, id.subtype, id.serial_num)
+            spec = self._cache.get(key, lambda: self._load_whole(key))
+            return spec[:, start:] if n_frame is None else spec[:, start : start + n_frame]
+        waves = self._open_shards()[stage_wave.name][id.subtype]
+        if n_frame is None:
+            return compute_feature(waves.get(id.serial_num), self._spec_config, self._sr)
+        # Compute only the segment frames from a part of the waveform.
+        read = lambda start_sample, n_sample: waves.get(id.serial_num, start_sample, n_sample)
+        return compute_feature_range(read, waves.length(id.serial_num), start, n_frame, self._spec_config, self._sr)
+
+    def _n_frame(self, id: ItemIdJSSS) -> int:
+        shards = self._open_shards()
+        if self._online:
+            return shards[stage_wave.name][id.subtype].length(id.serial_num) // self._spec_config.hop + 1
+        return shards[self._spec_config.name][id.subtype].length(id.serial_num)
+
     def _load_datum(self, id: ItemIdJSSS) -> Union[Datum_JSSS_spec_train, Datum_JSSS_spec_test]:
-        spec_path = get_dataset_spec_path(self._path_contents_local, id)
-        spec: Tensor = self._transform(load(spec_path))
+        waves = self._get_shards()[stage_wave.name][id.subtype]
+        hop = self._spec_config.hop
+        if self._segment_length is None:
+            start, n_frame = 0, None
+        else:
+            # Read only the segment range from the shard.
+            start = random.randrange(max(self._n_frame(id) - self._segment_length, 0) + 1)
+            n_frame = self._segment_length
+        spec: Tensor = self._load_spec(id, start, n_frame)
+        if self._norm is not None:
+            with profiling.span("normalize"):
+                spec = normalize(spec, *self._norm)
+        if n_frame is not None:
+            spec = pad(spec, (0, n_frame - spec.size(-1)))
+        with profiling.span("transform"):
+            spec = self._transform(spec)
         # todo: trains/evals
         if self._train:
             return Datum_JSSS_spec_train(spec, f"{id.subtype}-{id.serial_num}")
         else:
-            waveform: Tensor = load(get_dataset_wave_path(self._path_contents_local, id))
+            if n_frame is None:
+                waveform: Tensor = read_cached(self._cache, waves, stage_wave.name, id)
+            else:
+                # frame t <-> samples [t*hop, (t+1)*hop)
+                waveform = read_cached(self._cache, waves, stage_wave.name, id, start * hop, n_frame * hop)
+                waveform = pad(waveform, (0, n_frame * hop - waveform.size(-1)))
             return Datum_JSSS_spec_test(waveform, spec, f"{id.subtype}-{id.serial_num}")
 
     def __getitem__(self, n: int) -> Union[Datum_JSSS_spec_train, Datum_JSSS_spec_test]:
@@ -130,10 +289,48 @@ class JSSS_spec(Dataset): # I failed to understand this error
         Args:
             n : The index of the datum to be loaded
         """
-        return self._load_datum(self._ids[n])
+        with profiling.span("getitem"):
+            return self._load_datum(self._ids[n])
+
+    def get_lengths(self) -> List[int]:
+        """Get spectrogram frame lengths of all items (from shard index, without loading)."""
+        self._get_shards()
+        return [self._n_frame(id) for id in self._ids]
 
-    def __len__(self) -> int:
-        return len(self._ids)
+    def get_stats(self, indices: Optional[Sequence[int]] = None, feature: Optional[str] = None) -> FeatureStats:
+        """Get statistics of items, merged from per-item moments persisted with the dataset (no pass over items).
+
+        Args:
+            indices: Dataset indices of the items (e.g. training split). None is all items.
+            feature: Spectrogram (`spec_config.name`, default) or waveform (`wave`).
+        Returns:
+            Per-frequency moments and item lengths [frame] (durations with `length_histogram(step_sec=hop/sr)`).
+        """
+
+        feature = feature if feature is not None else self._spec_config.name
+        if self._online and feature != stage_wave.name:
+            raise ValueError("Spectrogram statistics need precomputed spectrograms (not online mode).")
+        ids = self._ids if indices is None else [self._ids[i] for i in indices]
+        return merge_item_stats(ids, partial(self._get_moments, feature))
+
+    def get_subtype_stats(self, feature: Optional[str] = None) -> Dict[Subtype, FeatureStats]:
+        """Get statistics of each subtype."""
+        return {
+            subtype: self.get_stats([i for i, id in enumerate(self._ids) if id.subtype == subtype], feature)
+            for subtype in self._subtypes
+        }
+
+    def set_normalization(self, stats: Optional[FeatureStats], mode: str = "log") -> None:
+        """Set spectrogram normalization on load (None disables it), e.g. with `get_stats(train_indices)`.
+
+        Set it before DataLoader workers start, so that workers get it.
+
+        Args:
+            stats: Spectrogram statistics.
+            mode: `linear` or `log`.
+        """
+        self._norm = get_normalizer(stats, mode) if stats is not None else None
+        self._normalize = mode if stats is not None else None
 
 
 if __name__ == "__main__":
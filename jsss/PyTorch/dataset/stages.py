@@ -0,0 +1,44 @@
+"""
+# Feature stages
+Stages of JSSS datasets, shared by single-config datasets and multi-variant builds.
+"""
+
+from functools import partial
+from pathlib import Path
+
+from .pipeline import SpecConfig, Stage, as_waveform, compute_feature, to_spectrogram, to_spectrograms
+from ...corpus import ItemIdJSSS
+
+
+def get_dataset_wave_path(dir_dataset: Path, id: ItemIdJSSS) -> Path:
+    """Path of per-item waveform file, which is packed into shard after preprocessing."""
+    return dir_dataset / id.subtype / "waves" / f"{id.serial_num}.wave.pt"
+
+
+def get_dataset_spec_path(dir_dataset: Path, id: ItemIdJSSS) -> Path:
+    """Path of per-item spectrogram file, which is packed into shard after preprocessing."""
+    return dir_dataset / id.subtype / "specs" / f"{id.serial_num}.spec.pt"
+
+
+def get_dataset_feature_path(dir_dataset: Path, id: ItemIdJSSS, feature: str) -> Path:
+    """Path of per-item feature file of a named feature (e.g. `SpecConfig.name`)."""
+    return dir_dataset / id.subtype / feature / f"{id.serial_num}.pt"
+
+
+stage_wave = Stage("wave", as_waveform, get_dataset_wave_path)
+stage_spec = Stage("spec", to_spectrogram, get_dataset_spec_path, to_spectrograms)
+
+
+def get_spec_stage(config: SpecConfig, sr: int) -> Stage:
+    """Get spectrogram stage of the config.
+
+    Default config is `stage_spec` (batched STFT). Other configs are named by the config, so they never collide.
+
+    Args:
+        config: STFT/mel parameters.
+        sr: Sampling rate of the waveform (used by mel filterbank).
+    """
+
+    if config == SpecConfig():
+        return stage_spec
+    return Stage(config.name, partial(compute_feature, config=config, sr=sr), partial(get_dataset_feature_path, feature=config.name))
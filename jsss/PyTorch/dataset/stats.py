@@ -0,0 +1,215 @@
+"""
+# Dataset statistics
+Per-item moments of a feature are computed while packing shards (no extra pass over corpus or dataset),
+and persisted next to the shard (`<subtype>/<feature>.stats.npz`), so they travel with the dataset archive.
+Per-item moments are merged exactly (parallel Welford, Chan et al.) into statistics of any item set,
+e.g. a subtype, the whole dataset or a training split.
+
+Moments are per feature bin (e.g. frequency) over all time steps, of values and, for non-negative features
+(spectrogram), of log values (`log(max(x, eps))`). Moments are stored in float64.
+"""
+
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+import io
+
+import fsspec
+import numpy as np
+import torch
+from torch import Tensor
+
+from ...corpus import ItemIdJSSS, Subtype
+
+
+# Floor of log values, same as log-compressed storage
+_log_eps = 1e-10
+
+
+class FeatureStats(NamedTuple):
+    """Statistics of a feature over items.
+
+    Args:
+        n_steps: Total number of time steps.
+        mean: Per-bin mean over all time steps :: [Feat...]
+        var: Per-bin (population) variance :: [Feat...]
+        log_mean: Per-bin mean of log values :: [Feat...] (None for signed features, e.g. waveform)
+        log_var: Per-bin variance of log values :: [Feat...] (None for signed features)
+        lengths: Time length of each item :: (Item,)
+    """
+
+    n_steps: int
+    mean: np.ndarray
+    var: np.ndarray
+    log_mean: Optional[np.ndarray]
+    log_var: Optional[np.ndarray]
+    lengths: np.ndarray
+
+    @property
+    def std(self) -> np.ndarray:
+        return np.sqrt(self.var)
+
+    @property
+    def log_std(self) -> Optional[np.ndarray]:
+        return np.sqrt(self.log_var) if self.log_var is not None else None
+
+    def length_histogram(self, bins=32, step_sec: float = 1.0) -> Tuple[np.ndarray, np.ndarray]:
+        """Histogram of item lengths (`numpy.histogram`).
+
+        Args:
+            bins: Number of bins or bin edges.
+            step_sec: Duration of a time step [sec] (e.g. `1 / sr` for waveform, `hop / sr` for spectrogram),
+                with which the histogram is of item durations [sec]. 1.0 is of lengths [step].
+        Returns:
+            Counts and bin edges.
+        """
+        return np.histogram(self.lengths * step_sec, bins)
+
+
+class ItemMoments(NamedTuple):
+    """Per-item moments of a feature.
+
+    Args:
+        serial_nums: Serial number of each item :: (Item,)
+        n_steps: Time length of each item :: (Item,)
+        mean: Per-bin mean of each item :: (Item, Feat...)
+        m2: Per-bin sum of squared deviations of each item :: (Item, Feat...)
+        log_mean: `mean` of log values (None for signed features, e.g. waveform).
+        log_m2: `m2` of log values (None for signed features).
+    """
+
+    serial_nums: np.ndarray
+    n_steps: np.ndarray
+    mean: np.ndarray
+    m2: np.ndarray
+    log_mean: Optional[np.ndarray]
+    log_m2: Optional[np.ndarray]
+
+    def save(self, path: str) -> None:
+        with open(path, "wb") as f:
+            np.savez_compressed(f, **{field: array for field, array in self._asdict().items() if array is not None})
+
+    @classmethod
+    def load(cls, adress: str) -> "ItemMoments":
+        """Load moments from local path or remote adress (through `fsspec`)."""
+        with fsspec.open(adress, "rb") as f:
+            with np.load(io.BytesIO(f.read())) as arrays:
+                return cls(*(arrays[field] if field in arrays else None for field in cls._fields))
+
+    @classmethod
+    def concat(cls, moments: List["ItemMoments"]) -> "ItemMoments":
+        if len(moments) == 0:
+            raise ValueError("No moments to concatenate.")
+        return cls(*(np.concatenate(arrays) if arrays[0] is not None else None for arrays in zip(*moments)))
+
+    def rows(self, serial_nums: Sequence[int]) -> np.ndarray:
+        """Rows of the items."""
+        positions = {int(num): row for row, num in enumerate(self.serial_nums)}
+        return np.array([positions[num] for num in serial_nums], dtype=np.int64)
+
+    def select(self, rows: np.ndarray) -> "ItemMoments":
+        """Moments of the rows."""
+        return ItemMoments(*(array[rows] if array is not None else None for array in self))
+
+    def merge(self, rows: Optional[np.ndarray] = None) -> FeatureStats:
+        """Merge moments of the rows (all rows if None) into statistics (exact up to float64 rounding, vectorized)."""
+
+        rows = rows if rows is not None else np.arange(len(self.serial_nums))
+        if len(rows) == 0:
+            raise ValueError("Statistics of no items.")
+        n = self.n_steps[rows].astype(np.float64)
+        n_total = n.sum()
+        weight = n.reshape(-1, *([1] * (self.mean.ndim - 1)))
+        merged: List[Optional[np.ndarray]] = []
+        for mean, m2 in [(self.mean, self.m2), (self.log_mean, self.log_m2)]:
+            if mean is None or m2 is None:
+                merged += [None, None]
+                continue
+            mean, m2 = mean[rows].astype(np.float64), m2[rows].astype(np.float64)
+            mean_total = (weight * mean).sum(axis=0) / max(n_total, 1)
+            m2_total = m2.sum(axis=0) + (weight * (mean - mean_total) ** 2).sum(axis=0)
+            merged += [mean_total, m2_total / max(n_total, 1)]
+        return FeatureStats(int(n_total), *merged, self.n_steps[rows].copy())
+
+
+class MomentsAccumulator:
+    """Streaming accumulator of per-item moments, fed item by item (e.g. while packing)."""
+
+    def __init__(self, log: bool):
+        """
+        Args:
+            log: Whether to accumulate moments of log values too (for non-negative features, e.g. spectrogram).
+        """
+        self._serial_nums: List[int] = []
+        self._n_steps: List[int] = []
+        self._prefixes = ["", "log_"] if log else [""]
+        self._moments: Dict[str, List[np.ndarray]] = {f"{prefix}{field}": [] for prefix in self._prefixes for field in ["mean", "m2"]}
+
+    def add(self, serial_num: int, feature: Tensor) -> None:
+        """Add an item.
+
+        Args:
+            serial_num: Serial number of the item.
+            feature: Time-major feature :: [Time, Feat...]
+        """
+
+        values = feature.double()
+        self._serial_nums.append(serial_num)
+        self._n_steps.append(values.size(0))
+        for prefix in self._prefixes:
+            x = values if prefix == "" else torch.log(torch.clamp(values, min=_log_eps))
+            mean = x.mean(dim=0) if x.size(0) > 0 else torch.zeros(x.shape[1:], dtype=torch.float64)
+            self._moments[f"{prefix}mean"].append(mean.numpy())
+            self._moments[f"{prefix}m2"].append(((x - mean) ** 2).sum(dim=0).numpy())
+
+    def result(self) -> ItemMoments:
+        """Moments of added items."""
+        moments = {field: np.array(arrays, dtype=np.float64) for field, arrays in self._moments.items()}
+        return ItemMoments(np.array(self._serial_nums, dtype=np.int64), np.array(self._n_steps, dtype=np.int64),
+            moments["mean"], moments["m2"], moments.get("log_mean"), moments.get("log_m2"))
+
+
+def merge_item_stats(ids: Sequence[ItemIdJSSS], get_moments: Callable[[Subtype], ItemMoments]) -> FeatureStats:
+    """Statistics of items, merged from per-subtype moments.
+
+    Args:
+        ids: Items.
+        get_moments: Per-item moments of a subtype (e.g. loaded by `load_moments`).
+    Raises:
+        ValueError: When no item is selected.
+    """
+
+    if len(ids) == 0:
+        raise ValueError("Statistics of no items.")
+    selected = []
+    for subtype in dict.fromkeys(id.subtype for id in ids):
+        moments = get_moments(subtype)
+        selected.append(moments.select(moments.rows([id.serial_num for id in ids if id.subtype == subtype])))
+    return ItemMoments.concat(selected).merge()
+
+
+def normalize(feature: Tensor, mode: str, mean: Tensor, std: Tensor) -> Tensor:
+    """Normalize a feature :: [Feat..., Time] with per-bin statistics :: [Feat..., 1] (fused, never in-place on input).
+
+    Args:
+        mode: `linear` (`(x - mean) / std`) or `log` (`(log(max(x, eps)) - log_mean) / log_std`, with log statistics).
+    """
+    if mode == "log":
+        return torch.log(torch.clamp(feature, min=_log_eps)).sub_(mean).div_(std)
+    return (feature - mean).div_(std)
+
+
+def get_normalizer(stats: FeatureStats, mode: str) -> Tuple[str, Tensor, Tensor]:
+    """Normalization arguments (mode, mean, std) of `normalize` from statistics.
+
+    Args:
+        stats: Feature statistics.
+        mode: `linear` or `log`.
+    """
+
+    if mode not in ("linear", "log"):
+        raise ValueError(f"Unknown normalization mode: {mode}")
+    if mode == "log" and stats.log_mean is None:
+        raise ValueError("Log normalization needs log statistics (non-negative feature).")
+    mean, std = (stats.log_mean, stats.log_std) if mode == "log" else (stats.mean, stats.std)
+    # [Feat...] -> [Feat..., 1], zero variance bins are not scaled
+    to_tensor = lambda array: torch.from_numpy(array.astype(np.float32)).unsqueeze(-1)
+    return mode, to_tensor(mean), to_tensor(np.where(std > 0, std, 1.0))
@@ -0,0 +1,165 @@
+"""
+# Streaming datasets
+Items are read directly from the corpus archive (local path or remote `fsspec` adress) without extraction.
+Only the zip central directory and the requested members are fetched, so iteration starts immediately.
+Features are computed on the fly with the same pipeline functions as preprocessed datasets.
+"""
+
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple, TypeVar, Union
+from abc import ABC, abstractmethod
+import io
+import random
+import wave
+import zipfile
+
+import numpy as np
+import fsspec
+from torch import Tensor, from_numpy
+from torch.utils.data import IterableDataset, get_worker_info
+
+from .loader import identity
+from .pipeline import resample, to_spectrogram
+from .spectrogram import Datum_JSSS_spec_train, Datum_JSSS_spec_test
+from .waveform import Datum_JSSS_wave
+from ... import profiling
+from ...corpus import ItemIdJSSS, Subtype, JSSS
+
+
+T = TypeVar("T")
+
+
+def decode_wav(data: bytes) -> Tuple[Tensor, int]:
+    """Decode 16bit PCM wav bytes into normalized waveform :: [Channel, Length] and sampling rate (same as `torchaudio.load`)."""
+
+    with wave.open(io.BytesIO(data), "rb") as w:
+        if w.getsampwidth() != 2:
+            raise ValueError(f"JSSS corpus should be 16bit PCM, but got {8 * w.getsampwidth()}bit.")
+        n_channel, sr = w.getnchannels(), w.getframerate()
+        frames = w.readframes(w.getnframes())
+    pcm = np.frombuffer(frames, dtype="<i2").reshape(-1, n_channel).T
+    return from_numpy(pcm.astype(np.float32) / 32768), sr
+
+
+def shuffle_buffer(items: Iterable[T], size: int, rng: random.Random) -> Iterator[T]:
+    """Approximately shuffle a stream with bounded buffer.
+
+    Args:
+        items: Item stream.
+        size: Buffer size. 0 or 1 yield items as is.
+        rng: Random number generator.
+    """
+
+    buffer: List[T] = []
+    for item in items:
+        if len(buffer) < size:
+            buffer.append(item)
+            continue
+        idx = rng.randrange(size)
+        yield buffer[idx]
+        buffer[idx] = item
+    rng.shuffle(buffer)
+    yield from buffer
+
+
+class _JSSS_stream(IterableDataset, ABC):
+    """Base of streaming datasets, which read items directly from the corpus archive.
+    """
+
+    def __init__(
+        self,
+        resample_sr: Optional[int],
+        subtypes: List[Subtype] = ["short-form/basic5000"],
+        download_corpus: bool = False,
+        corpus_adress: Optional[str] = None,
+        transform: Callable[[Tensor], Tensor] = identity,
+        shuffle_buffer_size: int = 0,
+        seed: int = 0,
+    ):
+        """
+        Args:
+            resample_sr: If not None, resample with specified sampling rate.
+            subtypes: Sub corpus types.
+            download_corpus: Whether download the corpus or not when corpus archive is not found.
+            corpus_adress: URL/localPath of corpus archive (remote url, like `s3::`, can be used). None use default URL.
+            transform: Tensor transform on load.
+            shuffle_buffer_size: Size of shuffle buffer. 0 yield items in corpus order.
+            seed: Random seed of shuffle (combined with epoch and worker id). Epoch advances on each iteration,
+                but non-persistent DataLoader workers iterate a fresh copy of the dataset, so call `set_epoch` with them.
+        """
+
+        self._resample_sr = resample_sr
+        self._transform = transform
+        self._shuffle_buffer_size = shuffle_buffer_size
+        self._seed = seed
+        self._epoch = 0
+
+        self._corpus = JSSS(corpus_adress, download_corpus)
+        # Prepare data identities (in-memory identity index, without index I/O).
+        identities = self._corpus.get_identity_index()
+        self._ids: List[ItemIdJSSS] = identities.get_ids(identities.select(subtypes))
+
+        # Forward archive only when absent (no extraction).
+        archive = fsspec.open(self._corpus.adress)
+        if download_corpus and not archive.fs.exists(archive.path):
+            self._corpus.forward_from_origin()
+
+    def set_epoch(self, epoch: int) -> None:
+        """Set epoch for shuffle (like `DistributedSampler.set_epoch`)."""
+        self._epoch = epoch
+
+    @abstractmethod
+    def _make_datum(self, id: ItemIdJSSS, waveform: Tensor):
+        """Make a datum of an item from its (resampled) waveform :: [Length,]."""
+
+    def _iter_data(self, ids: List[ItemIdJSSS]):
+        with fsspec.open(self._corpus.adress, "rb") as f, zipfile.ZipFile(f) as archive:
+            for id in ids:
+                with profiling.span("archive.read") as span:
+                    data = archive.read(self._corpus.get_item_member(id))
+                    span.add_bytes(len(data))
+                with profiling.span("decode", len(data)):
+                    waveform, sr = decode_wav(data)
+                yield self._make_datum(id, resample(waveform, sr, self._resample_sr))
+
+    def __iter__(self):
+        # Per-worker sharding: worker k reads items k, k+N, k+2N, ...
+        worker_info = get_worker_info()
+        worker_id, n_worker = (worker_info.id, worker_info.num_workers) if worker_info is not None else (0, 1)
+        data = self._iter_data(self._ids[worker_id::n_worker])
+        if self._shuffle_buffer_size > 1:
+            rng = random.Random(f"{self._seed}-{self._epoch}-{worker_id}")
+            data = shuffle_buffer(data, self._shuffle_buffer_size, rng)
+        # Reshuffle in next epoch even if `set_epoch` is not called.
+        self._epoch += 1
+        return iter(data)
+
+
+class JSSS_wave_stream(_JSSS_stream):
+    """Audio waveform dataset streamed from JSSS corpus archive.
+
+    This dataset yield (audio, label).
+    """
+
+    def _make_datum(self, id: ItemIdJSSS, waveform: Tensor) -> Datum_JSSS_wave:
+        return Datum_JSSS_wave(self._transform(waveform), f"{id.subtype}-{id.serial_num}")
+
+
+class JSSS_spec_stream(_JSSS_stream):
+    """Audio spectrogram dataset streamed from JSSS corpus archive.
+    """
+
+    def __init__(self, train: bool, *args, **kwargs):
+        """
+        Args:
+            train: train_dataset if True else validation/test_dataset.
+            others: Same as `JSSS_wave_stream`.
+        """
+        super().__init__(*args, **kwargs)
+        self._train = train
+
+    def _make_datum(self, id: ItemIdJSSS, waveform: Tensor) -> Union[Datum_JSSS_spec_train, Datum_JSSS_spec_test]:
+        spec: Tensor = self._transform(to_spectrogram(waveform))
+        if self._train:
+            return Datum_JSSS_spec_train(spec, f"{id.subtype}-{id.serial_num}")
+        else:
+            return Datum_JSSS_spec_test(waveform, spec, f"{id.subtype}-{id.serial_num}")
@@ -0,0 +1,88 @@
+"""
+# Multi-variant dataset store
+One build makes features of several sampling rates and spectrogram configs.
+Each source wav is decoded once and fanned out to all variants, which are packed into one store (one archive).
+Datasets select a variant at load time (`get_variant_dir` and feature name).
+
+Store layout: `<contents>/sr<resample_sr|orig>/<subtype>/<feature>.bin` (+ index), feature is `wave` or `SpecConfig.name`.
+"""
+
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from pathlib import Path
+
+from .itemcache import ItemCache
+from .pipeline import Pipeline, SpecConfig, Stage, VariantPipeline
+from .preprocess import batch_by_length, preprocess_items
+from .shard import Storage, pack_shards
+from .stages import get_spec_stage, stage_wave
+from ...corpus import ItemIdJSSS, JSSS
+
+
+class Variants(NamedTuple):
+    """Variants of a multi-variant dataset store.
+
+    Args:
+        resample_srs: Sampling rates (None is the original sampling rate).
+        spec_configs: Spectrogram configs, which are computed for all sampling rates (empty for waveform only).
+        wave_storage: On-disk waveform format.
+        spec_storage: On-disk spectrogram format.
+    """
+
+    resample_srs: Tuple[Optional[int], ...] = (None,)
+    spec_configs: Tuple[SpecConfig, ...] = ()
+    wave_storage: Storage = Storage()
+    spec_storage: Storage = Storage()
+
+    def hash_args(self) -> List[object]:
+        """Arguments which identify the store (for archive name)."""
+        return ["variants", tuple(self.resample_srs), tuple(map(tuple, self.spec_configs)),
+            tuple(self.wave_storage), tuple(self.spec_storage)]
+
+    def get_stages(self, resample_sr: Optional[int]) -> List[Stage]:
+        """Stages of a sampling rate variant."""
+        sr = resample_sr if resample_sr is not None else JSSS.sampling_rate
+        return [stage_wave] + [get_spec_stage(config, sr) for config in self.spec_configs]
+
+
+def get_variant_dir(dir_contents: Path, resample_sr: Optional[int]) -> Path:
+    """Directory of a sampling rate variant in the store."""
+    return dir_contents / f"sr{resample_sr if resample_sr is not None else 'orig'}"
+
+
+def build_variants(corpus: JSSS, ids: List[ItemIdJSSS], variants: Variants, dir_contents: Path, n_workers: Optional[int] = 1) -> None:
+    """Build multi-variant dataset contents.
+
+    Per-item outputs go to the build cache of each sampling rate (shared with single-variant builds),
+    so items already built by any build are not decoded again.
+
+    Args:
+        corpus: Corpus.
+        ids: Items of the dataset.
+        variants: Variants to be built.
+        dir_contents: Dataset contents directory, into which all variants are packed.
+        n_workers: Number of preprocessing processes. None use all CPU cores.
+    """
+
+    caches: Dict[Optional[int], ItemCache] = {
+        sr: ItemCache(Path(".")/"tmp"/"JSSS_cache", resample_sr=sr) for sr in variants.resample_srs
+    }
+    todo = set()
+    for sr, cache in caches.items():
+        todo.update(cache.missing(ids, variants.get_stages(sr)))
+    ids_todo = [id for id in ids if id in todo]
+    print(f"Preprocessing {len(caches)} sampling rates x {1 + len(variants.spec_configs)} features... "
+        f"({len(ids) - len(ids_todo)} items cached, {len(ids_todo)} items to process)")
+    if len(ids_todo) > 0:
+        corpus.get_contents(list(dict.fromkeys(id.subtype for id in ids_todo)))
+        index = corpus.get_index()
+        batches = batch_by_length([index.num_samples[index.get_row(id)] for id in ids_todo])
+        items = [([corpus.get_item_path(ids_todo[i]) for i in batch], [ids_todo[i] for i in batch]) for batch in batches]
+        pipelines = [(Pipeline(variants.get_stages(sr), sr), cache.dir) for sr, cache in caches.items()]
+        preprocess_items(VariantPipeline(pipelines).process_batch, items, n_workers, chunksize=1)
+    for sr, cache in caches.items():
+        stages = variants.get_stages(sr)
+        cache.commit(ids, stages)
+        for stage in stages:
+            storage = variants.wave_storage if stage.name == stage_wave.name else variants.spec_storage
+            pack_shards(cache.dir, get_variant_dir(dir_contents, sr), ids, stage, storage)
+    print("Preprocessed.")
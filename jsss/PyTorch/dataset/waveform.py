@@ -6,21 +6,27 @@ For example, JSUT corpus contains waves, and can be processed into JSUT-spec dat
 """
 
 # from typing import Callable, List, Literal, NamedTuple # >= Python3.8
-from typing import Callable, List, NamedTuple, Optional
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+from functools import partial
 from pathlib import Path
-
-from torch import Tensor, save, load
-from torch.utils.data import Dataset
-# currently there is no stub in torchaudio [issue](https://github.com/pytorch/audio/issues/615)
-from torchaudio import load as load_wav
-from torchaudio.transforms import Resample
-from corpuspy.components.archive import hash_args, save_archive, try_to_acquire_archive_contents
-
+import random
+
+from torch import Tensor
+from torch.nn.functional import pad
+from corpuspy.components.archive import hash_args
+
+from .pipeline import Pipeline
+from .cache import RAMCache, read_cached
+from .itemcache import ItemCache
+from .loader import identity
+from .preprocess import preprocess_items
+from .shard import Storage, pack_shards
+from .sharded import _JSSS_sharded, resolve_archive_subtypes
+from .stages import get_dataset_wave_path, stage_wave
+from .stats import FeatureStats, merge_item_stats
+from .variants import Variants, build_variants
 from ...corpus import ItemIdJSSS, Subtype, JSSS
-
-
-def get_dataset_wave_path(dir_dataset: Path, id: ItemIdJSSS) -> Path:
-    return dir_dataset / id.subtype / "waves" / f"{id.serial_num}.wave.pt"
+from ... import profiling
 
 
 def preprocess_as_wave(path_wav: Path, id: ItemIdJSSS, dir_dataset: Path, new_sr: Optional[int] = None) -> None:
@@ -29,14 +35,7 @@ def preprocess_as_wave(path_wav: Path, id: ItemIdJSSS, dir_dataset: Path, new_sr
     Before this preprocessing, corpus contents should be deployed.
     """
 
-    waveform, _sr_orig = load_wav(path_wav)
-    if new_sr is not None:
-        waveform = Resample(_sr_orig, new_sr)(waveform)
-    # :: [1, Length] -> [Length,]
-    waveform: Tensor = waveform[0, :]
-    path_wave = get_dataset_wave_path(dir_dataset, id)
-    path_wave.parent.mkdir(parents=True, exist_ok=True)
-    save(waveform, path_wave)
+    Pipeline([stage_wave], new_sr)(path_wav, id, dir_dataset)
 
 
 class Datum_JSSS_wave(NamedTuple):
@@ -47,7 +46,7 @@ class Datum_JSSS_wave(NamedTuple):
     label: str
 
 
-class JSSS_wave(Dataset): # I failed to understand this error
+class JSSS_wave(_JSSS_sharded): # I failed to understand this error
     """Audio waveform dataset from JSSS speech corpus.
 
     This dataset yield (audio, label).
@@ -59,7 +58,16 @@ class JSSS_wave(Dataset): # I failed to understand this error
         download_corpus: bool = False,
         corpus_adress: Optional[str] = None,
         dataset_dir_adress: Optional[str] = None,
-        transform: Callable[[Tensor], Tensor] = (lambda i: i),
+        transform: Callable[[Tensor], Tensor] = identity,
+        n_workers: Optional[int] = 1,
+        segment_length: Optional[int] = None,
+        cache: Optional[RAMCache] = None,
+        storage: Storage = Storage(),
+        upload_archive: bool = True,
+        variants: Optional[Variants] = None,
+        archive_compression: str = "none",
+        archive_subtypes: Optional[List[Subtype]] = None,
+        remote_shards: bool = False,
     ):
         """
         Args:
@@ -69,6 +77,19 @@ class JSSS_wave(Dataset): # I failed to understand this error
             corpus_adress: URL/localPath of corpus archive (remote url, like `s3::`, can be used). None use default URL.
             dataset_dir_adress: URL/localPath of JSSS_wave dataset directory (remote url, like `s3::`, can be used).
             transform: Tensor transform on load.
+            n_workers: Number of preprocessing processes for dataset generation. None use all CPU cores.
+            segment_length: If not None, yield random segment of the length [sample] (zero-padded if an item is shorter).
+            cache: If not None, cache waveforms in RAM (`LRUCache`, or `SharedCache` which is preloaded in `prepare`).
+            storage: On-disk waveform format (e.g. `Storage("int16")`, which is lossless without resampling).
+            upload_archive: Whether to save generated dataset archive to `dataset_dir_adress`
+                (e.g. False except on the global rank zero, so that nodes do not race to upload the same archive).
+            variants: If not None, use multi-variant dataset store, from which `resample_sr` variant is selected
+                (`storage` is ignored, the store has its own formats).
+            archive_compression: Compression of generated dataset archive, `none`, `zlib` or `zstd` (needs `zstandard`).
+            archive_subtypes: Subtypes of the dataset archive (superset of `subtypes`), from which only `subtypes` are fetched.
+                None is `subtypes`. Jobs on different subtype subsets can share one archive.
+            remote_shards: If True, read items by ranged reads from the (uncompressed) dataset archive in place,
+                without deploying contents locally (e.g. object storage, with `PrefetchDataset` to overlap reads).
         """
 
         # Design Notes:
@@ -77,54 +98,116 @@ class JSSS_wave(Dataset): # I failed to understand this error
         #   Download:
         #     Dataset is often saved in the private adress, so there is no `download_dataset` safety flag.
         #     `download` is common option in torchAudio datasets.
+        #   Dataset format:
+        #     Waveforms are packed into per-subtype shards, and read through memmap.
+        #     Non-default storage format is added to the archive hash (default keeps the hash of float32 archives).
+        #   Variants:
+        #     Multi-variant store is identified by variants (not by selected one), so sweeps share one build and archive.
+        #   Lazy initialization:
+        #     Construction only resolves arguments (no I/O), and contents are deployed by `prepare` (explicitly or on first access).
+        #     Pickled dataset carries only arguments and ids, and shards are reopened in each DataLoader worker.
+        #   Remote shards:
+        #     Uncompressed archive keeps the shard layout, so it is read in place by ranged reads instead of deployed.
+        #   Statistics:
+        #     Per-item moments are computed while packing and persisted with shards, so statistics need no pass over items.
 
         # Store parameters.
-        self._resample_sr = resample_sr
         self._transform = transform
-
-        self._corpus = JSSS(corpus_adress, download_corpus)
-        arg_hash = hash_args(subtypes, resample_sr)
-        JSSS_wave_root = Path(".")/"tmp"/"JSSS_wave"
-        self._path_contents_local = JSSS_wave_root/"contents"/arg_hash
-        dataset_dir_adress = dataset_dir_adress if dataset_dir_adress else str(JSSS_wave_root/"archive")
-        dataset_archive_adress = f"{dataset_dir_adress}/{arg_hash}.zip"
-
-        # Prepare data identities.
-        self._ids: List[ItemIdJSSS] = list(filter(lambda id: id.subtype in subtypes, self._corpus.get_identities()))
-
-        # Deploy dataset contents.
-        contents_acquired = try_to_acquire_archive_contents(dataset_archive_adress, self._path_contents_local)
-        if not contents_acquired:
-            # Generate the dataset contents from corpus
-            print("Dataset archive file is not found. Automatically generating new dataset...")
-            self._generate_dataset_contents()
-            save_archive(self._path_contents_local, dataset_archive_adress)
-            print("Dataset contents was generated and archive was saved.")
+        self._segment_length = segment_length
+        self._storage = storage
+
+        corpus = JSSS(corpus_adress, download_corpus)
+        archive_subtypes = resolve_archive_subtypes(subtypes, archive_subtypes, archive_compression, remote_shards)
+        (variants.wave_storage if variants is not None else storage).validate(waveform=True)
+        if variants is None:
+            storage_args = [tuple(storage)] if storage != Storage() else []
+            arg_hash = hash_args(archive_subtypes, resample_sr, "shard", *storage_args)
+            JSSS_wave_root = Path(".")/"tmp"/"JSSS_wave"
+        else:
+            if resample_sr not in variants.resample_srs:
+                raise ValueError(f"resample_sr {resample_sr} is not in the variants {variants.resample_srs}.")
+            arg_hash = hash_args(archive_subtypes, *variants.hash_args())
+            JSSS_wave_root = Path(".")/"tmp"/"JSSS_variants"
+        self._init_contents(corpus, resample_sr, subtypes, archive_subtypes, variants, JSSS_wave_root, arg_hash,
+            dataset_dir_adress, cache, n_workers, upload_archive, archive_compression, remote_shards)
+
+    def _features(self) -> List[str]:
+        return [stage_wave.name]
+
+    def _cache_keys(self) -> List[Tuple[str, Subtype, int]]:
+        return [(stage_wave.name, id.subtype, id.serial_num) for id in self._ids]
+
+    def _load_whole(self, key: Tuple[str, Subtype, int]) -> Tensor:
+        feature, subtype, serial_num = key
+        return self._open_shards()[feature][subtype].get(serial_num)
 
     def _generate_dataset_contents(self) -> None:
         """Generate dataset with corpus auto-download and preprocessing.
+
+        Items already in the build cache (previous/interrupted/overlapping builds) are not preprocessed again.
+        All items of the archive subtypes are generated.
         """
 
-        self._corpus.get_contents()
-        print("Preprocessing...")
-        for id in self._ids:
-            path_wav = self._corpus.get_item_path(id)
-            preprocess_as_wave(path_wav, id, self._path_contents_local, self._resample_sr)
+        ids = self._get_archive_ids()
+
+        if self._variants is not None:
+            build_variants(self._corpus, ids, self._variants, self._path_contents_local, self._n_workers)
+            return
+
+        stages = [stage_wave]
+        cache = ItemCache(Path(".")/"tmp"/"JSSS_cache", resample_sr=self._resample_sr)
+        ids_todo = cache.missing(ids, stages)
+        print(f"Preprocessing... ({len(ids) - len(ids_todo)} items cached, {len(ids_todo)} items to process)")
+        if len(ids_todo) > 0:
+            self._corpus.get_contents(list(dict.fromkeys(id.subtype for id in ids_todo)))
+            items = [(self._corpus.get_item_path(id), id) for id in ids_todo]
+            process = partial(Pipeline(stages, self._resample_sr), dir_dataset=cache.dir)
+            preprocess_items(process, items, self._n_workers)
+        cache.commit(ids, stages)
+        for stage in stages:
+            pack_shards(cache.dir, self._path_contents_local, ids, stage, self._storage)
         print("Preprocessed.")
 
     def _load_datum(self, id: ItemIdJSSS) -> Datum_JSSS_wave:
-        waveform: Tensor = load(get_dataset_wave_path(self._path_contents_local, id))
-        return Datum_JSSS_wave(self._transform(waveform), f"{id.subtype}-{id.serial_num}")
+        waves = self._get_shards()[stage_wave.name][id.subtype]
+        if self._segment_length is None:
+            waveform: Tensor = read_cached(self._cache, waves, stage_wave.name, id)
+        else:
+            # Read only the segment range from the shard.
+            start = random.randrange(max(waves.length(id.serial_num) - self._segment_length, 0) + 1)
+            waveform = read_cached(self._cache, waves, stage_wave.name, id, start, self._segment_length)
+            waveform = pad(waveform, (0, self._segment_length - waveform.size(-1)))
+        with profiling.span("transform"):
+            waveform = self._transform(waveform)
+        return Datum_JSSS_wave(waveform, f"{id.subtype}-{id.serial_num}")
 
     def __getitem__(self, n: int) -> Datum_JSSS_wave:
         """Load the n-th sample from the dataset.
         Args:
             n: The index of the datum to be loaded
         """
-        return self._load_datum(self._ids[n])
+        with profiling.span("getitem"):
+            return self._load_datum(self._ids[n])
+
+    def get_lengths(self) -> List[int]:
+        """Get waveform lengths of all items (from shard index, without loading)."""
+        waves = self._get_shards()[stage_wave.name]
+        return [waves[id.subtype].length(id.serial_num) for id in self._ids]
+
+    def get_stats(self, indices: Optional[Sequence[int]] = None) -> FeatureStats:
+        """Get waveform statistics of items, merged from per-item moments persisted with the dataset (no pass over items).
+
+        Args:
+            indices: Dataset indices of the items (e.g. training split). None is all items.
+        Returns:
+            Sample moments and item lengths [sample] (durations with `length_histogram(step_sec=1/sr)`).
+        """
+        ids = self._ids if indices is None else [self._ids[i] for i in indices]
+        return merge_item_stats(ids, partial(self._get_moments, stage_wave.name))
 
-    def __len__(self) -> int:
-        return len(self._ids)
+    def get_subtype_stats(self) -> Dict[Subtype, FeatureStats]:
+        """Get waveform statistics of each subtype."""
+        return {subtype: merge_item_stats([id for id in self._ids if id.subtype == subtype], partial(self._get_moments, stage_wave.name)) for subtype in self._subtypes}
 
 
 if __name__ == "__main__":
@@ -0,0 +1,214 @@
+"""
+# Dataset archive
+Dataset contents are archived as a directory of files (`<adress>/<file>[.zz|.zst]`) with a manifest,
+instead of single zip of the whole contents.
+
+- Files (per-subtype shards and their indices) are uploaded/fetched in parallel.
+- Compression is none (default, shards are dense tensors), zlib (fast level) or zstd (optional `zstandard` package).
+- Fetch can be partial (e.g. only subtypes/variants a job needs).
+- Manifest is written last, so an interrupted upload is never seen as an archive.
+- Uncompressed archive keeps the shard layout, so items can be read directly from it by ranged reads (`RemoteShardReader`).
+
+Remote adresses are handled through `fsspec`, so local paths, remote URLs (e.g. `s3::`) and stand-ins (e.g. `memory://`) can be used.
+"""
+
+from typing import Any, Callable, Dict, List, Optional
+from concurrent.futures import ThreadPoolExecutor
+import json
+from pathlib import Path
+import zlib
+
+import fsspec
+
+
+_manifest_name = "manifest.json"
+_suffixes = {"none": "", "zlib": ".zz", "zstd": ".zst"}
+_block_size = 8 * 1024 * 1024
+
+
+def _compressor(compression: str) -> Optional[Any]:
+    if compression == "zlib":
+        return zlib.compressobj(1)
+    if compression == "zstd":
+        import zstandard # optional dependency
+        return zstandard.ZstdCompressor(level=3).compressobj()
+    return None
+
+
+def _decompressor(compression: str) -> Optional[Any]:
+    if compression == "zlib":
+        return zlib.decompressobj()
+    if compression == "zstd":
+        import zstandard # optional dependency
+        return zstandard.ZstdDecompressor().decompressobj()
+    return None
+
+
+def validate_compression(compression: str) -> None:
+    """Raise ValueError for an unknown archive compression."""
+    if compression not in _suffixes:
+        raise ValueError(f"Unknown archive compression: {compression} (`none`, `zlib` or `zstd`).")
+
+
+def write_manifest(dir_contents: Path, compression: str = "none") -> Dict[str, Any]:
+    """Write local manifest of dataset contents, which lists all files with their sizes.
+
+    Args:
+        dir_contents: Dataset contents directory.
+        compression: Archive compression, `none`, `zlib` or `zstd`.
+    Returns:
+        The manifest.
+    """
+
+    validate_compression(compression)
+    files = {
+        path.relative_to(dir_contents).as_posix(): {"size": path.stat().st_size}
+        for path in sorted(dir_contents.rglob("*"))
+        if path.is_file() and path.name != _manifest_name and not path.name.endswith(".tmp")
+    }
+    manifest = {"version": 1, "compression": compression, "files": files}
+    with open(dir_contents / _manifest_name, "w") as f:
+        json.dump(manifest, f)
+    return manifest
+
+
+def _read_manifest(dir_contents: Path) -> Optional[Dict[str, Any]]:
+    path = dir_contents / _manifest_name
+    if not path.exists():
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def _upload(fs: Any, path_local: Path, path_remote: str, compression: str) -> None:
+    compressor = _compressor(compression)
+    with open(path_local, "rb") as f_src, fs.open(path_remote, "wb") as f_dst:
+        for block in iter(lambda: f_src.read(_block_size), b""):
+            f_dst.write(compressor.compress(block) if compressor is not None else block)
+        if compressor is not None:
+            f_dst.write(compressor.flush())
+
+
+def save_dataset_archive(dir_contents: Path, adress: str, compression: str = "none", n_workers: int = 8) -> None:
+    """Save dataset contents as an archive.
+
+    Args:
+        dir_contents: Dataset contents directory.
+        adress: Archive directory adress (path or remote URL) through `fsspec`.
+        compression: `none`, `zlib` or `zstd`.
+        n_workers: Number of parallel uploads.
+    """
+
+    manifest = write_manifest(dir_contents, compression)
+    archive = fsspec.open(adress)
+    fs, root = archive.fs, archive.path.rstrip("/")
+    suffix = _suffixes[compression]
+    fs.makedirs(root, exist_ok=True)
+    for parent in sorted(set(str(Path(name).parent.as_posix()) for name in manifest["files"])):
+        if parent != ".":
+            fs.makedirs(f"{root}/{parent}", exist_ok=True)
+    with ThreadPoolExecutor(n_workers) as executor:
+        futures = [
+            executor.submit(_upload, fs, dir_contents / name, f"{root}/{name}{suffix}", compression)
+            for name in manifest["files"]
+        ]
+        for future in futures:
+            future.result()
+    # Manifest last: readers never see an incomplete archive.
+    with fs.open(f"{root}/{_manifest_name}", "w") as f:
+        json.dump(manifest, f)
+
+
+def read_archive_manifest(adress: str) -> Optional[Dict[str, Any]]:
+    """Read manifest of the archive (None if the archive does not exist).
+
+    Args:
+        adress: Archive directory adress (path or remote URL) through `fsspec`.
+    """
+
+    archive = fsspec.open(adress)
+    fs, root = archive.fs, archive.path.rstrip("/")
+    if not fs.exists(f"{root}/{_manifest_name}"):
+        return None
+    with fs.open(f"{root}/{_manifest_name}", "r") as f:
+        return json.load(f)
+
+
+def _fetch(fs: Any, path_remote: str, path_local: Path, size: int, compression: str) -> None:
+    decompressor = _decompressor(compression)
+    path_local.parent.mkdir(parents=True, exist_ok=True)
+    # Atomic write: interrupted fetch never leaves a broken file.
+    path_tmp = path_local.with_name(path_local.name + ".tmp")
+    with fs.open(path_remote, "rb") as f_src, open(path_tmp, "wb") as f_dst:
+        for block in iter(lambda: f_src.read(_block_size), b""):
+            f_dst.write(decompressor.decompress(block) if decompressor is not None else block)
+        if decompressor is not None and hasattr(decompressor, "flush"):
+            f_dst.write(decompressor.flush())
+    if path_tmp.stat().st_size != size:
+        path_tmp.unlink()
+        raise RuntimeError(f"Fetched archive file is broken: {path_remote}")
+    path_tmp.replace(path_local)
+
+
+def _is_deployed(dir_contents: Path, names: List[str], files: Dict[str, Dict[str, int]]) -> bool:
+    return all((dir_contents / name).exists() and (dir_contents / name).stat().st_size == files[name]["size"] for name in names)
+
+
+def is_contents_complete(dir_contents: Path) -> bool:
+    """Whether local dataset contents have all files of the manifest (not partially fetched)."""
+    manifest = _read_manifest(dir_contents)
+    return manifest is not None and _is_deployed(dir_contents, list(manifest["files"]), manifest["files"])
+
+
+def acquire_dataset_archive(
+    adress: str,
+    dir_contents: Path,
+    selector: Callable[[str], bool] = (lambda name: True),
+    n_workers: int = 8,
+) -> bool:
+    """Deploy (selected files of) dataset contents from local contents or the archive.
+
+    Args:
+        adress: Archive directory adress (path or remote URL) through `fsspec`.
+        dir_contents: Dataset contents directory.
+        selector: Filter of file names (relative posix path in contents), e.g. files of needed subtypes.
+        n_workers: Number of parallel fetches.
+    Returns:
+        Whether contents are deployed (False if neither local contents nor the archive exists).
+    """
+
+    # Local contents (generated or already fetched)
+    manifest = _read_manifest(dir_contents)
+    if manifest is not None:
+        names = [name for name in manifest["files"] if selector(name)]
+        if _is_deployed(dir_contents, names, manifest["files"]):
+            return True
+
+    manifest = read_archive_manifest(adress)
+    if manifest is None:
+        return False
+    archive = fsspec.open(adress)
+    fs, root = archive.fs, archive.path.rstrip("/")
+    files: Dict[str, Dict[str, int]] = manifest["files"]
+    compression = manifest["compression"]
+    suffix = _suffixes[compression]
+    names = [name for name in files if selector(name)]
+    todo = [name for name in names if not _is_deployed(dir_contents, [name], files)]
+    with ThreadPoolExecutor(n_workers) as executor:
+        futures = [
+            executor.submit(_fetch, fs, f"{root}/{name}{suffix}", dir_contents / name, files[name]["size"], compression)
+            for name in todo
+        ]
+        for future in futures:
+            future.result()
+    dir_contents.mkdir(parents=True, exist_ok=True)
+    with open(dir_contents / _manifest_name, "w") as f:
+        json.dump(manifest, f)
+    return True
+
+
+def select_subtypes(subtypes: List[str], prefix: str = "") -> Callable[[str], bool]:
+    """File selector of subtypes (under the prefix directory, e.g. a variant directory)."""
+
+    prefixes = tuple(f"{prefix}{subtype}/" for subtype in subtypes)
+    return lambda name: name.startswith(prefixes)
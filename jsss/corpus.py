@@ -1,9 +1,17 @@
-from typing import Iterable, Optional, Union, NamedTuple, Dict, List
+from typing import FrozenSet, Optional, NamedTuple, Dict, List, Tuple
+from functools import lru_cache
+import json
+import os
 from pathlib import Path
+import wave
 
+import fsspec
+import numpy as np
 from corpuspy.interface import AbstractCorpus
-from corpuspy.helper.forward import forward_from_GDrive
-from corpuspy.helper.contents import get_contents
+
+from . import profiling
+from .lock import file_lock
+from .transfer import download_ranged, extract_members, zip_magic
 
 
 # Shortform = Literal["short-form/basic5000", "short-form/onomatopee300", "short-form/voiceactress100"] # >=Python3.8
@@ -35,6 +43,36 @@ subtypes = [
 # 
 # File name handling is abstracted by `jsss`, so you do not have to warry! Yeah!
 
+# Serial numbers of each subtype (before missing patch)
+_serial_ranges: Dict[Subtype, range] = {
+    "short-form/basic5000": range(1, 3001),
+    "short-form/onomatopee300": range(1, 186),
+    "short-form/voiceactress100": range(1, 101),
+    "long-form/katsura-masakazu": range(1, 60),
+    "long-form/udon": range(1, 87),
+    "long-form/washington-dc": range(1, 24),
+    "simplification": range(1, 228),
+    "summarization": range(1, 227),
+}
+# generator of simplification: [i for i in range(1, 228) if i not in [int(name[-7:-4]) for name in os.listdir("./jsss_ver1/jsss_ver1/simplification/wav24kHz16bit/")]
+_missings: Dict[Subtype, FrozenSet[int]] = {
+    "short-form/voiceactress100": frozenset([77]),
+    "simplification": frozenset([34, 38, 39, 41, 46, 53, 56, 57, 60, 62, 70, 71, 72, 73, 75, 76,
+        109, 110, 118, 133, 143, 145, 146, 149, 156, 157, 165, 169, 170, 171, 172, 179, 183, 184, 186, 189, 190, 195,
+        200, 201, 221, 223, 225]),
+}
+# File name (prefix, zero-padding) of each subtype
+_name_formats: Dict[Subtype, Tuple[str, int]] = {
+    "short-form/basic5000": ("BASIC5000", 4),
+    "short-form/onomatopee300": ("ONOMATOPEE300", 3),
+    "short-form/voiceactress100": ("VOICEACTRESS100", 3),
+    "long-form/katsura-masakazu": ("KATSURA-MASAKAZU", 3),
+    "long-form/udon": ("UDON", 3),
+    "long-form/washington-dc": ("WASHINGTON-DC", 3),
+    "simplification": ("SIMPLIFICATION", 3),
+    "summarization": ("SUMMARIZATION", 3),
+}
+
 
 class ItemIdJSSS(NamedTuple):
     """Identity of JSSS corpus's item.
@@ -44,6 +82,92 @@ class ItemIdJSSS(NamedTuple):
     serial_num: int
 
 
+# Full item identities, computed once.
+_identities: Tuple[ItemIdJSSS, ...] = tuple(
+    ItemIdJSSS(subtype, num)
+    for subtype in subtypes
+    for num in _serial_ranges[subtype]
+    if num not in _missings.get(subtype, frozenset())
+)
+
+
+class CorpusIndex:
+    """Array-backed item table of JSSS corpus with metadata.
+
+    Rows are in `JSSS.get_identities()` order.
+    Unknown metadata (items not yet extracted) is -1.
+    """
+
+    def __init__(self, subtype_codes: np.ndarray, serial_nums: np.ndarray, num_samples: np.ndarray, sample_rates: np.ndarray):
+        """
+        Args:
+            subtype_codes: Subtype of each item, as position in `subtypes` :: (Item,)
+            serial_nums: Serial number of each item :: (Item,)
+            num_samples: Number of waveform samples of each item :: (Item,)
+            sample_rates: Sampling rate of each item :: (Item,)
+        """
+
+        self.subtype_codes = subtype_codes
+        self.serial_nums = serial_nums
+        self.num_samples = num_samples
+        self.sample_rates = sample_rates
+        self._rows: Optional[Dict[ItemIdJSSS, int]] = None
+
+    @classmethod
+    def from_identities(cls, ids: List[ItemIdJSSS]) -> "CorpusIndex":
+        """Build metadata-less index of the items."""
+
+        codes = np.array([subtypes.index(id.subtype) for id in ids], dtype=np.int8)
+        nums = np.array([id.serial_num for id in ids], dtype=np.int32)
+        return cls(codes, nums, np.full(len(ids), -1, dtype=np.int64), np.full(len(ids), -1, dtype=np.int32))
+
+    @classmethod
+    def load(cls, path: Path) -> "CorpusIndex":
+        with np.load(path) as arrays:
+            if list(arrays["subtypes"]) != subtypes:
+                raise ValueError(f"Index of different subtype definition: {path} (delete it to rebuild).")
+            return cls(arrays["subtype_codes"], arrays["serial_nums"], arrays["num_samples"], arrays["sample_rates"])
+
+    def save(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Atomic write: concurrent readers never see a partial index.
+        path_tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        with open(path_tmp, "wb") as f:
+            np.savez(f, subtypes=np.array(subtypes), subtype_codes=self.subtype_codes, serial_nums=self.serial_nums,
+                num_samples=self.num_samples, sample_rates=self.sample_rates)
+        path_tmp.replace(path)
+
+    def __len__(self) -> int:
+        return len(self.serial_nums)
+
+    def select(self, target_subtypes: List[Subtype]) -> np.ndarray:
+        """Get rows of items which belong to the subtypes (vectorized)."""
+        codes = [subtypes.index(subtype) for subtype in target_subtypes if subtype in subtypes]
+        return np.flatnonzero(np.isin(self.subtype_codes, codes))
+
+    def get_ids(self, rows: Optional[np.ndarray] = None) -> List[ItemIdJSSS]:
+        """Get item identities of the rows (all rows if None)."""
+        rows = rows if rows is not None else np.arange(len(self))
+        return [ItemIdJSSS(subtypes[code], int(num)) for code, num in zip(self.subtype_codes[rows], self.serial_nums[rows])]
+
+    def get_row(self, id: ItemIdJSSS) -> int:
+        """Get row of the item in O(1)."""
+        if self._rows is None:
+            self._rows = {id: row for row, id in enumerate(self.get_ids())}
+        return self._rows[id]
+
+    def get_durations(self, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """Get durations [sec] of the rows (all rows if None). Unknown duration is NaN."""
+        rows = rows if rows is not None else np.arange(len(self))
+        num_samples, sample_rates = self.num_samples[rows], self.sample_rates[rows]
+        return np.where(num_samples >= 0, num_samples / np.maximum(sample_rates, 1), np.nan)
+
+
+@lru_cache(maxsize=None)
+def _get_identity_index() -> CorpusIndex:
+    return CorpusIndex.from_identities(list(_identities))
+
+
 class JSSS(AbstractCorpus[ItemIdJSSS]):
     """JSSS corpus.
     
@@ -51,17 +175,25 @@ class JSSS(AbstractCorpus[ItemIdJSSS]):
     """
 
     gdrive_contents_id: str = "1NyiZCXkYTdYBNtD1B-IMAYCVa-0SQsKX"
+    # Expected SHA-256 of the original archive. None verify only size.
+    archive_sha256: Optional[str] = None
+    # Sampling rate of corpus items (`wav24kHz16bit`)
+    sampling_rate: int = 24000
 
     def __init__(
         self,
         adress: Optional[str] = None,
         download_origin : bool = False,
+        origin_url: Optional[str] = None,
+        n_workers: int = 8,
     ) -> None:
         """Initiate JSSS with archive options.
 
         Args:
             adress: Corpus archive adress (e.g. path, S3) from/to which archive will be read/written through `fsspec`.
             download_origin: Download original corpus when there is no corpus in local and specified adress.
+            origin_url: URL of original corpus archive. None use Google Drive distribution.
+            n_workers: Number of parallel download connections / extraction threads.
         """
 
         ver: str = "ver1"
@@ -74,18 +206,78 @@ class JSSS(AbstractCorpus[ItemIdJSSS]):
         self._adress = adress if adress else default_path_archive
 
         self._download_origin = download_origin
+        default_origin_url = f"https://drive.usercontent.google.com/download?id={self.gdrive_contents_id}&export=download&confirm=t"
+        self._origin_url = origin_url if origin_url else default_origin_url
+        self._n_workers = n_workers
+        self._index: Optional[CorpusIndex] = None
+
+    def __getstate__(self):
+        # Pickle-light: the index is reloaded on demand.
+        state = self.__dict__.copy()
+        state["_index"] = None
+        return state
 
-    def get_contents(self) -> None:
+    @property
+    def adress(self) -> str:
+        """Corpus archive adress."""
+        return self._adress
+
+    def get_contents(self, target_subtypes: Optional[List[Subtype]] = None) -> None:
         """Get corpus contents into local.
+
+        Only members of requested subtypes are extracted (in parallel), and already-extracted subtypes are skipped.
+        Concurrent callers (e.g. DDP ranks on a node) are serialized, so contents are extracted only once.
+
+        Args:
+            target_subtypes: Sub corpus types to be extracted. None extract all supported subtypes.
         """
 
-        get_contents(self._adress, self._path_contents_local, self._download_origin, self.forward_from_origin)
+        target_subtypes = target_subtypes if target_subtypes is not None else subtypes
+        if all(subtype in self._get_extracted() for subtype in target_subtypes):
+            return
+
+        with file_lock(self._path_contents_local.parent / "contents.lock"):
+            # Other process could have extracted while waiting the lock.
+            extracted = self._get_extracted()
+            subtypes_todo = [subtype for subtype in target_subtypes if subtype not in extracted]
+            if len(subtypes_todo) == 0:
+                self._index = None
+                return
+
+            archive = fsspec.open(self._adress)
+            if not archive.fs.exists(archive.path):
+                if not self._download_origin:
+                    raise RuntimeError(f"Corpus archive is not found at {self._adress}, and origin download is not allowed.")
+                self.forward_from_origin()
+
+            prefixes = tuple(f"{self._corpus_name}/{subtype}/" for subtype in subtypes_todo)
+            with profiling.span("corpus.extract"):
+                extract_members(self._adress, self._path_contents_local, lambda name: name.startswith(prefixes), self._n_workers)
+            self._path_contents_local.mkdir(parents=True, exist_ok=True)
+            with open(self._path_contents_local / "extracted.json", "w") as f:
+                json.dump(extracted + subtypes_todo, f)
+        # Metadata of newly extracted items should be indexed.
+        self._index = None
+
+    def _get_extracted(self) -> List[Subtype]:
+        """Get already-extracted subtypes."""
+        path_extracted = self._path_contents_local / "extracted.json"
+        if not path_extracted.exists():
+            return []
+        with open(path_extracted) as f:
+            return json.load(f)
 
     def forward_from_origin(self) -> None:
         """Forward original corpus archive to the adress.
+
+        Download is parallel ranged requests, resumable after interruption, and verified with size/checksum
+        and zip signature (so that an HTML page served by the origin is never stored as the archive).
         """
 
-        forward_from_GDrive(self.gdrive_contents_id, self._adress, 1.09)
+        dir_parts = self._path_contents_local.parent / "download"
+        with profiling.span("corpus.download"):
+            download_ranged(self._origin_url, self._adress, dir_parts, self._n_workers, sha256=self.archive_sha256,
+                magic=zip_magic)
 
     def get_identities(self) -> List[ItemIdJSSS]:
         """Get corpus item identities.
@@ -94,30 +286,35 @@ class JSSS(AbstractCorpus[ItemIdJSSS]):
             Full item identity list.
         """
 
-        subs: Dict[Subtype, Iterable[int]] = {
-            "short-form/basic5000": range(1, 3001),
-            "short-form/onomatopee300": range(1, 186),
-            "short-form/voiceactress100": range(1, 101),
-            "long-form/katsura-masakazu": range(1, 60),
-            "long-form/udon": range(1, 87),
-            "long-form/washington-dc": range(1, 24),
-            "simplification": range(1, 228),
-            "summarization": range(1, 227),
-        }
-        # patch
-        missing_actr = [77]
-        subs["short-form/voiceactress100"] = filter(lambda i: i not in missing_actr, subs["short-form/voiceactress100"])
-        # generator: [i for i in range(1, 228) if i not in [int(name[-7:-4]) for name in os.listdir("./jsss_ver1/jsss_ver1/simplification/wav24kHz16bit/")]
-        missing_smpl = [34, 38, 39, 41, 46, 53, 56, 57, 60, 62, 70, 71, 72, 73, 75, 76,
-            109, 110, 118, 133, 143, 145, 146, 149, 156, 157, 165, 169, 170, 171, 172, 179, 183, 184, 186, 189, 190, 195,
-            200, 201, 221, 223, 225]
-        subs["simplification"] = filter(lambda i: i not in missing_smpl, subs["simplification"])
-
-        ids: List[ItemIdJSSS] = []
-        for subtype in subtypes:
-                for num in subs[subtype]:
-                    ids.append(ItemIdJSSS(subtype, num))
-        return ids
+        return list(_identities)
+
+    def get_identity_index(self) -> CorpusIndex:
+        """Get metadata-less corpus index, built in memory once per process (no I/O, unlike `get_index`).
+
+        It is shared, so it should not be modified.
+        """
+
+        return _get_identity_index()
+
+    def get_index(self) -> CorpusIndex:
+        """Get corpus index with item metadata.
+
+        The index is persisted next to the contents (`index.npz`).
+        Metadata of extracted items is filled from wav headers (without audio decode) only once.
+        """
+
+        if self._index is None:
+            path_index = self._path_contents_local / "index.npz"
+            index = CorpusIndex.load(path_index) if path_index.exists() else CorpusIndex.from_identities(self.get_identities())
+            rows = np.intersect1d(index.select(self._get_extracted()), np.flatnonzero(index.num_samples < 0))
+            with profiling.span("corpus.index"):
+                for row, id in zip(rows, index.get_ids(rows)):
+                    with wave.open(str(self.get_item_path(id)), "rb") as w:
+                        index.num_samples[row], index.sample_rates[row] = w.getnframes(), w.getframerate()
+            if len(rows) > 0 or not path_index.exists():
+                index.save(path_index)
+            self._index = index
+        return self._index
 
     def get_item_path(self, id: ItemIdJSSS) -> Path:
         """Get path of the item.
@@ -128,42 +325,17 @@ class JSSS(AbstractCorpus[ItemIdJSSS]):
             Path of the specified item.
         """
 
-        subs: Dict[Subtype, Dict[str, Union[str, int]]] = {
-            "short-form/basic5000": {
-                "prefix": "BASIC5000",
-                "zpad": 4
-            },
-            "short-form/onomatopee300": {
-                "prefix": "ONOMATOPEE300",
-                "zpad": 3
-            },
-            "short-form/voiceactress100": {
-                "prefix": "VOICEACTRESS100",
-                "zpad": 3
-            },
-            "long-form/katsura-masakazu": {
-                "prefix": "KATSURA-MASAKAZU",
-                "zpad": 3
-            },
-            "long-form/udon": {
-                "prefix": "UDON",
-                "zpad": 3
-            },
-            "long-form/washington-dc": {
-                "prefix": "WASHINGTON-DC",
-                "zpad": 3
-            },
-            "simplification": {
-                "prefix": "SIMPLIFICATION",
-                "zpad": 3
-            },
-            "summarization": {
-                "prefix": "SUMMARIZATION",
-                "zpad": 3
-            }
-        }
-        root = str(self._path_contents_local)
-        prefix = subs[id.subtype]["prefix"]
-        num = str(id.serial_num).zfill(int(subs[id.subtype]["zpad"]))
-        p = f"{root}/{self._corpus_name}/{id.subtype}/wav24kHz16bit/{prefix}_{num}.wav"
-        return Path(p)
+        return self._path_contents_local / self.get_item_member(id)
+
+    def get_item_member(self, id: ItemIdJSSS) -> str:
+        """Get member name of the item in the corpus archive.
+
+        Args:
+            id: Target item identity.
+        Returns:
+            Archive member name of the specified item (e.g. `jsss_ver1/simplification/wav24kHz16bit/SIMPLIFICATION_001.wav`).
+        """
+
+        prefix, zpad = _name_formats[id.subtype]
+        num = str(id.serial_num).zfill(zpad)
+        return f"{self._corpus_name}/{id.subtype}/wav24kHz16bit/{prefix}_{num}.wav"
@@ -0,0 +1,35 @@
+"""
+# Inter-process file lock
+Corpus extraction and dataset build write shared local directories, so concurrent builders (e.g. DDP ranks on a node)
+are serialized with an advisory `fcntl` lock. The lock is released by the OS even if the holder crashes.
+"""
+
+from typing import Iterator
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError: # non-POSIX (e.g. Windows)
+    fcntl = None # type: ignore
+
+
+@contextmanager
+def file_lock(path_lock: Path) -> Iterator[None]:
+    """Hold an exclusive lock of the lock file (blocking until acquired).
+
+    On platforms without `fcntl`, the lock is no-op.
+
+    Args:
+        path_lock: Lock file path (created if not exist, never removed).
+    """
+
+    path_lock.parent.mkdir(parents=True, exist_ok=True)
+    with open(path_lock, "a") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
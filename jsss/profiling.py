@@ -0,0 +1,235 @@
+"""
+# Hot-path instrumentation
+Per-stage timers, counters and bytes of dataset build and item loading (decode, resample, spectrogram, save/load,
+archive transfer, transform).
+
+Disabled by default, and then a span is a shared no-op object (one function call and one flag check).
+When enabled with an output directory, each process (including DataLoader workers) writes its records there at exit,
+so that statistics are aggregated over workers by `collect` and exported as a summary or a Chrome trace.
+
+Usage:
+    profiling.enable(Path("prof"))
+    ... (build dataset, run DataLoader epochs)
+    print(profiling.format_summary(profiling.collect(Path("prof"))))
+    profiling.export_chrome_trace(Path("prof"), Path("trace.json"))  # open in chrome://tracing or Perfetto
+"""
+
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+import atexit
+import json
+import os
+from pathlib import Path
+import threading
+import time
+from multiprocessing import util
+
+
+# Environment variable of output directory, which propagates enabled state to spawned worker processes.
+_env_dir = "JSSS_PROFILE_DIR"
+# Upper bound of trace events per process (aggregated statistics are always recorded).
+_max_events = 1_000_000
+
+_enabled = False
+_dir_out: Optional[Path] = None
+# name -> [count, sec, n_bytes]
+_stats: Dict[str, List[float]] = {}
+# (name, start_us, duration_us, thread_id, n_bytes)
+_events: List[Tuple[str, float, float, int, int]] = []
+_lock = threading.Lock()
+
+
+class Stat(NamedTuple):
+    count: int
+    sec: float
+    n_bytes: int
+
+
+class _NullSpan:
+    """Disabled span (shared, does nothing)."""
+
+    def __enter__(self) -> "_NullSpan":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        pass
+
+    def add_bytes(self, n_bytes: int) -> None:
+        pass
+
+
+_null_span = _NullSpan()
+
+
+class _Span:
+    """Enabled span, which times its block."""
+
+    def __init__(self, name: str, n_bytes: int):
+        self._name = name
+        self._n_bytes = n_bytes
+
+    def __enter__(self) -> "_Span":
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        end = time.perf_counter()
+        _record(self._name, 1, end - self._start, self._n_bytes, self._start)
+
+    def add_bytes(self, n_bytes: int) -> None:
+        """Add processed bytes known only inside the block."""
+        self._n_bytes += n_bytes
+
+
+def _record(name: str, n: int, sec: float, n_bytes: int, start: Optional[float]) -> None:
+    with _lock:
+        stat = _stats.setdefault(name, [0, 0.0, 0])
+        stat[0] += n
+        stat[1] += sec
+        stat[2] += n_bytes
+        if start is not None and len(_events) < _max_events:
+            _events.append((name, start * 1e6, sec * 1e6, threading.get_ident(), n_bytes))
+
+
+def span(name: str, n_bytes: int = 0):
+    """Time a block as a stage (`with span("decode", n_bytes): ...`).
+
+    Args:
+        name: Stage name.
+        n_bytes: Bytes read/written in the block (more can be added by `add_bytes` of the span).
+    """
+    return _Span(name, n_bytes) if _enabled else _null_span
+
+
+def count(name: str, n: int = 1, n_bytes: int = 0) -> None:
+    """Count events of a stage without timing (e.g. cache hits)."""
+    if _enabled:
+        _record(name, n, 0.0, n_bytes, None)
+
+
+def is_enabled() -> bool:
+    """Whether instrumentation is enabled (e.g. to skip computing costly record arguments)."""
+    return _enabled
+
+
+def enable(dir_out: Optional[Path] = None) -> None:
+    """Enable instrumentation in this process and its (forked/spawned) children.
+
+    Args:
+        dir_out: If not None, each process writes its records into the directory at exit (for `collect`).
+    """
+
+    global _enabled, _dir_out
+    _enabled = True
+    _dir_out = dir_out
+    if dir_out is not None:
+        dir_out.mkdir(parents=True, exist_ok=True)
+        os.environ[_env_dir] = str(dir_out)
+        _register_flush()
+
+
+def disable() -> None:
+    global _enabled
+    _enabled = False
+    os.environ.pop(_env_dir, None)
+
+
+def reset() -> None:
+    """Clear records of this process."""
+    with _lock:
+        _stats.clear()
+        _events.clear()
+
+
+def summary() -> Dict[str, Stat]:
+    """Get statistics of this process."""
+    with _lock:
+        return {name: Stat(int(c), s, int(b)) for name, (c, s, b) in _stats.items()}
+
+
+def flush() -> None:
+    """Write records of this process into the output directory (overwrite previous flush of this process)."""
+
+    if _dir_out is None:
+        return
+    with _lock:
+        records = {"pid": os.getpid(), "stats": dict(_stats), "events": list(_events)}
+    path = _dir_out / f"profile.{os.getpid()}.json"
+    path_tmp = path.with_name(path.name + ".tmp")
+    with open(path_tmp, "w") as f:
+        json.dump(records, f)
+    path_tmp.replace(path)
+
+
+class _ForkHook:
+    """Weak-referenceable owner of the after-fork hook."""
+
+
+_fork_hook = _ForkHook()
+
+
+def _after_fork(_: _ForkHook) -> None:
+    # Forked child inherits records of the parent, which are flushed by the parent.
+    reset()
+    util.Finalize(None, flush, exitpriority=0)
+
+
+_flush_registered = False
+
+
+def _register_flush() -> None:
+    # `atexit` for the main process, multiprocessing finalizer for worker processes (which exit without atexit).
+    global _flush_registered
+    if _flush_registered:
+        return
+    _flush_registered = True
+    atexit.register(flush)
+    util.Finalize(None, flush, exitpriority=0)
+    util.register_after_fork(_fork_hook, _after_fork)
+
+
+def _load_records(dir_out: Path) -> List[Dict[str, Any]]:
+    flush()
+    records = []
+    for path in sorted(dir_out.glob("profile.*.json")):
+        with open(path) as f:
+            records.append(json.load(f))
+    return records
+
+
+def collect(dir_out: Path) -> Dict[str, Stat]:
+    """Aggregate statistics of all processes in the output directory (including this process)."""
+
+    merged: Dict[str, List[float]] = {}
+    for records in _load_records(dir_out):
+        for name, (c, s, b) in records["stats"].items():
+            stat = merged.setdefault(name, [0, 0.0, 0])
+            stat[0], stat[1], stat[2] = stat[0] + c, stat[1] + s, stat[2] + b
+    return {name: Stat(int(c), s, int(b)) for name, (c, s, b) in merged.items()}
+
+
+def format_summary(stats: Dict[str, Stat]) -> str:
+    """Format statistics as a table sorted by total time."""
+
+    lines = [f"{'stage':<24} {'count':>10} {'total [s]':>10} {'mean [ms]':>10} {'MB':>10} {'MB/s':>10}"]
+    for name, stat in sorted(stats.items(), key=lambda item: -item[1].sec):
+        mean_ms = stat.sec / stat.count * 1000 if stat.count > 0 else 0.0
+        throughput = stat.n_bytes / stat.sec / 1e6 if stat.sec > 0 else 0.0
+        lines.append(f"{name:<24} {stat.count:>10} {stat.sec:>10.3f} {mean_ms:>10.3f} {stat.n_bytes / 1e6:>10.1f} {throughput:>10.1f}")
+    return "\n".join(lines)
+
+
+def export_chrome_trace(dir_out: Path, path_trace: Path) -> None:
+    """Export events of all processes as Chrome trace JSON (chrome://tracing, Perfetto)."""
+
+    trace_events = []
+    for records in _load_records(dir_out):
+        for name, ts, dur, tid, n_bytes in records["events"]:
+            trace_events.append({"name": name, "ph": "X", "ts": ts, "dur": dur, "pid": records["pid"], "tid": tid,
+                "args": {"bytes": n_bytes}})
+    with open(path_trace, "w") as f:
+        json.dump({"traceEvents": trace_events, "displayTimeUnit": "ms"}, f)
+
+
+# Spawned worker processes inherit enabled state through the environment variable.
+if os.environ.get(_env_dir):
+    enable(Path(os.environ[_env_dir]))
@@ -0,0 +1,101 @@
+"""
+# Dataset split
+Seeded train/val/test split stratified by subtype, driven by the corpus index.
+Splits are item positions in a dataset (arrays), so each stage is a cheap `Subset` view of a single dataset instance.
+"""
+
+from typing import List, NamedTuple, Optional, Tuple
+import os
+from pathlib import Path
+
+import numpy as np
+
+from .corpus import CorpusIndex
+
+
+class Split(NamedTuple):
+    """Item positions (in dataset order) of each split :: (Item,)"""
+
+    train: np.ndarray
+    val: np.ndarray
+    test: np.ndarray
+
+    def save(self, path: Path, rows: Optional[np.ndarray] = None) -> None:
+        """Save the split, with index rows of the split items (in dataset order) for validation on reuse."""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Atomic write: concurrent readers never see a partial split.
+        path_tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        items = {"rows": rows} if rows is not None else {}
+        with open(path_tmp, "wb") as f:
+            np.savez(f, train=self.train, val=self.val, test=self.test, **items)
+        path_tmp.replace(path)
+
+    @classmethod
+    def load(cls, path: Path) -> "Split":
+        with np.load(path) as arrays:
+            return cls(arrays["train"], arrays["val"], arrays["test"])
+
+
+def split_rows(
+    index: CorpusIndex,
+    rows: np.ndarray,
+    ratios: Tuple[float, float, float] = (0.9, 0.05, 0.05),
+    seed: int = 0,
+) -> Split:
+    """Split dataset items stratified by subtype.
+
+    Each subtype is split with the ratios independently, so that all splits have the same subtype balance.
+    Permutation of a subtype depends only on the seed and the subtype, so adding a subtype does not change others.
+
+    Args:
+        index: Corpus index.
+        rows: Index rows of dataset items, in dataset order (e.g. `index.select(subtypes)`).
+        ratios: Ratios of train/val/test.
+        seed: Random seed.
+    Returns:
+        Sorted item positions of each split.
+    """
+
+    total = sum(ratios)
+    splits: Tuple[List[np.ndarray], List[np.ndarray], List[np.ndarray]] = ([], [], [])
+    codes = index.subtype_codes[rows]
+    for code in np.unique(codes):
+        positions = np.flatnonzero(codes == code)
+        positions = positions[np.random.default_rng([seed, int(code)]).permutation(len(positions))]
+        n_val = int(round(len(positions) * ratios[1] / total))
+        n_test = int(round(len(positions) * ratios[2] / total))
+        n_train = len(positions) - n_val - n_test
+        splits[0].append(positions[:n_train])
+        splits[1].append(positions[n_train : n_train + n_val])
+        splits[2].append(positions[n_train + n_val :])
+    train, val, test = (np.sort(np.concatenate(parts)) if len(parts) > 0 else np.zeros(0, dtype=np.int64) for parts in splits)
+    return Split(train, val, test)
+
+
+def get_split(
+    path: Path,
+    index: CorpusIndex,
+    rows: np.ndarray,
+    ratios: Tuple[float, float, float] = (0.9, 0.05, 0.05),
+    seed: int = 0,
+) -> Split:
+    """Load the persisted split, or split items and persist it.
+
+    Persisted split is reused only if it was made for the same items in the same order,
+    because its positions refer to the dataset items.
+
+    Args:
+        path: Split file path (`.npz`), which should be unique to (items, ratios, seed).
+        index: Corpus index.
+        rows: Index rows of dataset items, in dataset order (e.g. `get_ids()` of the dataset through `index.get_row`).
+        ratios: Ratios of train/val/test.
+        seed: Random seed.
+    """
+
+    if path.exists():
+        with np.load(path) as arrays:
+            if "rows" in arrays and np.array_equal(arrays["rows"], rows):
+                return Split(arrays["train"], arrays["val"], arrays["test"])
+    split = split_rows(index, rows, ratios, seed)
+    split.save(path, rows)
+    return split
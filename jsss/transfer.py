@@ -0,0 +1,217 @@
+"""
+# Archive transfer
+Parallel ranged download with resume, and parallel member extraction of zip archives.
+Sources/destinations are handled through `fsspec`, so local paths, remote URLs (e.g. `s3::`) and stand-ins (e.g. `memory://`) can be used.
+`requests` is imported only when downloading, so corpus access from local contents does not import it.
+"""
+
+from typing import Callable, Iterable, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+from pathlib import Path
+import posixpath
+import shutil
+import zipfile
+
+import fsspec
+from tqdm import tqdm
+
+
+# Leading bytes (local file header signature) of a zip archive
+zip_magic = b"PK\x03\x04"
+
+
+def _check_content_type(res) -> None:
+    """Reject HTML page served in place of the file (e.g. confirmation interstitial, or error page with status 200)."""
+    content_type = res.headers.get("Content-Type", "")
+    if content_type.split(";")[0].strip().lower() == "text/html":
+        raise RuntimeError(f"Got HTML page instead of file content from {res.url}.")
+
+
+def _probe(url: str) -> Tuple[Optional[int], bool]:
+    """Get content size and range support of the URL."""
+
+    import requests
+
+    with requests.get(url, headers={"Range": "bytes=0-0"}, stream=True, allow_redirects=True) as res:
+        res.raise_for_status()
+        _check_content_type(res)
+        content_range = res.headers.get("Content-Range")
+        if res.status_code == 206 and content_range is not None and "/" in content_range:
+            total = content_range.rsplit("/", 1)[1]
+            return (int(total) if total != "*" else None), True
+        length = res.headers.get("Content-Length")
+        return (int(length) if length is not None else None), False
+
+
+class _RangeIgnored(Exception):
+    """The server answered a range request with the whole content (not 206)."""
+
+
+def _download_part(url: str, path_part: Path, start: int, end: int, n_retry: int, pbar: tqdm) -> None:
+    """Download byte range [start, end] into the part file, resuming from its current size.
+
+    Raises:
+        _RangeIgnored: When the server does not answer the range (the part is left as is, never appended).
+    """
+
+    import requests
+
+    size = end - start + 1
+    for trial in range(n_retry + 1):
+        done = path_part.stat().st_size if path_part.exists() else 0
+        if done >= size:
+            return
+        try:
+            headers = {"Range": f"bytes={start + done}-{end}"}
+            with requests.get(url, headers=headers, stream=True, allow_redirects=True) as res:
+                res.raise_for_status()
+                if res.status_code != 206:
+                    raise _RangeIgnored()
+                _check_content_type(res)
+                with open(path_part, "ab") as f:
+                    for block in res.iter_content(chunk_size=1024 * 1024):
+                        f.write(block)
+                        pbar.update(len(block))
+        except (requests.RequestException, OSError):
+            if trial == n_retry:
+                raise
+
+
+def _get_parts_dir(dir_parts: Path, url: str, total: Optional[int], chunk_size: int) -> Path:
+    """Part directory of a download, keyed on (url, size, chunk_size), whose part files are resumable."""
+    return dir_parts / hashlib.sha256(f"{url}\n{total}\n{chunk_size}".encode()).hexdigest()[:16]
+
+
+def download_ranged(
+    url: str,
+    adress: str,
+    dir_parts: Path,
+    n_workers: int = 8,
+    chunk_size: int = 64 * 1024 * 1024,
+    sha256: Optional[str] = None,
+    magic: Optional[bytes] = None,
+    n_retry: int = 3,
+) -> None:
+    """Download a file with parallel range requests, then forward it to the adress.
+
+    Downloaded parts are kept in `dir_parts` until completion, so an interrupted download resumes from them.
+    If the server does not support range requests, the file is downloaded in single stream.
+
+    Args:
+        url: Source URL.
+        adress: Destination adress (path or remote URL) through `fsspec`.
+        dir_parts: Local directory for resumable part files. Parts are keyed on (url, size, chunk_size),
+            so parts of another file (or another chunking) are never resumed.
+        n_workers: Number of parallel connections.
+        chunk_size: Size of a range request.
+        sha256: Expected SHA-256 hex digest. If None, only content size is verified.
+        magic: Expected leading bytes of the content (e.g. `zip_magic`). If None, not verified.
+        n_retry: Number of retries of each part.
+    Raises:
+        RuntimeError: When the response is HTML page, or the downloaded content does not match the expected
+            size/checksum/leading bytes. Broken content is never written to the adress.
+    """
+
+    import requests
+
+    total, ranged = _probe(url)
+    ranged = ranged and total is not None
+    # Fallback: single stream without resume
+    chunks: List[Tuple[int, int]] = [(0, -1)]
+    if ranged:
+        chunks = [(start, min(start + chunk_size, total) - 1) for start in range(0, total, chunk_size)]
+
+    dir_key = _get_parts_dir(dir_parts, url, total, chunk_size)
+    dir_key.mkdir(parents=True, exist_ok=True)
+    paths_part = [dir_key / f"{i}.part" for i in range(len(chunks))]
+    if not ranged and paths_part[0].exists():
+        paths_part[0].unlink()
+    resumed = sum(path.stat().st_size for path in paths_part if path.exists())
+    with tqdm(total=total, initial=resumed, unit="B", unit_scale=True, desc="Downloading") as pbar:
+        if ranged:
+            try:
+                with ThreadPoolExecutor(n_workers) as executor:
+                    futures = [
+                        executor.submit(_download_part, url, path, start, end, n_retry, pbar)
+                        for path, (start, end) in zip(paths_part, chunks)
+                    ]
+                    for future in futures:
+                        future.result()
+            except _RangeIgnored:
+                # Range support was probed, but a request was answered in full (e.g. by another backend).
+                ranged = False
+                for path in paths_part:
+                    if path.exists():
+                        path.unlink()
+                paths_part = paths_part[:1]
+                pbar.reset()
+        if not ranged:
+            with requests.get(url, stream=True, allow_redirects=True) as res, open(paths_part[0], "wb") as f:
+                res.raise_for_status()
+                _check_content_type(res)
+                for block in res.iter_content(chunk_size=1024 * 1024):
+                    f.write(block)
+                    pbar.update(len(block))
+
+    # Verify before forwarding, so that broken content (e.g. truncated, or an HTML page) never reaches the adress.
+    size = sum(path.stat().st_size for path in paths_part)
+    digest = hashlib.sha256()
+    if sha256 is not None:
+        for path in paths_part:
+            with open(path, "rb") as f_src:
+                for block in iter(lambda: f_src.read(8 * 1024 * 1024), b""):
+                    digest.update(block)
+    head = b""
+    if magic is not None and len(paths_part) > 0:
+        with open(paths_part[0], "rb") as f_src:
+            head = f_src.read(len(magic))
+    if (total is not None and size != total) or (sha256 is not None and digest.hexdigest() != sha256) or (
+            magic is not None and head != magic):
+        shutil.rmtree(dir_parts)
+        checksum = digest.hexdigest() if sha256 is not None else "-"
+        raise RuntimeError(f"Downloaded archive is broken (size: {size}/{total}, sha256: {checksum}, head: {head!r}).")
+
+    dst = fsspec.open(adress, "wb")
+    dst.fs.makedirs(posixpath.dirname(dst.path), exist_ok=True)
+    with dst as f_dst:
+        for path in paths_part:
+            with open(path, "rb") as f_src:
+                shutil.copyfileobj(f_src, f_dst, 8 * 1024 * 1024)
+    shutil.rmtree(dir_parts)
+
+
+def _extract_chunk(adress: str, names: List[str], dir_dest: Path) -> int:
+    # Each worker opens its own handle, because ZipFile over a shared file object is not thread-safe.
+    with fsspec.open(adress, "rb") as f, zipfile.ZipFile(f) as archive:
+        for name in names:
+            archive.extract(name, dir_dest)
+    return len(names)
+
+
+def extract_members(
+    adress: str,
+    dir_dest: Path,
+    selector: Callable[[str], bool] = (lambda name: True),
+    n_workers: int = 8,
+) -> None:
+    """Extract selected members of a zip archive in parallel.
+
+    Args:
+        adress: Archive adress (path or remote URL) through `fsspec`.
+        dir_dest: Destination directory.
+        selector: Member name filter. Unselected members are not read at all.
+        n_workers: Number of parallel extraction threads (decompression releases GIL).
+    """
+
+    with fsspec.open(adress, "rb") as f, zipfile.ZipFile(f) as archive:
+        names = [info.filename for info in archive.infolist() if not info.is_dir() and selector(info.filename)]
+    # Directories are made beforehand, because concurrent `makedirs` in `ZipFile.extract` races.
+    for parent in set(Path(name).parent for name in names):
+        (dir_dest / parent).mkdir(parents=True, exist_ok=True)
+    # Interleaved chunks, which balance large/small members among workers (8 chunks per worker for progress report).
+    n_chunk = min(len(names), n_workers * 8)
+    chunks: Iterable[List[str]] = [names[i::n_chunk] for i in range(n_chunk)]
+    with tqdm(total=len(names), desc="Extracting") as pbar, ThreadPoolExecutor(n_workers) as executor:
+        for n_done in executor.map(lambda chunk: _extract_chunk(adress, chunk, dir_dest), chunks):
+            pbar.update(n_done)
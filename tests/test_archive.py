@@ -0,0 +1,98 @@
+"""Dataset archive round-trip against the fsspec memory filesystem."""
+
+import json
+import uuid
+
+import fsspec
+import pytest
+
+from jsss.archive import (acquire_dataset_archive, is_contents_complete, read_archive_manifest, save_dataset_archive,
+    select_subtypes, validate_compression, write_manifest)
+
+
+_files = {
+    "short-form/basic5000/wave.bin": b"\x01" * 1000,
+    "short-form/basic5000/wave.index.json": b'{"items": {}}',
+    "short-form/voiceactress100/wave.bin": b"\x02" * 300,
+    "short-form/voiceactress100/wave.index.json": b'{"items": {}}',
+}
+
+
+@pytest.fixture
+def contents(tmp_path):
+    dir_contents = tmp_path / "contents"
+    for name, data in _files.items():
+        (dir_contents / name).parent.mkdir(parents=True, exist_ok=True)
+        (dir_contents / name).write_bytes(data)
+    return dir_contents
+
+
+def _adress() -> str:
+    return f"memory://archive-{uuid.uuid4().hex}"
+
+
+def test_write_manifest(contents):
+    manifest = write_manifest(contents, "zlib")
+    assert manifest["compression"] == "zlib"
+    assert manifest["files"] == {name: {"size": len(data)} for name, data in _files.items()}
+    with open(contents / "manifest.json") as f:
+        assert json.load(f) == manifest
+
+
+@pytest.mark.parametrize("compression", ["none", "zlib", "zstd"])
+def test_round_trip(contents, tmp_path, compression):
+    if compression == "zstd":
+        pytest.importorskip("zstandard")
+    adress = _adress()
+    save_dataset_archive(contents, adress, compression)
+    manifest = read_archive_manifest(adress)
+    assert manifest is not None and sorted(manifest["files"]) == sorted(_files)
+
+    # Partial fetch: only the selected subtype
+    dir_fetched = tmp_path / "fetched"
+    assert acquire_dataset_archive(adress, dir_fetched, select_subtypes(["short-form/voiceactress100"]))
+    fetched = sorted(p.relative_to(dir_fetched).as_posix() for p in dir_fetched.rglob("*") if p.is_file())
+    assert fetched == ["manifest.json", "short-form/voiceactress100/wave.bin", "short-form/voiceactress100/wave.index.json"]
+    assert not is_contents_complete(dir_fetched)
+
+    # Fetch of the rest, then everything equals the source
+    assert acquire_dataset_archive(adress, dir_fetched)
+    assert is_contents_complete(dir_fetched)
+    for name, data in _files.items():
+        assert (dir_fetched / name).read_bytes() == data
+
+
+def test_uncompressed_keeps_layout(contents):
+    adress = _adress()
+    save_dataset_archive(contents, adress, "none")
+    with fsspec.open(f"{adress}/short-form/basic5000/wave.bin", "rb") as f:
+        assert f.read() == _files["short-form/basic5000/wave.bin"]
+
+
+def test_select_subtypes_with_variant_prefix():
+    selector = select_subtypes(["short-form/basic5000"], "sr16000/")
+    assert selector("sr16000/short-form/basic5000/wave.bin")
+    assert not selector("sr24000/short-form/basic5000/wave.bin")
+    assert not selector("short-form/basic5000/wave.bin")
+
+
+def test_missing_or_incomplete_archive(contents, tmp_path):
+    adress = _adress()
+    assert read_archive_manifest(adress) is None
+    assert not acquire_dataset_archive(adress, tmp_path / "fetched")
+    # Files without manifest (interrupted upload) are not an archive.
+    fs = fsspec.filesystem("memory")
+    fs.pipe(f"{adress[len('memory://'):]}/short-form/basic5000/wave.bin", b"\x01")
+    assert not acquire_dataset_archive(adress, tmp_path / "fetched")
+
+
+def test_local_contents_are_reused_without_archive(contents):
+    write_manifest(contents)
+    assert acquire_dataset_archive(_adress(), contents)
+
+
+def test_unknown_compression(contents):
+    with pytest.raises(ValueError):
+        validate_compression("gzip")
+    with pytest.raises(ValueError):
+        write_manifest(contents, "zst")
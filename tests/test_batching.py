@@ -0,0 +1,94 @@
+"""Length-bucketed batching and padded collation."""
+
+from typing import NamedTuple
+
+import pytest
+import torch
+
+from jsss.PyTorch.dataset.batching import LengthBucketBatchSampler, collate_pad
+from jsss.PyTorch.dataset.preprocess import batch_by_length
+
+
+_lengths = [(i * 7919) % 500 + 10 for i in range(103)]
+
+
+def _flatten(batches):
+    return [i for batch in batches for i in batch]
+
+
+@pytest.mark.parametrize("shuffle", [True, False])
+def test_fixed_size(shuffle):
+    sampler = LengthBucketBatchSampler(_lengths, batch_size=8, shuffle=shuffle)
+    batches = list(sampler)
+    assert sorted(_flatten(batches)) == list(range(len(_lengths)))
+    assert len(batches) == len(sampler) == 13
+    assert all(len(batch) == 8 for batch in batches if len(batch) != 103 % 8)
+    # Bucketed: a batch spans a narrow length range of the sorted lengths.
+    sorted_lengths = sorted(_lengths)
+    for batch in batches:
+        lo, hi = min(_lengths[i] for i in batch), max(_lengths[i] for i in batch)
+        assert sorted_lengths.index(hi) - sorted_lengths.index(lo) < 8 + _lengths.count(lo)
+
+
+def test_drop_last():
+    batches = list(LengthBucketBatchSampler(_lengths, batch_size=8, drop_last=True))
+    assert len(batches) == 12 and all(len(batch) == 8 for batch in batches)
+
+
+def test_max_frames():
+    batches = list(LengthBucketBatchSampler(_lengths, max_frames=2000))
+    assert sorted(_flatten(batches)) == list(range(len(_lengths)))
+    for batch in batches:
+        assert len(batch) == 1 or max(_lengths[i] for i in batch) * len(batch) <= 2000
+
+
+def test_batch_by_length():
+    batches = batch_by_length(_lengths, max_items=4, max_samples=2000)
+    assert sorted(_flatten(batches)) == list(range(len(_lengths)))
+    assert _flatten(batches) == sorted(range(len(_lengths)), key=lambda i: _lengths[i])
+    for batch in batches:
+        assert len(batch) <= 4
+        assert len(batch) == 1 or max(_lengths[i] for i in batch) * len(batch) <= 2000
+
+
+def test_epochs():
+    sampler = LengthBucketBatchSampler(_lengths, batch_size=8, seed=1)
+    first, second = list(sampler), list(sampler)
+    assert first != second
+    sampler.set_epoch(0)
+    assert list(sampler) == first
+    assert list(LengthBucketBatchSampler(_lengths, batch_size=8, seed=1)) == first
+
+
+@pytest.mark.parametrize("num_replicas", [2, 3])
+def test_replicas(num_replicas):
+    replicas = [list(LengthBucketBatchSampler(_lengths, batch_size=8, num_replicas=num_replicas, rank=rank))
+        for rank in range(num_replicas)]
+    # Same number of steps, and every item is covered (wrap-around padding may repeat some).
+    assert len({len(batches) for batches in replicas}) == 1
+    assert set(_flatten(_flatten(replicas))) == set(range(len(_lengths)))
+
+
+class _Datum(NamedTuple):
+    wave: torch.Tensor
+    spec: torch.Tensor
+    label: str
+
+
+def test_collate_pad():
+    data = [_Datum(torch.ones(5), torch.ones(3, 2), "a"), _Datum(torch.ones(8), torch.ones(3, 4), "b")]
+    batch = collate_pad(data)
+    assert batch.data.wave.shape == (2, 8) and batch.data.spec.shape == (2, 3, 4)
+    assert batch.data.label == ["a", "b"]
+    assert batch.lengths["wave"].tolist() == [5, 8] and batch.lengths["spec"].tolist() == [2, 4]
+    assert batch.masks["wave"].sum(dim=1).tolist() == [5, 8]
+    assert batch.data.wave[0, 5:].sum() == 0 and batch.data.spec[0, :, 2:].sum() == 0
+
+
+def test_invalid_arguments():
+    with pytest.raises(ValueError):
+        LengthBucketBatchSampler(_lengths)
+    with pytest.raises(ValueError):
+        LengthBucketBatchSampler(_lengths, batch_size=8, max_frames=2000)
+    with pytest.raises(ValueError):
+        LengthBucketBatchSampler(_lengths, batch_size=8, num_replicas=2, rank=2)
@@ -0,0 +1,70 @@
+"""RAM cache tier and its hit accounting."""
+
+import torch
+from torch.utils.data import DataLoader, Dataset
+
+from jsss.PyTorch.dataset.cache import LRUCache, SharedCache
+
+
+def _loader(value: int, n: int = 100):
+    calls = []
+    def load():
+        calls.append(value)
+        return torch.full((n,), float(value))
+    return load, calls
+
+
+def test_lru_hits_and_eviction():
+    # float32 x 100 = 400 bytes, so 2 items fit.
+    cache = LRUCache(max_bytes=900)
+    load_0, calls_0 = _loader(0)
+    load_1, _ = _loader(1)
+    load_2, _ = _loader(2)
+    assert cache.get("a", load_0).sum() == 0
+    assert cache.get("a", load_0).sum() == 0
+    cache.get("b", load_1)
+    cache.get("a", load_0)
+    # "b" is the least recently used, so it is evicted.
+    cache.get("c", load_2)
+    assert len(calls_0) == 1
+    assert cache.stats() == (2, 3, 2, 800)
+    load_1_again, calls_1 = _loader(1)
+    cache.get("b", load_1_again)
+    assert calls_1 == [1] and cache.stats().misses == 4
+
+    # Item larger than the budget is loaded, but not cached.
+    load_big, calls_big = _loader(3, 1000)
+    cache.get("big", load_big)
+    cache.get("big", load_big)
+    assert calls_big == [3, 3] and cache.stats().n_items == 2
+
+
+def test_shared_hits_and_misses():
+    cache = SharedCache()
+    cache.preload(["a", "b"], lambda key: torch.arange(6, dtype=torch.int16).reshape(2, 3) if key == "a" else torch.ones(4))
+    load, calls = _loader(0)
+    assert cache.get("a", load).tolist() == [[0, 1, 2], [3, 4, 5]]
+    assert cache.get("b", load).tolist() == [1.0] * 4
+    cache.get("c", load)
+    assert calls == [0]
+    assert cache.stats() == (2, 1, 2, 6 * 2 + 4 * 4)
+
+
+class _Cached(Dataset):
+    def __init__(self, cache):
+        self.cache = cache
+
+    def __len__(self):
+        return 12
+
+    def __getitem__(self, i):
+        # Even items read the key 0, odd items the key 1.
+        return self.cache.get(i % 2, lambda: torch.zeros(1))
+
+
+def test_hits_aggregated_over_workers():
+    cache = SharedCache()
+    cache.preload([0], lambda key: torch.zeros(1))
+    list(DataLoader(_Cached(cache), batch_size=2, num_workers=2, multiprocessing_context="fork"))
+    # Key 0 hits (preloaded) and key 1 misses (not preloaded), counted in both workers.
+    assert cache.stats()[:2] == (6, 6)
@@ -0,0 +1,82 @@
+"""Array-backed corpus index."""
+
+import io
+import wave
+import zipfile
+
+import numpy as np
+import pytest
+
+from jsss.corpus import CorpusIndex, ItemIdJSSS, JSSS, subtypes
+
+
+_subtype = "short-form/voiceactress100"
+
+
+def _wav(n_sample: int, sr: int = 24000) -> bytes:
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(sr)
+        w.writeframes(np.zeros(n_sample, dtype="<i2").tobytes())
+    return buffer.getvalue()
+
+
+def _index() -> CorpusIndex:
+    ids = [ItemIdJSSS(_subtype, 1), ItemIdJSSS("simplification", 2), ItemIdJSSS(_subtype, 3)]
+    index = CorpusIndex.from_identities(ids)
+    index.num_samples[:2], index.sample_rates[:2] = [48000, 12000], [24000, 24000]
+    return index
+
+
+def test_select_and_rows():
+    index = _index()
+    assert index.select([_subtype]).tolist() == [0, 2]
+    assert index.select(["simplification", "long-form/udon"]).tolist() == [1]
+    assert index.get_ids(index.select([_subtype])) == [ItemIdJSSS(_subtype, 1), ItemIdJSSS(_subtype, 3)]
+    assert index.get_row(ItemIdJSSS(_subtype, 3)) == 2
+
+
+def test_durations():
+    durations = _index().get_durations()
+    assert durations[:2].tolist() == [2.0, 0.5] and np.isnan(durations[2])
+    assert _index().get_durations(np.array([1])).tolist() == [0.5]
+
+
+def test_save_load(tmp_path):
+    index = _index()
+    index.save(tmp_path / "sub" / "index.npz")
+    loaded = CorpusIndex.load(tmp_path / "sub" / "index.npz")
+    for field in ["subtype_codes", "serial_nums", "num_samples", "sample_rates"]:
+        assert np.array_equal(getattr(loaded, field), getattr(index, field))
+
+    # Codes of another subtype definition are not reinterpreted.
+    with open(tmp_path / "stale.npz", "wb") as f:
+        np.savez(f, subtypes=np.array(subtypes[::-1]), subtype_codes=index.subtype_codes, serial_nums=index.serial_nums,
+            num_samples=index.num_samples, sample_rates=index.sample_rates)
+    with pytest.raises(ValueError):
+        CorpusIndex.load(tmp_path / "stale.npz")
+
+
+def test_get_index_from_headers(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    corpus = JSSS(str(tmp_path / "corpus.zip"))
+    ids = [id for id in corpus.get_identities() if id.subtype == _subtype]
+    with zipfile.ZipFile(tmp_path / "corpus.zip", "w") as archive:
+        for id in ids:
+            archive.writestr(corpus.get_item_member(id), _wav(100 * id.serial_num))
+    corpus.get_contents([_subtype])
+
+    index = corpus.get_index()
+    rows = index.select([_subtype])
+    assert index.num_samples[rows].tolist() == [100 * id.serial_num for id in ids]
+    assert (index.sample_rates[rows] == 24000).all()
+    # Not extracted items are unknown.
+    assert (index.num_samples[index.select(["simplification"])] == -1).all()
+
+    # Persisted, so headers are not read again.
+    for id in ids:
+        corpus.get_item_path(id).unlink()
+    reloaded = JSSS(str(tmp_path / "corpus.zip")).get_index()
+    assert np.array_equal(reloaded.num_samples, index.num_samples)
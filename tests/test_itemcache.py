@@ -0,0 +1,44 @@
+"""Per-item build cache."""
+
+import shutil
+
+from jsss.corpus import ItemIdJSSS
+from jsss.PyTorch.dataset.itemcache import ItemCache
+from jsss.PyTorch.dataset.stages import stage_spec, stage_wave
+
+
+_ids = [ItemIdJSSS("short-form/basic5000", num) for num in range(1, 6)]
+
+
+def test_keyed_on_config(tmp_path):
+    assert ItemCache(tmp_path, resample_sr=16000).dir == ItemCache(tmp_path, resample_sr=16000).dir
+    assert ItemCache(tmp_path, resample_sr=16000).dir != ItemCache(tmp_path, resample_sr=None).dir
+
+
+def test_reuse(tmp_path):
+    cache = ItemCache(tmp_path, resample_sr=None)
+    assert cache.missing(_ids, [stage_wave]) == _ids
+
+    # Item file of an interrupted build (not committed) is reused.
+    path = stage_wave.get_path(cache.dir, _ids[0])
+    path.parent.mkdir(parents=True)
+    path.write_bytes(b"")
+    assert cache.missing(_ids, [stage_wave]) == _ids[1:]
+
+    # Committed items are reused by another builder without item files, per stage.
+    cache.commit(_ids[1:3], [stage_wave])
+    ItemCache(tmp_path, resample_sr=None).commit(_ids[3:4], [stage_wave, stage_spec])
+    reloaded = ItemCache(tmp_path, resample_sr=None)
+    assert reloaded.missing(_ids, [stage_wave]) == _ids[4:]
+    assert reloaded.missing(_ids, [stage_wave, stage_spec]) == _ids[:3] + _ids[4:]
+    # Other configs do not share items.
+    assert ItemCache(tmp_path, resample_sr=16000).missing(_ids, [stage_wave]) == _ids
+
+
+def test_invalidation(tmp_path):
+    cache = ItemCache(tmp_path, resample_sr=None)
+    cache.commit(_ids, [stage_wave])
+    assert ItemCache(tmp_path, resample_sr=None).missing(_ids, [stage_wave]) == []
+    # The cache can be deleted as a whole, then all items are built again.
+    shutil.rmtree(cache.dir)
+    assert ItemCache(tmp_path, resample_sr=None).missing(_ids, [stage_wave]) == _ids
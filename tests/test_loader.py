@@ -0,0 +1,30 @@
+"""DataLoader knobs and autotuning."""
+
+from torch.utils.data import DataLoader
+
+from jsss.PyTorch.dataset.loader import LoaderConfig, autotune, default_candidates, loader_kwargs, probe
+
+
+def test_default_candidates():
+    candidates = default_candidates()
+    assert candidates[0].num_workers == 0
+    with_workers = candidates[1:]
+    # Prefetch depths and persistence are tuned for each worker count, cheapest first.
+    assert {config.prefetch_factor for config in with_workers} == {2, 4, 8}
+    assert {config.persistent_workers for config in with_workers} == {False, True}
+    keys = [(config.num_workers, config.prefetch_factor, config.persistent_workers) for config in candidates]
+    assert keys == sorted(keys) and len(set(keys)) == len(keys)
+
+
+def test_loader_kwargs():
+    assert loader_kwargs(LoaderConfig(0, prefetch_factor=8)) == {"num_workers": 0, "pin_memory": False}
+    kwargs = loader_kwargs(LoaderConfig(2, prefetch_factor=8, persistent_workers=True))
+    assert kwargs["prefetch_factor"] == 8 and kwargs["persistent_workers"]
+
+
+def test_autotune():
+    make_loader = lambda config: DataLoader(list(range(64)), batch_size=4, **loader_kwargs(config))
+    assert probe(make_loader(LoaderConfig())) > 0
+    # Tie within tolerance is resolved to the earliest (cheapest) candidate.
+    candidates = [LoaderConfig(0), LoaderConfig(0, prefetch_factor=4)]
+    assert autotune(make_loader, candidates, n_batch=4, tolerance=1.0) == candidates[0]
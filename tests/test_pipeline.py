@@ -0,0 +1,46 @@
+"""Spectrogram computation paths (range, batched) against per-item full STFT."""
+
+import pytest
+import torch
+
+from jsss.PyTorch.dataset.pipeline import SpecConfig, compute_feature, compute_feature_range, to_spectrogram, to_spectrograms
+
+
+_configs = [SpecConfig(), SpecConfig(512, 128), SpecConfig(400, 160, 40)]
+
+
+def _waveform(length: int) -> torch.Tensor:
+    return torch.rand(length, generator=torch.Generator().manual_seed(length)) * 2 - 1
+
+
+@pytest.mark.parametrize("config", _configs)
+@pytest.mark.parametrize("n_hop, remainder", [(40, 0), (40, 1), (40, -1), (3, 0), (12, 5)])
+@pytest.mark.parametrize("n_frame", [1, 7])
+def test_compute_feature_range(config, n_hop, remainder, n_frame):
+    n_sample = n_hop * config.hop + remainder
+    if n_sample <= config.n_fft // 2:
+        pytest.skip("Too short for reflection padding (also in full STFT).")
+    waveform = _waveform(n_sample)
+    whole = compute_feature(waveform, config, 16000)
+    read = lambda start_sample, length: waveform[start_sample : start_sample + length]
+    for start in range(whole.size(-1)):
+        segment = compute_feature_range(read, n_sample, start, n_frame, config, 16000)
+        assert torch.allclose(segment, whole[:, start : start + n_frame], rtol=1e-5, atol=1e-6), f"start {start}"
+
+
+def test_compute_feature_range_last_frame():
+    # n_sample % hop == 0, the last frame only
+    config = SpecConfig()
+    waveform = _waveform(5080)
+    read = lambda start_sample, length: waveform[start_sample : start_sample + length]
+    segment = compute_feature_range(read, 5080, 40, 1, config, 24000)
+    assert torch.allclose(segment, compute_feature(waveform, config, 24000)[:, 40:41], rtol=1e-5, atol=1e-6)
+
+
+@pytest.mark.parametrize("n_fft", [254, 512])
+def test_to_spectrograms_bit_identical(n_fft):
+    # Mixed lengths, including the shortest STFT-able one and hop-aligned ones
+    lengths = [n_fft // 2 + 1, 1000, 1001, 127 * 40, 3333, 8000]
+    waveforms = [_waveform(length) for length in lengths]
+    for waveform, spec in zip(waveforms, to_spectrograms(waveforms, n_fft)):
+        assert torch.equal(spec, to_spectrogram(waveform, n_fft))
@@ -0,0 +1,38 @@
+"""Parallel preprocessing runner."""
+
+from pathlib import Path
+
+import pytest
+
+from jsss.PyTorch.dataset.preprocess import preprocess_items
+
+
+def _write_square(dir_out: Path, num: int) -> None:
+    if num == 13:
+        raise ValueError("broken item")
+    (dir_out / f"{num}.txt").write_text(str(num * num))
+
+
+def _outputs(dir_out: Path):
+    return {path.name: path.read_text() for path in dir_out.iterdir()}
+
+
+@pytest.mark.parametrize("n_workers", [2, 3])
+def test_serial_and_parallel_results_match(tmp_path, n_workers):
+    (tmp_path / "serial").mkdir()
+    (tmp_path / "parallel").mkdir()
+    nums = [num for num in range(40) if num != 13]
+    preprocess_items(_write_square, [(tmp_path / "serial", num) for num in nums], n_workers=1)
+    preprocess_items(_write_square, [(tmp_path / "parallel", num) for num in nums], n_workers=n_workers, chunksize=3)
+    assert _outputs(tmp_path / "serial") == _outputs(tmp_path / "parallel")
+    assert len(_outputs(tmp_path / "serial")) == len(nums)
+
+
+@pytest.mark.parametrize("n_workers", [1, 2])
+def test_failure_reported(tmp_path, n_workers):
+    items = [(tmp_path, num) for num in range(20)]
+    with pytest.raises(RuntimeError) as info:
+        preprocess_items(_write_square, items, n_workers=n_workers)
+    # Failed item and its traceback are reported.
+    message = str(info.value)
+    assert f"{items[13]}" in message and "ValueError: broken item" in message
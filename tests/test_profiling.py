@@ -0,0 +1,50 @@
+"""Instrumentation records, aggregated over processes."""
+
+import multiprocessing
+
+import pytest
+
+from jsss import profiling
+
+
+@pytest.fixture
+def dir_out(tmp_path):
+    profiling.reset()
+    profiling.enable(tmp_path / "prof")
+    yield tmp_path / "prof"
+    # No output directory: nothing is written at exit into the removed temporary directory.
+    profiling.enable(None)
+    profiling.disable()
+    profiling.reset()
+
+
+def _work() -> None:
+    with profiling.span("decode", 100) as span:
+        span.add_bytes(20)
+    profiling.count("cache.hit", 3)
+
+
+def test_span_and_count(dir_out):
+    assert profiling.is_enabled()
+    _work()
+    stats = profiling.summary()
+    assert stats["decode"].count == 1 and stats["decode"].n_bytes == 120 and stats["decode"].sec >= 0
+    assert stats["cache.hit"].count == 3 and stats["cache.hit"].sec == 0
+    assert "decode" in profiling.format_summary(stats)
+
+
+def test_collect_over_processes(dir_out):
+    _work()
+    processes = [multiprocessing.get_context("fork").Process(target=_work) for _ in range(2)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    stats = profiling.collect(dir_out)
+    assert stats["decode"].count == 3 and stats["cache.hit"].count == 9
+
+
+def test_disabled():
+    assert not profiling.is_enabled()
+    _work()
+    assert profiling.summary() == {}
@@ -0,0 +1,159 @@
+"""Shard packing and reading round-trips over storage formats, local and remote."""
+
+import pickle
+import uuid
+
+import fsspec
+import numpy as np
+import pytest
+import torch
+from torch.utils.data import DataLoader, Dataset
+
+from jsss.corpus import ItemIdJSSS
+from jsss.PyTorch.dataset.shard import RemoteShardReader, ShardReader, Storage, load_moments, open_shard, pack_shards
+from jsss.PyTorch.dataset.stages import stage_spec, stage_wave
+
+
+_ids = [ItemIdJSSS("short-form/basic5000", num) for num in [3, 1, 2]] + [ItemIdJSSS("short-form/voiceactress100", 1)]
+
+
+def _features(stage):
+    generator = torch.Generator().manual_seed(0)
+    features = {}
+    for i, id in enumerate(_ids):
+        length = 500 + 37 * i
+        if stage is stage_wave:
+            features[id] = torch.rand(length, generator=generator) * 2 - 1
+        else:
+            features[id] = torch.rand(128, length // 10, generator=generator) ** 4 * 100
+    return features
+
+
+def _pack(tmp_path, stage, storage):
+    features = _features(stage)
+    for id, feature in features.items():
+        path = stage.get_path(tmp_path / "items", id)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        torch.save(feature, path)
+    pack_shards(tmp_path / "items", tmp_path / "dataset", _ids, stage, storage)
+    return features
+
+
+@pytest.mark.parametrize("stage, storage, atol, rtol", [
+    (stage_wave, Storage(), 0, 0),
+    (stage_wave, Storage(compression="zlib"), 0, 0),
+    (stage_wave, Storage("float16"), 1e-3, 0),
+    (stage_wave, Storage("int16", compression="zlib"), 1 / 32768, 0),
+    (stage_spec, Storage(), 0, 0),
+    (stage_spec, Storage("float32", log=True), 1e-9, 1e-5),
+    (stage_spec, Storage("float16", log=True, compression="zlib"), 1e-9, 2e-2),
+])
+def test_round_trip(tmp_path, stage, storage, atol, rtol):
+    features = _pack(tmp_path, stage, storage)
+    readers = {subtype: ShardReader(tmp_path / "dataset", subtype, stage.name) for subtype in {id.subtype for id in _ids}}
+    for id, feature in features.items():
+        reader = readers[id.subtype]
+        assert reader.length(id.serial_num) == feature.size(-1)
+        item = reader.get(id.serial_num)
+        assert item.dtype == torch.float32 and item.shape == feature.shape
+        assert torch.allclose(item, feature, atol=atol, rtol=rtol)
+        # Time range, clipped at the item end
+        assert torch.equal(reader.get(id.serial_num, 5, 20), item[..., 5:25])
+        assert torch.equal(reader.get(id.serial_num, feature.size(-1) - 3, 20), item[..., -3:])
+    # Pickled reader (DataLoader worker) maps the shard by itself.
+    id = _ids[0]
+    assert torch.equal(pickle.loads(pickle.dumps(readers[id.subtype])).get(id.serial_num), readers[id.subtype].get(id.serial_num))
+
+
+def test_read_does_not_modify_shard(tmp_path):
+    features = _pack(tmp_path, stage_wave, Storage())
+    id = _ids[0]
+    ShardReader(tmp_path / "dataset", id.subtype, stage_wave.name).get(id.serial_num).zero_()
+    assert torch.equal(ShardReader(tmp_path / "dataset", id.subtype, stage_wave.name).get(id.serial_num), features[id])
+
+
+@pytest.mark.parametrize("stage", [stage_wave, stage_spec])
+def test_moments_are_saved_with_shard(tmp_path, stage):
+    features = _pack(tmp_path, stage, Storage())
+    moments = load_moments(tmp_path / "dataset", "short-form/basic5000", stage.name)
+    assert list(moments.serial_nums) == [3, 1, 2]
+    assert (moments.log_mean is None) == (stage is stage_wave)
+    for row, num in enumerate(moments.serial_nums):
+        feature = features[ItemIdJSSS("short-form/basic5000", int(num))].double()
+        assert moments.n_steps[row] == feature.size(-1)
+        assert np.allclose(moments.mean[row], feature.mean(dim=-1).numpy())
+
+
+def test_invalid_storage(tmp_path):
+    with pytest.raises(ValueError):
+        _pack(tmp_path, stage_spec, Storage("int16"))
+    with pytest.raises(ValueError):
+        _pack(tmp_path, stage_wave, Storage(compression="gzip"))
+
+
+def test_moments_fallback_scans_shard(tmp_path):
+    # Contents packed without moments (older builds)
+    _pack(tmp_path, stage_wave, Storage())
+    reader = ShardReader(tmp_path / "dataset", "short-form/basic5000", stage_wave.name)
+    assert reader.serial_nums() == [3, 1, 2]
+    saved = load_moments(tmp_path / "dataset", "short-form/basic5000", stage_wave.name)
+    (tmp_path / "dataset" / "short-form/basic5000" / "wave.stats.npz").unlink()
+    scanned = load_moments(tmp_path / "dataset", "short-form/basic5000", stage_wave.name)
+    assert list(scanned.serial_nums) == [3, 1, 2]
+    assert np.allclose(scanned.mean, saved.mean) and np.allclose(scanned.m2, saved.m2)
+
+
+def _upload(tmp_path, adress: str) -> None:
+    fs, path = fsspec.core.url_to_fs(adress)
+    for file in (tmp_path / "dataset").rglob("*"):
+        if file.is_file():
+            name = file.relative_to(tmp_path / "dataset").as_posix()
+            fs.makedirs(f"{path}/{name}".rsplit("/", 1)[0], exist_ok=True)
+            fs.pipe(f"{path}/{name}", file.read_bytes())
+
+
+@pytest.fixture(params=["memory", "file"])
+def remote_root(request, tmp_path):
+    if request.param == "memory":
+        return f"memory://remote-{uuid.uuid4().hex}"
+    return f"file://{tmp_path / 'remote'}"
+
+
+@pytest.mark.parametrize("storage", [Storage(), Storage("int16", compression="zlib")])
+def test_remote_reads(tmp_path, remote_root, storage):
+    _pack(tmp_path, stage_wave, storage)
+    _upload(tmp_path, remote_root)
+    for subtype in {id.subtype for id in _ids}:
+        local = ShardReader(tmp_path / "dataset", subtype, stage_wave.name)
+        remote = open_shard(remote_root, subtype, stage_wave.name)
+        assert isinstance(remote, RemoteShardReader)
+        assert remote.serial_nums() == local.serial_nums()
+        for num in local.serial_nums():
+            assert remote.length(num) == local.length(num)
+            assert torch.equal(remote.get(num), local.get(num))
+            assert torch.equal(remote.get(num, 7, 50), local.get(num, 7, 50))
+            assert torch.equal(remote.get(num, local.length(num) - 2, 50), local.get(num)[..., -2:])
+        # Pickled reader resolves its own filesystem.
+        assert torch.equal(pickle.loads(pickle.dumps(remote)).get(local.serial_nums()[0]), local.get(local.serial_nums()[0]))
+        assert np.array_equal(load_moments(remote_root, subtype, stage_wave.name).mean,
+            load_moments(tmp_path / "dataset", subtype, stage_wave.name).mean)
+
+
+class _RemoteItems(Dataset):
+    def __init__(self, root: str):
+        self._reader = open_shard(root, "short-form/basic5000", stage_wave.name)
+
+    def __getitem__(self, n: int) -> torch.Tensor:
+        return self._reader.get(self._reader.serial_nums()[n])
+
+    def __len__(self) -> int:
+        return len(self._reader.serial_nums())
+
+
+def test_remote_reads_in_workers(tmp_path):
+    _pack(tmp_path, stage_wave, Storage())
+    root = f"file://{tmp_path / 'remote'}"
+    _upload(tmp_path, root)
+    dataset = _RemoteItems(root)
+    loader = DataLoader(dataset, batch_size=None, num_workers=2, multiprocessing_context="fork")
+    assert all(torch.equal(item, dataset[i]) for i, item in enumerate(loader))
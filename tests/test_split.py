@@ -0,0 +1,71 @@
+"""Seeded, subtype-stratified split."""
+
+import numpy as np
+
+from jsss.corpus import CorpusIndex, _get_identity_index
+from jsss.split import Split, get_split, split_rows
+
+
+_subtypes = ["short-form/basic5000", "short-form/voiceactress100", "simplification"]
+
+
+def _index_rows():
+    index: CorpusIndex = _get_identity_index()
+    return index, index.select(_subtypes)
+
+
+def test_seed_determinism():
+    index, rows = _index_rows()
+    split = split_rows(index, rows, seed=3)
+    again = split_rows(index, rows, seed=3)
+    other = split_rows(index, rows, seed=4)
+    assert all(np.array_equal(a, b) for a, b in zip(split, again))
+    assert not np.array_equal(split.val, other.val)
+    # Disjoint, and covers all items.
+    assert np.array_equal(np.sort(np.concatenate(split)), np.arange(len(rows)))
+
+
+def test_stratified_per_subtype():
+    index, rows = _index_rows()
+    ratios = (0.8, 0.1, 0.1)
+    split = split_rows(index, rows, ratios, seed=0)
+    codes = index.subtype_codes[rows]
+    for code in np.unique(codes):
+        n_subtype = int((codes == code).sum())
+        for positions, ratio in zip(split, ratios):
+            assert abs(int((codes[positions] == code).sum()) - n_subtype * ratio) <= 1
+
+    # Adding a subtype does not change the split of others.
+    rows_sub = index.select(_subtypes[:1])
+    split_sub = split_rows(index, rows_sub, ratios, seed=0)
+    positions_sub = np.flatnonzero(codes == index.subtype_codes[rows_sub[0]])
+    assert np.array_equal(positions_sub[split_sub.val], np.intersect1d(split.val, positions_sub))
+
+
+def test_save_load(tmp_path):
+    index, rows = _index_rows()
+    split = split_rows(index, rows)
+    path = tmp_path / "sub" / "split.npz"
+    split.save(path, rows)
+    loaded = Split.load(path)
+    assert all(np.array_equal(a, b) for a, b in zip(split, loaded))
+
+
+def test_get_split_rejects_stale(tmp_path):
+    index, rows = _index_rows()
+    path = tmp_path / "split.npz"
+    split = get_split(path, index, rows, seed=1)
+    # Reused as is for the same items, even with another seed.
+    reused = get_split(path, index, rows, seed=2)
+    assert all(np.array_equal(a, b) for a, b in zip(split, reused))
+
+    # Stale for other items: split again and overwritten.
+    rows_sub = index.select(_subtypes[:2])
+    resplit = get_split(path, index, rows_sub, seed=1)
+    assert np.array_equal(np.sort(np.concatenate(resplit)), np.arange(len(rows_sub)))
+    with np.load(path) as arrays:
+        assert np.array_equal(arrays["rows"], rows_sub)
+
+    # Split without rows (e.g. saved by hand) is not trusted.
+    Split(*split).save(path)
+    assert all(np.array_equal(a, b) for a, b in zip(get_split(path, index, rows_sub, seed=1), resplit))
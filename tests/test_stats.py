@@ -0,0 +1,81 @@
+"""Per-item moments merge against two-pass statistics."""
+
+import numpy as np
+import pytest
+import torch
+
+from jsss.corpus import ItemIdJSSS
+from jsss.PyTorch.dataset.stats import (ItemMoments, MomentsAccumulator, get_normalizer, merge_item_stats, normalize,
+    _log_eps)
+
+
+def _items(n: int = 6, signed: bool = False):
+    generator = torch.Generator().manual_seed(n)
+    # Time-major [Time, Feat], including an empty item
+    items = [torch.rand(length, 4, generator=generator) * 10 for length in [50, 0, 7, 123, 1, 64][:n]]
+    return [item * 2 - 10 for item in items] if signed else items
+
+
+def _accumulate(items, log: bool = True) -> ItemMoments:
+    accumulator = MomentsAccumulator(log)
+    for num, item in enumerate(items):
+        accumulator.add(num, item)
+    return accumulator.result()
+
+
+def test_merge_against_two_pass():
+    items = _items()
+    stats = _accumulate(items).merge()
+    whole = torch.cat(items).double()
+    log_whole = torch.log(torch.clamp(whole, min=_log_eps))
+    assert stats.n_steps == whole.size(0)
+    assert np.allclose(stats.mean, whole.mean(dim=0).numpy(), rtol=1e-12)
+    assert np.allclose(stats.var, whole.var(dim=0, unbiased=False).numpy(), rtol=1e-10)
+    assert np.allclose(stats.log_mean, log_whole.mean(dim=0).numpy(), rtol=1e-12)
+    assert np.allclose(stats.log_var, log_whole.var(dim=0, unbiased=False).numpy(), rtol=1e-10)
+    assert stats.lengths.tolist() == [item.size(0) for item in items]
+
+
+def test_merge_subset_and_save(tmp_path):
+    items = _items()
+    moments = _accumulate(items)
+    path = str(tmp_path / "stats.npz")
+    moments.save(path)
+    loaded = ItemMoments.load(path)
+    assert loaded.mean.dtype == np.float64 and loaded.m2.dtype == np.float64
+    stats = loaded.merge(loaded.rows([3, 0]))
+    whole = torch.cat([items[3], items[0]]).double()
+    assert np.allclose(stats.var, whole.var(dim=0, unbiased=False).numpy(), rtol=1e-10)
+
+
+def test_signed_feature_has_no_log_moments(tmp_path):
+    moments = _accumulate(_items(signed=True), log=False)
+    assert moments.log_mean is None and moments.log_m2 is None
+    path = str(tmp_path / "stats.npz")
+    moments.save(path)
+    stats = ItemMoments.load(path).merge()
+    assert stats.log_mean is None and stats.log_std is None
+    with pytest.raises(ValueError):
+        get_normalizer(stats, "log")
+
+
+def test_merge_item_stats_over_subtypes():
+    items = {"a": _items(4), "b": _items(6)}
+    moments = {subtype: _accumulate(subtype_items) for subtype, subtype_items in items.items()}
+    ids = [ItemIdJSSS("b", 5), ItemIdJSSS("a", 2), ItemIdJSSS("b", 0)]
+    stats = merge_item_stats(ids, moments.__getitem__)
+    whole = torch.cat([items[id.subtype][id.serial_num] for id in ids]).double()
+    assert np.allclose(stats.mean, whole.mean(dim=0).numpy(), rtol=1e-12)
+    with pytest.raises(ValueError):
+        merge_item_stats([], moments.__getitem__)
+
+
+@pytest.mark.parametrize("mode", ["linear", "log"])
+def test_normalize(mode):
+    items = _items()
+    stats = _accumulate(items).merge()
+    # [Feat, Time]
+    feature = torch.cat(items).T.contiguous()
+    normalized = normalize(feature, *get_normalizer(stats, mode))
+    assert torch.allclose(normalized.mean(dim=-1), torch.zeros(4), atol=1e-4)
+    assert torch.allclose(normalized.std(dim=-1, unbiased=False), torch.ones(4), atol=1e-4)
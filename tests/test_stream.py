@@ -0,0 +1,75 @@
+"""Streaming datasets over a synthetic corpus archive."""
+
+import io
+import random
+import wave
+import zipfile
+
+import numpy as np
+import pytest
+from torch.utils.data import DataLoader
+
+from jsss.corpus import JSSS
+from jsss.PyTorch.dataset.stream import JSSS_wave_stream, shuffle_buffer
+
+
+_subtype = "short-form/voiceactress100"
+
+
+def _wav(n_sample: int) -> bytes:
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(24000)
+        w.writeframes(np.arange(n_sample, dtype="<i2").tobytes())
+    return buffer.getvalue()
+
+
+@pytest.fixture(scope="module")
+def corpus_adress(tmp_path_factory):
+    path = tmp_path_factory.mktemp("corpus") / "corpus.zip"
+    corpus = JSSS()
+    with zipfile.ZipFile(path, "w") as archive:
+        for id in filter(lambda id: id.subtype == _subtype, corpus.get_identities()):
+            archive.writestr(corpus.get_item_member(id), _wav(100 + id.serial_num))
+    return str(path)
+
+
+def _expected():
+    return [f"{id.subtype}-{id.serial_num}" for id in JSSS().get_identities() if id.subtype == _subtype]
+
+
+def _labels(data):
+    return [datum.label for datum in data]
+
+
+def test_shuffle_buffer():
+    items = list(range(100))
+    shuffled = list(shuffle_buffer(items, 16, random.Random(0)))
+    assert sorted(shuffled) == items and shuffled != items
+    assert list(shuffle_buffer(items, 1, random.Random(0))) == items
+
+
+def test_stream_coverage_and_epochs(corpus_adress):
+    ordered = JSSS_wave_stream(None, [_subtype], corpus_adress=corpus_adress)
+    labels = _labels(ordered)
+    assert labels == _expected()
+    datum = next(iter(ordered))
+    assert datum.waveform.shape == (101,)
+
+    stream = JSSS_wave_stream(None, [_subtype], corpus_adress=corpus_adress, shuffle_buffer_size=16, seed=1)
+    first, second = _labels(stream), _labels(stream)
+    # Every item exactly once, and reshuffled in next epoch without `set_epoch`.
+    assert sorted(first) == sorted(labels) and first != labels
+    assert sorted(second) == sorted(labels) and second != first
+    stream.set_epoch(0)
+    assert _labels(stream) == first
+
+
+@pytest.mark.parametrize("num_workers", [2, 3])
+def test_stream_worker_sharding(corpus_adress, num_workers):
+    stream = JSSS_wave_stream(None, [_subtype], corpus_adress=corpus_adress, shuffle_buffer_size=8)
+    loader = DataLoader(stream, batch_size=None, num_workers=num_workers, multiprocessing_context="fork")
+    # Every item exactly once over workers.
+    assert sorted(_labels(loader)) == sorted(_expected())
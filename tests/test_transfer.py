@@ -0,0 +1,136 @@
+"""Ranged download against a local HTTP stand-in (`http.server` with Range support)."""
+
+from typing import List
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import hashlib
+import threading
+
+import pytest
+
+from jsss.transfer import download_ranged, zip_magic, _get_parts_dir
+
+
+_content = bytes(range(256)) * 4000
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # Set by the fixture
+    ranges: List[str] = []
+    support_range = True
+    ignore_part_range = False
+    content = _content
+    content_type = "application/zip"
+
+    def do_GET(self):
+        header = self.headers.get("Range")
+        self.ranges.append(header)
+        is_probe = header == "bytes=0-0"
+        if header is None or not self.support_range or (self.ignore_part_range and not is_probe):
+            self._send(200, self.content)
+            return
+        start, end = header[len("bytes="):].split("-")
+        start, end = int(start), min(int(end), len(self.content) - 1)
+        self._send(206, self.content[start : end + 1], {"Content-Range": f"bytes {start}-{end}/{len(self.content)}"})
+
+    def _send(self, status, body, headers={}):
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Content-Type", self.content_type)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    _Handler.ranges, _Handler.support_range, _Handler.ignore_part_range = [], True, False
+    _Handler.content, _Handler.content_type = _content, "application/zip"
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}/archive.zip", _Handler
+    httpd.shutdown()
+
+
+def _parts_dir(url, tmp_path):
+    path = _get_parts_dir(tmp_path / "parts", url, len(_content), 100_000)
+    path.mkdir(parents=True)
+    return path
+
+
+def _download(url, tmp_path, **kwargs):
+    path = tmp_path / "out" / "archive.zip"
+    download_ranged(url, str(path), tmp_path / "parts", n_workers=4, chunk_size=100_000, **kwargs)
+    return path.read_bytes()
+
+
+def test_parallel_ranged(server, tmp_path):
+    url, handler = server
+    assert _download(url, tmp_path, sha256=hashlib.sha256(_content).hexdigest()) == _content
+    # probe + 11 parts
+    assert len(handler.ranges) == 1 + 11
+    assert not (tmp_path / "parts").exists()
+
+
+def test_resume(server, tmp_path):
+    url, handler = server
+    dir_parts = _parts_dir(url, tmp_path)
+    (dir_parts / "0.part").write_bytes(_content[:100_000])
+    (dir_parts / "1.part").write_bytes(_content[100_000:130_000])
+    assert _download(url, tmp_path) == _content
+    assert "bytes=130000-199999" in handler.ranges
+    assert not any(r is not None and r.startswith("bytes=0-99999") for r in handler.ranges)
+
+
+def test_parts_of_other_download_not_resumed(server, tmp_path):
+    url, handler = server
+    # Parts of another URL (and of the same URL with another chunking) are left in the parts directory.
+    for dir_other in [_get_parts_dir(tmp_path / "parts", url + "?v=1", len(_content), 100_000),
+            _get_parts_dir(tmp_path / "parts", url, len(_content), 50_000)]:
+        dir_other.mkdir(parents=True)
+        (dir_other / "0.part").write_bytes(b"x" * 100_000)
+    assert _download(url, tmp_path) == _content
+    assert "bytes=0-99999" in handler.ranges
+
+
+def test_range_ignored_falls_back_to_single_stream(server, tmp_path):
+    url, handler = server
+    handler.ignore_part_range = True
+    (_parts_dir(url, tmp_path) / "1.part").write_bytes(_content[100_000:130_000])
+    assert _download(url, tmp_path) == _content
+
+
+def test_no_range_support(server, tmp_path):
+    url, handler = server
+    handler.support_range = False
+    assert _download(url, tmp_path) == _content
+
+
+def test_checksum_mismatch(server, tmp_path):
+    url, _ = server
+    with pytest.raises(RuntimeError):
+        _download(url, tmp_path, sha256="0" * 64)
+    assert not (tmp_path / "out" / "archive.zip").exists()
+
+
+@pytest.mark.parametrize("support_range", [True, False])
+def test_html_page_rejected(server, tmp_path, support_range):
+    url, handler = server
+    handler.support_range = support_range
+    handler.content_type = "text/html; charset=utf-8"
+    with pytest.raises(RuntimeError, match="HTML"):
+        _download(url, tmp_path)
+    assert not (tmp_path / "out" / "archive.zip").exists()
+
+
+def test_magic_mismatch(server, tmp_path):
+    url, handler = server
+    with pytest.raises(RuntimeError):
+        _download(url, tmp_path, magic=zip_magic)
+    assert not (tmp_path / "out" / "archive.zip").exists()
+    handler.content = zip_magic + _content[len(zip_magic):]
+    assert _download(url, tmp_path, magic=zip_magic) == handler.content
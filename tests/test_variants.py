@@ -0,0 +1,66 @@
+"""Multi-variant builds with single decode."""
+
+import io
+import wave
+import zipfile
+
+import numpy as np
+import pytest
+import torch
+
+from jsss import profiling
+from jsss.corpus import JSSS
+from jsss.PyTorch.dataset.pipeline import SpecConfig, load_waveform
+from jsss.PyTorch.dataset.shard import open_shard
+from jsss.PyTorch.dataset.variants import Variants, build_variants, get_variant_dir
+
+
+_subtype = "short-form/voiceactress100"
+
+
+def _wav(n_sample: int, rng: np.random.Generator) -> bytes:
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(24000)
+        w.writeframes(rng.integers(-3000, 3000, n_sample).astype("<i2").tobytes())
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def corpus(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    corpus = JSSS(str(tmp_path / "corpus.zip"))
+    rng = np.random.default_rng(0)
+    with zipfile.ZipFile(tmp_path / "corpus.zip", "w") as archive:
+        for id in filter(lambda id: id.subtype == _subtype, corpus.get_identities()):
+            archive.writestr(corpus.get_item_member(id), _wav(int(rng.integers(500, 3000)), rng))
+    profiling.enable()
+    yield corpus
+    profiling.disable()
+    profiling.reset()
+
+
+def test_build_variants(corpus, tmp_path):
+    ids = [id for id in corpus.get_identities() if id.subtype == _subtype][:6]
+    mel = SpecConfig(256, 64, 20)
+    variants = Variants((None, 16000), (SpecConfig(), mel))
+    build_variants(corpus, ids, variants, tmp_path / "contents")
+    # Each source wav is decoded once for all variants.
+    assert profiling.summary()["decode"].count == len(ids)
+
+    for sr in variants.resample_srs:
+        root = get_variant_dir(tmp_path / "contents", sr)
+        # Same features as per-item computation of the sampling rate.
+        for id in ids:
+            waveform = load_waveform(corpus.get_item_path(id), sr)
+            for stage in variants.get_stages(sr):
+                expected = stage.compute(waveform)
+                assert torch.allclose(open_shard(root, _subtype, stage.name).get(id.serial_num), expected, atol=1e-6)
+
+    # Items are cached, so rebuild does not decode again.
+    profiling.reset()
+    build_variants(corpus, ids, variants, tmp_path / "contents2")
+    assert "decode" not in profiling.summary()
+    assert (get_variant_dir(tmp_path / "contents2", 16000) / _subtype / f"{mel.name}.bin").exists()